@@ -0,0 +1,168 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# 当前线程所属比对的资源统计，线程池中的任务需要重新设置
+_current_tracker = contextvars.ContextVar('cost_tracker', default=None)
+
+
+class CostTracker:
+    """
+    一次比对的资源消耗统计
+
+    记录Face++调用数（按接口，包括换密钥重试和对冲请求）、上传字节数、重试和对冲次数、缓存命中、
+    各阶段耗时、线程池中的线程占用时间和CPU时间，以及比对经过的处理路径
+    （pil_fallback、token_generation、multi_key、fanout、degraded、timeout），比对结束后保存为 ComparisonCost。
+    """
+
+    # 处理路径：比对经过的、会额外消耗Face++额度或时间的分支
+    PIL_FALLBACK = 'pil_fallback'
+    TOKEN_GENERATION = 'token_generation'
+    MULTI_KEY = 'multi_key'
+    FANOUT = 'fanout'
+    DEGRADED = 'degraded'
+    TIMEOUT = 'timeout'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls_by_endpoint = {}
+        self.bytes_uploaded = 0
+        self.retries = 0
+        self.hedges = 0
+        self.cache_hits = 0
+        self.stage_seconds = {}
+        self.worker_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.paths = set()
+
+    @staticmethod
+    def current():
+        """当前线程所属比对的统计，不在比对中时为None"""
+        return _current_tracker.get()
+
+    @contextmanager
+    def activate(self, measure_cpu=False):
+        """
+        在代码块内把调用记入本次比对
+
+        参数:
+            measure_cpu (bool): 是否把代码块中当前线程的CPU时间计入统计
+        """
+        token = _current_tracker.set(self)
+        cpu_started = time.thread_time() if measure_cpu else None
+        try:
+            yield self
+        finally:
+            if cpu_started is not None:
+                self.add_cpu_time(time.thread_time() - cpu_started)
+            _current_tracker.reset(token)
+
+    def record_call(self, endpoint, upload_bytes, retry=False):
+        """记录一次发出的Face++ HTTP请求"""
+        with self._lock:
+            self.calls_by_endpoint[endpoint] = self.calls_by_endpoint.get(endpoint, 0) + 1
+            self.bytes_uploaded += upload_bytes
+            if retry:
+                self.retries += 1
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def record_cache_hit(self):
+        with self._lock:
+            self.cache_hits += 1
+
+    def add_stage_time(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    def add_worker_time(self, seconds):
+        """线程池中的线程处理任务的时间"""
+        with self._lock:
+            self.worker_seconds += seconds
+
+    def add_cpu_time(self, seconds):
+        with self._lock:
+            self.cpu_seconds += seconds
+
+    def mark_path(self, path):
+        with self._lock:
+            self.paths.add(path)
+
+    @property
+    def facepp_calls(self):
+        with self._lock:
+            return sum(self.calls_by_endpoint.values())
+
+    def as_fields(self, wall_seconds):
+        """ComparisonCost 的字段值"""
+        with self._lock:
+            return {
+                'facepp_calls': sum(self.calls_by_endpoint.values()),
+                'calls_by_endpoint': dict(self.calls_by_endpoint),
+                'bytes_uploaded': self.bytes_uploaded,
+                'retries': self.retries,
+                'hedges': self.hedges,
+                'cache_hits': self.cache_hits,
+                'stage_seconds': {stage: round(seconds, 4) for stage, seconds in self.stage_seconds.items()},
+                'wall_seconds': round(wall_seconds, 4),
+                'worker_seconds': round(self.worker_seconds, 4),
+                'cpu_seconds': round(self.cpu_seconds, 4),
+                'path': '+'.join(sorted(self.paths)) or 'none',
+            }
+
+
+def record_facepp_call(endpoint, data, files=None, retry=False):
+    """在当前比对的统计中记录一次Face++请求（上传字节数按表单字段和文件内容估算）"""
+    tracker = _current_tracker.get()
+    if tracker is None:
+        return
+    upload_bytes = sum(len(str(value)) for value in data.values())
+    for file_value in (files or {}).values():
+        content = file_value[1] if isinstance(file_value, tuple) else file_value
+        if isinstance(content, (bytes, bytearray)):
+            upload_bytes += len(content)
+    tracker.record_call(endpoint, upload_bytes, retry=retry)
+
+
+def summarize_costs(queryset):
+    """
+    按处理路径汇总资源消耗
+
+    参数:
+        queryset: ComparisonCost 查询集
+
+    返回:
+        dict: total 为所有比对的合计，paths 为各处理路径的合计和平均值（按Face++调用数降序）
+    """
+    groups = {}
+    fields = ('path', 'facepp_calls', 'calls_by_endpoint', 'bytes_uploaded', 'retries', 'hedges', 'cache_hits',
+              'wall_seconds', 'worker_seconds', 'cpu_seconds')
+    for row in queryset.values(*fields).iterator():
+        for key in ('all', row['path']):
+            group = groups.setdefault(key, {
+                'comparisons': 0, 'facepp_calls': 0, 'calls_by_endpoint': {}, 'bytes_uploaded': 0, 'retries': 0,
+                'hedges': 0, 'cache_hits': 0, 'wall_seconds': 0.0, 'worker_seconds': 0.0, 'cpu_seconds': 0.0,
+            })
+            group['comparisons'] += 1
+            for name in ('facepp_calls', 'bytes_uploaded', 'retries', 'hedges', 'cache_hits',
+                         'wall_seconds', 'worker_seconds', 'cpu_seconds'):
+                group[name] += row[name] or 0
+            for endpoint, calls in (row['calls_by_endpoint'] or {}).items():
+                group['calls_by_endpoint'][endpoint] = group['calls_by_endpoint'].get(endpoint, 0) + calls
+
+    def finish(group):
+        count = group['comparisons']
+        for name in ('wall_seconds', 'worker_seconds', 'cpu_seconds'):
+            group[name] = round(group[name], 2)
+        group['avg_facepp_calls'] = round(group['facepp_calls'] / count, 1)
+        group['avg_wall_seconds'] = round(group['wall_seconds'] / count, 2)
+        group['avg_bytes_uploaded'] = int(group['bytes_uploaded'] / count)
+        return group
+
+    total = groups.pop('all', None)
+    paths = [dict(finish(group), path=path) for path, group in groups.items()]
+    paths.sort(key=lambda group: group['facepp_calls'], reverse=True)
+    return {'total': finish(total) if total else None, 'paths': paths}
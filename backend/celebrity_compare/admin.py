@@ -1,13 +1,19 @@
 from django.contrib import admin
+from django.http import HttpResponse, Http404
+from django.urls import path, reverse
 from django.utils.html import format_html
-from .models import Celebrity, ComparisonResult, ComparisonDetail
+from .models import Celebrity, ComparisonResult, ComparisonDetail, ComparisonCost, ProfilingConfig
+from .thumbnails import ThumbnailService
+from .media_delivery import MediaDelivery
+from .profiling import SamplingProfiler
+from .accounting import summarize_costs
 
 @admin.register(Celebrity)
 class CelebrityAdmin(admin.ModelAdmin):
     list_display = ('name', 'nationality', 'occupation', 'birth_date', 'source', 'show_photo', 'created_at')
     search_fields = ('name', 'nationality', 'occupation', 'description', 'works')
     list_filter = ('nationality', 'occupation', 'source', 'created_at')
-    readonly_fields = ('created_at', 'updated_at', 'show_photo_large')
+    readonly_fields = ('created_at', 'updated_at', 'photo_hash', 'face_token_key', 'show_photo_large')
     fieldsets = (
         ('基本信息', {
             'fields': ('name', 'photo', 'show_photo_large', 'description')
@@ -16,13 +22,17 @@ class CelebrityAdmin(admin.ModelAdmin):
             'fields': ('nationality', 'occupation', 'birth_date', 'works')
         }),
         ('技术信息', {
-            'fields': ('source', 'detail_url', 'face_token', 'created_at', 'updated_at')
+            'fields': ('source', 'detail_url', 'face_token', 'face_token_key', 'photo_hash', 'created_at', 'updated_at')
         }),
     )
     
     def show_photo(self, obj):
         """在列表中显示缩略图"""
         if obj.photo:
+            # 优先使用缩略图，避免列表页加载原图；缩略图尚未生成时提交到进程池，本次使用原图
+            thumbnail_url = ThumbnailService.get_thumbnail_url(obj.photo, 'small', generate=False)
+            if thumbnail_url:
+                return format_html('<img src="{}" width="50" height="50" style="object-fit: cover;" />', thumbnail_url)
             # 检查是否为外部URL
             if str(obj.photo).startswith(('http://', 'https://')):
                 return format_html('<img src="{}" width="50" height="50" style="object-fit: cover;" />', str(obj.photo))
@@ -34,6 +44,9 @@ class CelebrityAdmin(admin.ModelAdmin):
     def show_photo_large(self, obj):
         """在详情页中显示大图"""
         if obj.photo:
+            thumbnail_url = ThumbnailService.get_thumbnail_url(obj.photo, 'medium', generate=False)
+            if thumbnail_url:
+                return format_html('<img src="{}" width="200" />', thumbnail_url)
             # 检查是否为外部URL
             if str(obj.photo).startswith(('http://', 'https://')):
                 return format_html('<img src="{}" width="200" />', str(obj.photo))
@@ -46,7 +59,8 @@ class CelebrityAdmin(admin.ModelAdmin):
 class ComparisonResultAdmin(admin.ModelAdmin):
     list_display = ('id_short', 'show_user_photo', 'created_at', 'session_id_short', 'processing_status', 'progress', 'is_public')
     list_filter = ('processing_status', 'created_at', 'is_public')
-    readonly_fields = ('id', 'created_at', 'session_id', 'face_token', 'show_user_photo_large')
+    readonly_fields = ('id', 'created_at', 'session_id', 'face_token', 'content_hash', 'idempotency_key',
+                       'show_user_photo_large', 'profile_download')
     search_fields = ('session_id', 'id', 'message', 'share_code')
     fieldsets = (
         ('基本信息', {
@@ -59,10 +73,35 @@ class ComparisonResultAdmin(admin.ModelAdmin):
             'fields': ('is_public', 'share_code')
         }),
         ('技术信息', {
-            'fields': ('session_id', 'face_token')
+            'fields': ('session_id', 'face_token', 'content_hash', 'idempotency_key', 'profile_download')
         }),
     )
     
+    def get_urls(self):
+        urls = [
+            path('<path:object_id>/profile/', self.admin_site.admin_view(self.download_profile),
+                 name='celebrity_compare_comparisonresult_profile'),
+        ]
+        return urls + super().get_urls()
+    
+    def download_profile(self, request, object_id):
+        """下载折叠调用栈格式的采样分析（flamegraph.pl、speedscope可直接打开）"""
+        comparison = self.get_object(request, object_id)
+        if comparison is None or not comparison.profile or not self.has_view_permission(request, comparison):
+            raise Http404('该比对没有采样分析')
+        response = HttpResponse(comparison.profile, content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="comparison-{comparison.id}.folded"'
+        return response
+    
+    def profile_download(self, obj):
+        """采样分析下载链接"""
+        if not obj.profile:
+            return "未开启"
+        url = reverse('admin:celebrity_compare_comparisonresult_profile', args=[obj.pk])
+        samples = sum(int(line.rsplit(' ', 1)[1]) for line in obj.profile.splitlines() if line)
+        return format_html('<a href="{}">下载火焰图数据</a>（{} 个样本）', url, samples)
+    profile_download.short_description = '采样分析'
+    
     def id_short(self, obj):
         """显示ID的前8位"""
         return str(obj.id)[:8] + '...'
@@ -78,14 +117,16 @@ class ComparisonResultAdmin(admin.ModelAdmin):
     def show_user_photo(self, obj):
         """在列表中显示用户照片缩略图"""
         if obj.user_photo:
-            return format_html('<img src="{}" width="50" height="50" style="object-fit: cover;" />', obj.user_photo.url)
+            photo_url = ThumbnailService.get_thumbnail_url(obj.user_photo, 'small', generate=False) or MediaDelivery.get_default().url(obj.user_photo.name)
+            return format_html('<img src="{}" width="50" height="50" style="object-fit: cover;" />', photo_url)
         return "无照片"
     show_user_photo.short_description = '用户照片'
     
     def show_user_photo_large(self, obj):
         """在详情页中显示大图"""
         if obj.user_photo:
-            return format_html('<img src="{}" width="200" />', obj.user_photo.url)
+            photo_url = ThumbnailService.get_thumbnail_url(obj.user_photo, 'medium', generate=False) or MediaDelivery.get_default().url(obj.user_photo.name)
+            return format_html('<img src="{}" width="200" />', photo_url)
         return "无照片"
     show_user_photo_large.short_description = '照片预览'
     
@@ -96,6 +137,7 @@ class ComparisonResultAdmin(admin.ModelAdmin):
 @admin.register(ComparisonDetail)
 class ComparisonDetailAdmin(admin.ModelAdmin):
     list_display = ('id', 'comparison_id', 'celebrity_name', 'similarity_percent')
+    list_select_related = ('celebrity',)
     list_filter = ('similarity',)
     search_fields = ('comparison__id', 'celebrity__name')
     readonly_fields = ('comparison', 'celebrity', 'similarity')
@@ -106,7 +148,7 @@ class ComparisonDetailAdmin(admin.ModelAdmin):
     
     def comparison_id(self, obj):
         """显示比对结果ID的前8位"""
-        return str(obj.comparison.id)[:8] + '...'
+        return str(obj.comparison_id)[:8] + '...'
     comparison_id.short_description = '比对结果ID'
     
     def celebrity_name(self, obj):
@@ -122,3 +164,41 @@ class ComparisonDetailAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         """禁止手动添加比对详情"""
         return False
+
+@admin.register(ComparisonCost)
+class ComparisonCostAdmin(admin.ModelAdmin):
+    list_display = ('comparison_id_short', 'created_at', 'path', 'facepp_calls', 'retries', 'hedges', 'cache_hits',
+                    'bytes_uploaded', 'wall_seconds', 'worker_seconds', 'cpu_seconds')
+    list_filter = ('path', 'created_at')
+    search_fields = ('comparison__id',)
+    readonly_fields = [field.name for field in ComparisonCost._meta.fields]
+    
+    def changelist_view(self, request, extra_context=None):
+        """列表上方显示当前筛选条件下按处理路径的汇总"""
+        response = super().changelist_view(request, extra_context)
+        if hasattr(response, 'context_data') and 'cl' in response.context_data:
+            response.context_data['cost_summary'] = summarize_costs(response.context_data['cl'].queryset)
+        return response
+    
+    def comparison_id_short(self, obj):
+        """显示比对结果ID的前8位"""
+        return str(obj.comparison_id)[:8] + '...'
+    comparison_id_short.short_description = '比对结果ID'
+    
+    def has_add_permission(self, request):
+        """资源消耗由比对自动记录"""
+        return False
+
+@admin.register(ProfilingConfig)
+class ProfilingConfigAdmin(admin.ModelAdmin):
+    list_display = ('id', 'sample_rate', 'profile_next', 'updated_at')
+    readonly_fields = ('updated_at',)
+    
+    def has_add_permission(self, request):
+        """只使用一条设置记录"""
+        return not ProfilingConfig.objects.exists()
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # 立即生效，不等待缓存过期
+        SamplingProfiler.invalidate_admin_config()
@@ -0,0 +1,204 @@
+import math
+import time
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """比对任务未被接纳（排队已满或会话超出限制）"""
+
+    def __init__(self, message, retry_after, queued):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+        self.queued = queued
+
+
+class AdmissionTicket:
+    """一个比对任务的准入凭证"""
+
+    def __init__(self, job_id, session_id):
+        self.job_id = str(job_id)
+        self.session_id = session_id
+        self.enqueued_at = time.monotonic()
+        self.admitted_at = None
+        self.admitted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """
+    比对任务准入控制
+
+    - 全局最多 MAX_IN_FLIGHT 个比对同时运行，超出的进入容量为 MAX_QUEUE 的先进先出等待队列
+    - 同一会话最多 MAX_PER_SESSION 个比对（运行中和排队中合计）
+    - 队列已满时拒绝，并根据近期比对耗时的指数移动平均估算建议的重试时间
+
+    计数保存在进程内存中，限制针对单个服务进程。
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, max_in_flight=4, max_per_session=2, max_queue=16, queue_timeout=120,
+                 initial_duration=10.0):
+        self.max_in_flight = max_in_flight
+        self.max_per_session = max_per_session
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._in_flight = {}
+        self._sessions = {}
+        # 比对耗时的指数移动平均（秒），用于估算Retry-After
+        self._avg_duration = initial_duration
+        self.rejected = 0
+
+    @staticmethod
+    def get_config():
+        """获取准入控制配置"""
+        config = getattr(settings, 'COMPARISON_ADMISSION', {})
+        return {
+            'max_in_flight': config.get('MAX_IN_FLIGHT', 4),
+            'max_per_session': config.get('MAX_PER_SESSION', 2),
+            'max_queue': config.get('MAX_QUEUE', 16),
+            'queue_timeout': config.get('QUEUE_TIMEOUT', 120),
+        }
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的准入控制器"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls(**cls.get_config())
+        return cls._default
+
+    def _estimate_retry_after(self, queued):
+        """估算排在第 queued 位之后的任务需要等待的秒数"""
+        rounds = (queued + 1) / max(self.max_in_flight, 1)
+        return max(1, int(math.ceil(rounds * self._avg_duration)))
+
+    def reserve(self, job_id, session_id=None):
+        """
+        登记一个比对任务，有空闲名额时直接接纳，否则进入等待队列
+
+        返回:
+            AdmissionTicket: 准入凭证，需要在后台线程中调用 wait() 等待接纳
+
+        异常:
+            AdmissionRejected: 会话超出限制或等待队列已满
+        """
+        with self._condition:
+            if session_id and self._sessions.get(session_id, 0) >= self.max_per_session:
+                self.rejected += 1
+                raise AdmissionRejected(
+                    f'您已有 {self.max_per_session} 个比对正在处理，请稍后再试',
+                    self._estimate_retry_after(len(self._queue)), len(self._queue)
+                )
+
+            ticket = AdmissionTicket(job_id, session_id)
+            if len(self._in_flight) < self.max_in_flight and not self._queue:
+                self._admit(ticket)
+            elif len(self._queue) < self.max_queue:
+                self._queue.append(ticket)
+            else:
+                self.rejected += 1
+                raise AdmissionRejected(
+                    '当前比对请求过多，请稍后再试',
+                    self._estimate_retry_after(len(self._queue)), len(self._queue)
+                )
+
+            if session_id:
+                self._sessions[session_id] = self._sessions.get(session_id, 0) + 1
+            return ticket
+
+    def _admit(self, ticket):
+        ticket.admitted = True
+        ticket.admitted_at = time.monotonic()
+        self._in_flight[ticket.job_id] = ticket
+
+    def _admit_waiting(self):
+        """按先进先出顺序接纳等待中的任务"""
+        while self._queue and len(self._in_flight) < self.max_in_flight:
+            self._admit(self._queue.popleft())
+        self._condition.notify_all()
+
+    def wait(self, ticket, timeout=None):
+        """
+        等待任务被接纳
+
+        返回:
+            bool: 是否被接纳，超时返回False（任务同时被移出队列）
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not ticket.admitted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._cancel(ticket)
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def _cancel(self, ticket):
+        if ticket.cancelled:
+            return
+        ticket.cancelled = True
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+        self._release_session(ticket)
+
+    def _release_session(self, ticket):
+        if ticket.session_id:
+            count = self._sessions.get(ticket.session_id, 0) - 1
+            if count > 0:
+                self._sessions[ticket.session_id] = count
+            else:
+                self._sessions.pop(ticket.session_id, None)
+
+    def release(self, ticket):
+        """任务结束（无论成功与否），释放名额并接纳下一个等待中的任务"""
+        with self._condition:
+            if ticket.cancelled:
+                return
+            if self._in_flight.pop(ticket.job_id, None) is not None:
+                duration = time.monotonic() - ticket.admitted_at
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+            elif ticket in self._queue:
+                self._queue.remove(ticket)
+            ticket.cancelled = True
+            self._release_session(ticket)
+            self._admit_waiting()
+
+    def position(self, job_id):
+        """
+        任务在等待队列中的位置（从1开始）
+
+        返回:
+            int 或 None: 不在队列中（已接纳或不存在）时返回None
+        """
+        job_id = str(job_id)
+        with self._condition:
+            for index, ticket in enumerate(self._queue):
+                if ticket.job_id == job_id:
+                    return index + 1
+        return None
+
+    def stats(self):
+        """当前运行中、排队中的任务数等统计"""
+        with self._condition:
+            return {
+                'in_flight': len(self._in_flight),
+                'queued': len(self._queue),
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'max_per_session': self.max_per_session,
+                'rejected': self.rejected,
+                'avg_duration': round(self._avg_duration, 2),
+            }
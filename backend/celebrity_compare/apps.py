@@ -1,7 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CelebrityCompareConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'celebrity_compare'
     verbose_name = '名人相似度比对'
+
+    def ready(self):
+        # 注册比对结果渲染缓存的清除信号
+        from . import signals  # noqa: F401
+        # 创建明星搜索的FTS5索引（SQLite），迁移重建明星表后重新创建触发器
+        from .search import ensure_search_index
+        post_migrate.connect(ensure_search_index, sender=self, dispatch_uid='celebrity_search_index')
@@ -0,0 +1,219 @@
+import os
+import re
+import json
+import logging
+import threading
+from .models import Celebrity
+from .photo_mirror import PhotoMirror
+from .signals import invalidate_celebrity_results
+
+logger = logging.getLogger(__name__)
+
+# 已存在的明星只补充这些缺失的字段
+FILLABLE_FIELDS = ['face_token', 'face_token_key', 'photo_hash', 'nationality', 'occupation', 'birth_date', 'works', 'detail_url', 'source']
+
+
+def validate_date_format(date_str):
+    """验证日期格式是否符合YYYY-MM-DD，不符合则返回None"""
+    if not date_str:
+        return None
+
+    # 检查特殊值
+    if date_str in ['未知', '保密']:
+        return None
+
+    # 检查只有年份的情况
+    if re.match(r'^\d{4}$', date_str):
+        return f"{date_str}-01-01"  # 如果只有年份，添加月和日
+
+    # 检查常见日期格式
+    date_formats = [
+        r'^\d{4}-\d{1,2}-\d{1,2}$',  # YYYY-MM-DD
+        r'^\d{4}/\d{1,2}/\d{1,2}$',  # YYYY/MM/DD
+        r'^\d{4}年\d{1,2}月\d{1,2}日$',  # YYYY年MM月DD日
+    ]
+
+    for date_format in date_formats:
+        if re.match(date_format, date_str):
+            # 转换为标准格式
+            parts = re.findall(r'\d+', date_str)
+            if len(parts) >= 3:
+                year, month, day = parts[0], parts[1], parts[2]
+                # 确保月和日是两位数
+                month = month.zfill(2)
+                day = day.zfill(2)
+                return f"{year}-{month}-{day}"
+
+    # 如果都不符合，返回None
+    logger.warning(f"日期格式不正确: {date_str}")
+    return None
+
+
+def celebrity_fields_from_record(record, source_name=None):
+    """
+    将爬虫/导出的明星记录转换为Celebrity模型字段
+
+    支持爬虫格式（国籍、职业、出生日期在raw_data中）和扁平格式（直接使用模型字段名）。
+    """
+    raw_data = record.get('raw_data') or {}
+    photo_url = record.get('photo_url') or record.get('photo') or ''
+    return {
+        'name': record['name'],
+        'photo': photo_url,
+        'photo_hash': record.get('photo_hash') or PhotoMirror.hash_for_url(photo_url),
+        'face_token': record.get('face_token') or None,
+        'face_token_key': record.get('face_token_key') or None,
+        'description': record.get('description', ''),
+        'nationality': record.get('nationality') or raw_data.get('国籍'),
+        'occupation': record.get('occupation') or raw_data.get('职业'),
+        'birth_date': validate_date_format(record.get('birth_date') or raw_data.get('出生日期')),
+        'works': record.get('works') or None,
+        'detail_url': record.get('detail_url'),
+        'source': record.get('source') or source_name,
+    }
+
+
+def bulk_upsert_celebrities(records, source_name=None, batch_size=500, max_create=None):
+    """
+    批量写入明星：不存在的批量创建，已存在的只补充缺失字段后批量更新
+
+    参数:
+        records (list): 明星记录
+        source_name (str, 可选): 数据源名称，记录中没有source时使用
+        batch_size (int): 每批写入的行数
+        max_create (int, 可选): 最多创建的新明星数，超出的记录不处理
+
+    返回:
+        dict: created（新建的记录）、updated（更新的记录）、skipped（因max_create未处理的记录），
+              以及 rows（已处理记录对应的 id、name、photo、face_token）
+    """
+    # 批内按姓名去重，保留第一条
+    unique_records = {}
+    for record in records:
+        if record.get('name') and record['name'] not in unique_records:
+            unique_records[record['name']] = record
+
+    names = list(unique_records)
+    existing = {}
+    for start in range(0, len(names), batch_size):
+        for celebrity in Celebrity.objects.filter(name__in=names[start:start + batch_size]):
+            existing.setdefault(celebrity.name, celebrity)
+
+    to_create = []
+    to_update = []
+    created_records = []
+    updated_records = []
+    skipped_records = []
+    skipped_names = set()
+    for name, record in unique_records.items():
+        fields = celebrity_fields_from_record(record, source_name)
+        celebrity = existing.get(name)
+        if celebrity is None:
+            if max_create is not None and len(to_create) >= max_create:
+                skipped_records.append(record)
+                skipped_names.add(name)
+                continue
+            to_create.append(Celebrity(**fields))
+            created_records.append(record)
+            continue
+
+        changed = False
+        for field in FILLABLE_FIELDS:
+            if not getattr(celebrity, field) and fields[field]:
+                setattr(celebrity, field, fields[field])
+                changed = True
+        if changed:
+            to_update.append(celebrity)
+            updated_records.append(record)
+
+    if to_create:
+        Celebrity.objects.bulk_create(to_create, batch_size=batch_size)
+    if to_update:
+        Celebrity.objects.bulk_update(to_update, FILLABLE_FIELDS, batch_size=batch_size)
+        # bulk_update 不触发信号，显式清除展示这些明星的比对结果缓存
+        invalidate_celebrity_results([celebrity.id for celebrity in to_update])
+
+    processed_names = [name for name in unique_records if name not in skipped_names]
+    rows = []
+    for start in range(0, len(processed_names), batch_size):
+        rows.extend(
+            Celebrity.objects.filter(name__in=processed_names[start:start + batch_size])
+            .values('id', 'name', 'photo', 'face_token')
+        )
+
+    return {
+        'created': created_records,
+        'updated': updated_records,
+        'skipped': skipped_records,
+        'rows': rows,
+    }
+
+
+def iter_jsonl(path):
+    """逐行读取JSONL文件（常量内存），跳过格式错误的行"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"{path} 第 {line_number} 行不是有效的JSON，已跳过")
+
+
+class CelebrityJsonlWriter:
+    """
+    明星数据JSONL输出（只追加）
+
+    打开时逐行读取已有文件建立内存中的姓名索引，之后每条记录只追加一行，
+    不再重写整个文件。旧版的JSON数组文件会在首次打开时转换为JSONL。
+    """
+
+    def __init__(self, path, legacy_json_path=None):
+        self.path = path
+        self.names = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path) and legacy_json_path and os.path.exists(legacy_json_path):
+            self._convert_legacy(legacy_json_path)
+
+        if os.path.exists(path):
+            for record in iter_jsonl(path):
+                if record.get('name'):
+                    self.names.add(record['name'])
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _convert_legacy(self, legacy_json_path):
+        """将旧版JSON数组文件转换为JSONL"""
+        try:
+            with open(legacy_json_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            logger.error(f"读取旧版JSON文件 {legacy_json_path} 失败: {str(e)}")
+            return
+        with open(self.path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        logger.info(f"已将 {legacy_json_path} 转换为 {self.path}")
+
+    def append(self, record):
+        """
+        追加一条记录，同名明星已存在时跳过
+
+        返回:
+            bool: 是否写入
+        """
+        with self._lock:
+            if record['name'] in self.names:
+                return False
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            self.names.add(record['name'])
+            return True
+
+    def close(self):
+        with self._lock:
+            self._file.close()
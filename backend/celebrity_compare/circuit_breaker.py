@@ -0,0 +1,166 @@
+import time
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Face++ 调用熔断器
+
+    - closed: 正常放行，按最近 WINDOW 次调用统计失败率和慢调用比例
+    - open: 失败率或慢调用比例超过阈值后打开，OPEN_SECONDS 内所有调用立即失败，不再占用线程等待超时
+    - half_open: 打开时间结束后放行最多 HALF_OPEN_PROBES 个探测调用，全部成功则关闭，任一失败则重新打开
+
+    失败指网络异常、超时和服务端5xx错误；“未检测到人脸”等业务错误不计入失败。
+    clock 为返回秒数的单调时钟（测试时可以替换）。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, window=50, min_calls=10, failure_rate=0.5, slow_call_seconds=5.0, slow_call_rate=0.8,
+                 open_seconds=30.0, half_open_probes=3, clock=time.monotonic):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+        self._lock = threading.Lock()
+        # 最近调用的结果 (是否失败, 是否慢调用)
+        self._outcomes = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.rejected = 0
+        self.opened_count = 0
+        self.last_open_reason = None
+
+    @staticmethod
+    def get_config():
+        """获取熔断器配置"""
+        config = getattr(settings, 'FACE_PLUS_PLUS_BREAKER', {})
+        return {
+            'window': config.get('WINDOW', 50),
+            'min_calls': config.get('MIN_CALLS', 10),
+            'failure_rate': config.get('FAILURE_RATE', 0.5),
+            'slow_call_seconds': config.get('SLOW_CALL_SECONDS', 5.0),
+            'slow_call_rate': config.get('SLOW_CALL_RATE', 0.8),
+            'open_seconds': config.get('OPEN_SECONDS', 30.0),
+            'half_open_probes': config.get('HALF_OPEN_PROBES', 3),
+        }
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的Face++熔断器"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls(**cls.get_config())
+        return cls._default
+
+    def _refresh_state(self, now):
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+            logger.info("Face++熔断器进入半开状态，开始探测")
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh_state(self.clock())
+            return self._state
+
+    def is_open(self):
+        """熔断器是否处于打开状态（调用会被立即拒绝）"""
+        return self.state == self.OPEN
+
+    def allow(self):
+        """
+        是否放行一次调用，放行后必须调用 record() 记录结果
+
+        返回:
+            bool: False表示熔断中，调用方应立即失败
+        """
+        with self._lock:
+            self._refresh_state(self.clock())
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def cancel(self):
+        """放行后未实际发出调用时归还探测名额"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def record(self, failed, latency):
+        """记录一次调用的结果"""
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if failed or slow:
+                    self._open('半开探测失败')
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    logger.info("Face++熔断器已关闭，恢复正常调用")
+                return
+
+            if self._state != self.CLOSED:
+                return
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self.min_calls:
+                return
+            total = len(self._outcomes)
+            failures = sum(1 for outcome in self._outcomes if outcome[0])
+            slow_calls = sum(1 for outcome in self._outcomes if outcome[1])
+            if failures / total >= self.failure_rate:
+                self._open(f'失败率 {failures}/{total}')
+            elif slow_calls / total >= self.slow_call_rate:
+                self._open(f'慢调用 {slow_calls}/{total}（超过 {self.slow_call_seconds} 秒）')
+
+    def _open(self, reason):
+        self._state = self.OPEN
+        self._opened_at = self.clock()
+        self._outcomes.clear()
+        self.opened_count += 1
+        self.last_open_reason = reason
+        logger.error(f"Face++熔断器已打开（{reason}），{self.open_seconds} 秒内的调用将立即失败")
+
+    def stats(self):
+        """熔断器状态统计"""
+        with self._lock:
+            now = self.clock()
+            self._refresh_state(now)
+            total = len(self._outcomes)
+            return {
+                'state': self._state,
+                'recent_calls': total,
+                'recent_failures': sum(1 for outcome in self._outcomes if outcome[0]),
+                'recent_slow_calls': sum(1 for outcome in self._outcomes if outcome[1]),
+                'rejected': self.rejected,
+                'opened_count': self.opened_count,
+                'last_open_reason': self.last_open_reason,
+                'open_remaining': round(max(self.open_seconds - (now - self._opened_at), 0), 1)
+                if self._state == self.OPEN else 0,
+            }
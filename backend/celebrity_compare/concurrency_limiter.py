@@ -0,0 +1,170 @@
+import time
+import logging
+import threading
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Face++ 调用的自适应并发上限（AIMD）
+
+    所有比对共享一个并发上限：
+    - 调用延迟稳定时，每完成约 limit 次调用上限加1（加性增长）
+    - 被限流（429、CONCURRENCY_LIMIT_EXCEEDED）时上限乘以 BACKOFF（乘性减小）
+    - 近期延迟（最近 RECENT_WINDOW 次调用的中位数）超过基线延迟（最近 BASELINE_WINDOW 次调用的10%分位数）的
+      LATENCY_TOLERANCE 倍时上限乘以 0.9，在Face++排队变慢、开始限流之前就降低并发；
+      使用分位数而不是最小值和平均值，正常的延迟波动和个别长尾请求不会被误判为延迟上升
+
+    同一轮调用中的多次限流只减小一次上限（两次减小至少间隔一个近期延迟）。
+    clock 为两次减小间隔使用的时钟（测试时可以替换）。
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, endpoints=('compare',), initial_limit=8, min_limit=1, max_limit=32,
+                 backoff=0.7, latency_tolerance=2.0, acquire_timeout=30.0, baseline_window=500, recent_window=20,
+                 clock=time.monotonic):
+        self.endpoints = set(endpoints)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.acquire_timeout = acquire_timeout
+        self.clock = clock
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._samples = deque(maxlen=baseline_window)
+        self._recent = deque(maxlen=recent_window)
+        self._recent_latency = None
+        self._baseline_latency = None
+        self._last_decrease = 0.0
+        self.throttled = 0
+        self.inflated = 0
+        self.decreases = 0
+        self.timeouts = 0
+
+    @staticmethod
+    def get_config():
+        """获取自适应并发配置"""
+        config = getattr(settings, 'FACE_PLUS_PLUS_CONCURRENCY', {})
+        endpoints = config.get('ENDPOINTS', 'compare')
+        if isinstance(endpoints, str):
+            endpoints = [endpoint.strip() for endpoint in endpoints.split(',') if endpoint.strip()]
+        return {
+            'endpoints': endpoints,
+            'initial_limit': config.get('INITIAL_LIMIT', 8),
+            'min_limit': config.get('MIN_LIMIT', 1),
+            'max_limit': config.get('MAX_LIMIT', 32),
+            'backoff': config.get('BACKOFF', 0.7),
+            'latency_tolerance': config.get('LATENCY_TOLERANCE', 2.0),
+            'acquire_timeout': config.get('ACQUIRE_TIMEOUT', 30.0),
+        }
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的并发上限"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls(**cls.get_config())
+        return cls._default
+
+    def applies_to(self, endpoint):
+        return endpoint in self.endpoints
+
+    @property
+    def limit(self):
+        """当前并发上限（整数）"""
+        with self._condition:
+            return int(self._limit)
+
+    def acquire(self, timeout=None):
+        """
+        占用一个并发名额，已达上限时等待
+
+        返回:
+            bool: 是否获得名额，等待超时返回False
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._waiting += 1
+            try:
+                while self._in_flight >= int(self._limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        return False
+                    self._condition.wait(remaining)
+                self._in_flight += 1
+                return True
+            finally:
+                self._waiting -= 1
+
+    def release(self, latency=None):
+        """
+        归还名额并根据调用延迟调整上限
+
+        参数:
+            latency (float, 可选): 调用耗时（秒），调用失败时为None，不参与调整
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if latency is not None:
+                self._on_latency(latency)
+            self._condition.notify_all()
+
+    def _on_latency(self, latency):
+        self._samples.append(latency)
+        self._recent.append(latency)
+        recent = sorted(self._recent)
+        self._recent_latency = recent[len(recent) // 2]
+        samples = sorted(self._samples)
+        self._baseline_latency = samples[len(samples) // 10]
+
+        baseline = self._baseline_latency
+        if len(self._samples) >= self._recent.maxlen and self._recent_latency > baseline * self.latency_tolerance:
+            self.inflated += 1
+            self._decrease(0.9, f'延迟上升 {self._recent_latency:.3f}s（基线 {baseline:.3f}s）')
+        elif self._limit < self.max_limit:
+            self._limit = min(self._limit + 1.0 / self._limit, float(self.max_limit))
+
+    def on_throttle(self):
+        """Face++返回限流错误时调用"""
+        with self._condition:
+            self.throttled += 1
+            self._decrease(self.backoff, '被限流')
+
+    def _decrease(self, factor, reason):
+        now = self.clock()
+        if now - self._last_decrease < (self._recent_latency or 0.0):
+            return
+        self._last_decrease = now
+        limit = max(self._limit * factor, float(self.min_limit))
+        if int(limit) < int(self._limit):
+            logger.info(f"Face++并发上限 {int(self._limit)} -> {int(limit)}（{reason}）")
+        self._limit = limit
+        self.decreases += 1
+
+    def stats(self):
+        """当前并发上限和调整统计"""
+        with self._condition:
+            return {
+                'limit': int(self._limit),
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'baseline_latency': round(self._baseline_latency, 3) if self._baseline_latency is not None else None,
+                'recent_latency': round(self._recent_latency, 3) if self._recent_latency is not None else None,
+                'throttled': self.throttled,
+                'inflated': self.inflated,
+                'decreases': self.decreases,
+                'timeouts': self.timeouts,
+            }
@@ -0,0 +1,50 @@
+import time
+
+
+class DeadlineExceeded(Exception):
+    """比对超过了总时间预算"""
+
+    def __init__(self, message='比对超时，请稍后重试'):
+        super().__init__(message)
+        self.message = message
+
+
+class Deadline:
+    """
+    一次比对的截止时间
+
+    在比对流程中逐层传递（检测、格式转换后重试、各明星的比对），
+    每次Face++调用的超时取自身超时与剩余时间中较小的一个，截止后不再发起新的调用。
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """剩余秒数，已截止时为0"""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def elapsed(self):
+        """从创建截止时间（收到请求）起经过的秒数"""
+        return time.monotonic() - (self.expires_at - self.seconds)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, default):
+        """
+        某一步操作可以使用的超时时间
+
+        参数:
+            default (float): 该操作自身的超时时间
+
+        返回:
+            float: default 与剩余时间中较小的一个
+        """
+        return min(default, self.remaining())
+
+    def check(self, message=None):
+        """已截止时抛出 DeadlineExceeded"""
+        if self.expired():
+            raise DeadlineExceeded(message) if message else DeadlineExceeded()
@@ -0,0 +1,438 @@
+import io
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import logging
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# 与Face++相同的误识率阈值
+THRESHOLDS = {'1e-3': 62.327, '1e-4': 69.101, '1e-5': 73.975}
+
+# FaceSet/AddFace 每次最多添加的人脸数，search 最多返回的结果数（与Face++一致）
+MAX_ADD_FACES = 5
+MAX_SEARCH_RESULTS = 5
+
+
+class EmulatorError(Exception):
+    """以Face++错误格式返回的错误"""
+
+    def __init__(self, status, error_message):
+        super().__init__(error_message)
+        self.status = status
+        self.error_message = error_message
+
+
+def average_hash(image_data):
+    """
+    图片的均值哈希（8x8灰度，64位）
+
+    返回:
+        tuple: (哈希值, 灰度是否完全一致)，纯色图片视为没有人脸
+    """
+    try:
+        image = Image.open(io.BytesIO(image_data))
+        image = ImageOps.exif_transpose(image).convert('L').resize((8, 8), Image.LANCZOS)
+    except Exception:
+        raise EmulatorError(400, 'IMAGE_ERROR_UNSUPPORTED_FORMAT')
+    pixels = list(image.getdata())
+    mean = sum(pixels) / len(pixels)
+    value = 0
+    for pixel in pixels:
+        value = (value << 1) | (1 if pixel >= mean else 0)
+    return value, max(pixels) == min(pixels)
+
+
+def hash_similarity(hash1, hash2):
+    """两个均值哈希的相似度（0-100）：相同图片为100，无关图片（约32位不同）约为33"""
+    distance = bin(hash1 ^ hash2).count('1')
+    return round(max(0.0, 100.0 * (1 - distance / 48)), 3)
+
+
+class EmulatorConfig:
+    """模拟服务的延迟分布、错误注入和限流配置"""
+
+    def __init__(self, latency_ms=80.0, latency_sigma=0.3, tail_ratio=0.0, tail_ms=1000.0, error_rate=0.0,
+                 throttle_rate=0.0, qps=0.0, api_keys=None, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.tail_ratio = tail_ratio
+        self.tail_ms = tail_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.qps = qps
+        # 为空时接受任意密钥
+        self.api_keys = dict(api_keys or {})
+        self.random = random.Random(seed)
+
+    def sample_latency(self):
+        """
+        一次请求的延迟（秒）：主体为对数正态分布，tail_ratio 比例的请求落入帕累托长尾
+        """
+        if self.tail_ratio and self.random.random() < self.tail_ratio:
+            return min(self.tail_ms * self.random.paretovariate(1.5), self.tail_ms * 10) / 1000.0
+        if self.latency_sigma:
+            return self.latency_ms * self.random.lognormvariate(0, self.latency_sigma) / 1000.0
+        return self.latency_ms / 1000.0
+
+
+class FacePPEmulator:
+    """
+    本地Face++模拟服务的状态
+
+    实现 detect、compare、search 和 faceset/create、faceset/addface、faceset/getdetail，
+    请求参数和响应格式与Face++ v3接口一致。face_token 由图片的均值哈希和密钥决定，
+    相同图片在相同密钥下得到相同的token，token只在生成它的密钥下有效；
+    compare 的相似度由两张图片均值哈希的汉明距离计算，结果可以复现。
+    """
+
+    def __init__(self, config=None):
+        self.config = config or EmulatorConfig()
+        self._lock = threading.Lock()
+        # face_token -> (api_key, 均值哈希)
+        self._faces = {}
+        # faceset_token -> FaceSet
+        self._facesets = {}
+        # api_key -> [可用令牌数, 上次补充时间]
+        self._buckets = {}
+        self.requests = {}
+        self.errors = {}
+
+    def _count(self, counter, key):
+        with self._lock:
+            counter[key] = counter.get(key, 0) + 1
+
+    def _check_qps(self, api_key):
+        """按密钥限制QPS（令牌桶，容量为1秒的请求数）"""
+        qps = self.config.qps
+        if not qps:
+            return
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(api_key, (qps, now))
+            tokens = min(tokens + (now - updated) * qps, qps)
+            if tokens < 1:
+                self._buckets[api_key] = (tokens, now)
+                raise EmulatorError(403, 'CONCURRENCY_LIMIT_EXCEEDED')
+            self._buckets[api_key] = (tokens - 1, now)
+
+    def _authenticate(self, form):
+        api_key = form.get('api_key')
+        api_secret = form.get('api_secret')
+        if not api_key or not api_secret:
+            raise EmulatorError(400, 'MISSING_ARGUMENTS: api_key' if not api_key else 'MISSING_ARGUMENTS: api_secret')
+        expected = self.config.api_keys.get(api_key)
+        if self.config.api_keys and expected != api_secret:
+            raise EmulatorError(401, 'AUTHENTICATION_ERROR')
+        return api_key
+
+    def _image_data(self, form, suffix=''):
+        """从 image_file/image_base64/image_url（可带1、2后缀）读取图片"""
+        image_file = form.get(f'image_file{suffix}')
+        if isinstance(image_file, bytes):
+            return image_file
+        image_base64 = form.get(f'image_base64{suffix}')
+        if image_base64:
+            try:
+                return base64.b64decode(image_base64)
+            except Exception:
+                raise EmulatorError(400, f'BAD_ARGUMENTS: image_base64{suffix}')
+        image_url = form.get(f'image_url{suffix}')
+        if image_url:
+            try:
+                response = requests.get(image_url, timeout=10)
+                response.raise_for_status()
+                return response.content
+            except Exception:
+                raise EmulatorError(400, f'INVALID_IMAGE_URL: image_url{suffix}')
+        return None
+
+    def register_face(self, api_key, image_hash):
+        """登记一个人脸（压测时直接为明星生成token，不经过detect）"""
+        face_token = hashlib.sha1(f'{api_key}:{image_hash:016x}'.encode('utf-8')).hexdigest()
+        with self._lock:
+            self._faces[face_token] = (api_key, image_hash)
+        return face_token
+
+    def _face_hash(self, api_key, face_token, argument):
+        with self._lock:
+            face = self._faces.get(face_token)
+        # face_token只在生成它的密钥下有效
+        if face is None or face[0] != api_key:
+            raise EmulatorError(400, f'INVALID_FACE_TOKEN: {argument}' if face_token else f'MISSING_ARGUMENTS: {argument}')
+        return face[1]
+
+    def _detect_image(self, api_key, image_data):
+        """检测图片，返回 face 列表（纯色图片视为没有人脸）"""
+        image_hash, blank = average_hash(image_data)
+        if blank:
+            return [], image_hash
+        face_token = self.register_face(api_key, image_hash)
+        return [{
+            'face_token': face_token,
+            'face_rectangle': {'top': 0, 'left': 0, 'width': 100, 'height': 100},
+        }], image_hash
+
+    def _get_faceset(self, form):
+        faceset_token = form.get('faceset_token')
+        outer_id = form.get('outer_id')
+        with self._lock:
+            if faceset_token:
+                faceset = self._facesets.get(faceset_token)
+            else:
+                faceset = next((f for f in self._facesets.values() if outer_id and f['outer_id'] == outer_id), None)
+        if faceset is None:
+            if not faceset_token and not outer_id:
+                raise EmulatorError(400, 'MISSING_ARGUMENTS: faceset_token, outer_id')
+            raise EmulatorError(400, 'INVALID_FACESET_TOKEN' if faceset_token else 'INVALID_OUTER_ID')
+        if faceset['api_key'] != form.get('api_key'):
+            raise EmulatorError(403, 'AUTHORIZATION_ERROR: faceset not owned by api_key')
+        return faceset
+
+    def _add_faces(self, api_key, faceset, face_tokens):
+        face_added = 0
+        failure_detail = []
+        for face_token in face_tokens:
+            with self._lock:
+                face = self._faces.get(face_token)
+                if face is None or face[0] != api_key:
+                    failure_detail.append({'face_token': face_token, 'reason': 'INVALID_FACE_TOKEN'})
+                    continue
+                if face_token not in faceset['faces']:
+                    faceset['faces'][face_token] = face[1]
+                    face_added += 1
+        return face_added, failure_detail
+
+    # 各接口的实现，返回响应JSON（不含 request_id 和 time_used）
+
+    def detect(self, form):
+        api_key = self._authenticate(form)
+        image_data = self._image_data(form)
+        if image_data is None:
+            raise EmulatorError(400, 'MISSING_ARGUMENTS: image_url, image_file, image_base64')
+        faces, _ = self._detect_image(api_key, image_data)
+        return {'image_id': str(uuid.uuid4()), 'faces': faces, 'face_num': len(faces)}
+
+    def _compare_operand(self, api_key, form, index):
+        face_token = form.get(f'face_token{index}')
+        if face_token:
+            return self._face_hash(api_key, face_token, f'face_token{index}')
+        image_data = self._image_data(form, str(index))
+        if image_data is None:
+            raise EmulatorError(400, f'MISSING_ARGUMENTS: face_token{index}')
+        faces, image_hash = self._detect_image(api_key, image_data)
+        if not faces:
+            raise EmulatorError(400, f'NO_FACE_FOUND: image{index}')
+        return image_hash
+
+    def compare(self, form):
+        api_key = self._authenticate(form)
+        hash1 = self._compare_operand(api_key, form, 1)
+        hash2 = self._compare_operand(api_key, form, 2)
+        return {'confidence': hash_similarity(hash1, hash2), 'thresholds': THRESHOLDS}
+
+    def faceset_create(self, form):
+        api_key = self._authenticate(form)
+        outer_id = form.get('outer_id') or ''
+        with self._lock:
+            if outer_id and any(f['outer_id'] == outer_id for f in self._facesets.values()):
+                raise EmulatorError(400, 'FACESET_EXIST')
+            faceset_token = uuid.uuid4().hex
+            faceset = {
+                'faceset_token': faceset_token, 'outer_id': outer_id, 'api_key': api_key,
+                'display_name': form.get('display_name') or '', 'faces': {},
+            }
+            self._facesets[faceset_token] = faceset
+        face_tokens = [token for token in (form.get('face_tokens') or '').split(',') if token][:MAX_ADD_FACES]
+        face_added, failure_detail = self._add_faces(api_key, faceset, face_tokens)
+        return {
+            'faceset_token': faceset_token, 'outer_id': outer_id, 'face_added': face_added,
+            'face_count': len(faceset['faces']), 'failure_detail': failure_detail,
+        }
+
+    def faceset_addface(self, form):
+        api_key = self._authenticate(form)
+        faceset = self._get_faceset(form)
+        face_tokens = [token for token in (form.get('face_tokens') or '').split(',') if token]
+        if not face_tokens:
+            raise EmulatorError(400, 'MISSING_ARGUMENTS: face_tokens')
+        if len(face_tokens) > MAX_ADD_FACES:
+            raise EmulatorError(400, 'BAD_ARGUMENTS: face_tokens')
+        face_added, failure_detail = self._add_faces(api_key, faceset, face_tokens)
+        return {
+            'faceset_token': faceset['faceset_token'], 'outer_id': faceset['outer_id'], 'face_added': face_added,
+            'face_count': len(faceset['faces']), 'failure_detail': failure_detail,
+        }
+
+    def faceset_getdetail(self, form):
+        self._authenticate(form)
+        faceset = self._get_faceset(form)
+        with self._lock:
+            face_tokens = list(faceset['faces'])
+        return {
+            'faceset_token': faceset['faceset_token'], 'outer_id': faceset['outer_id'],
+            'display_name': faceset['display_name'], 'face_count': len(face_tokens), 'face_tokens': face_tokens,
+        }
+
+    def search(self, form):
+        api_key = self._authenticate(form)
+        faceset = self._get_faceset(form)
+        faces = []
+        face_token = form.get('face_token')
+        if face_token:
+            query_hash = self._face_hash(api_key, face_token, 'face_token')
+        else:
+            image_data = self._image_data(form)
+            if image_data is None:
+                raise EmulatorError(400, 'MISSING_ARGUMENTS: face_token, image_url, image_file, image_base64')
+            faces, query_hash = self._detect_image(api_key, image_data)
+            if not faces:
+                return {'faces': [], 'results': []}
+        try:
+            count = int(form.get('return_result_count') or 1)
+        except ValueError:
+            raise EmulatorError(400, 'BAD_ARGUMENTS: return_result_count')
+        if not 1 <= count <= MAX_SEARCH_RESULTS:
+            raise EmulatorError(400, 'BAD_ARGUMENTS: return_result_count')
+        with self._lock:
+            candidates = list(faceset['faces'].items())
+        if not candidates:
+            raise EmulatorError(400, 'EMPTY_FACESET')
+        results = sorted(
+            ({'face_token': token, 'confidence': hash_similarity(query_hash, image_hash), 'user_id': ''}
+             for token, image_hash in candidates),
+            key=lambda result: result['confidence'], reverse=True
+        )[:count]
+        return {'faces': faces, 'results': results, 'thresholds': THRESHOLDS}
+
+    ENDPOINTS = {
+        'detect': 'detect',
+        'compare': 'compare',
+        'search': 'search',
+        'faceset/create': 'faceset_create',
+        'faceset/addface': 'faceset_addface',
+        'faceset/getdetail': 'faceset_getdetail',
+    }
+
+    def handle(self, endpoint, form):
+        """
+        处理一次请求（包括延迟和错误注入）
+
+        返回:
+            tuple: (HTTP状态码, 响应JSON)
+        """
+        started = time.monotonic()
+        request_id = f'{int(time.time())},{uuid.uuid4()}'
+        self._count(self.requests, endpoint)
+        try:
+            method = self.ENDPOINTS.get(endpoint)
+            if method is None:
+                raise EmulatorError(404, 'API_NOT_FOUND')
+            self._check_qps(form.get('api_key') or '')
+            config = self.config
+            if config.throttle_rate and config.random.random() < config.throttle_rate:
+                raise EmulatorError(403, 'CONCURRENCY_LIMIT_EXCEEDED')
+            time.sleep(config.sample_latency())
+            if config.error_rate and config.random.random() < config.error_rate:
+                raise EmulatorError(500, 'INTERNAL_ERROR')
+            status, body = 200, getattr(self, method)(form)
+        except EmulatorError as e:
+            self._count(self.errors, e.error_message.split(':')[0])
+            status, body = e.status, {'error_message': e.error_message}
+        body['request_id'] = request_id
+        body['time_used'] = int((time.monotonic() - started) * 1000)
+        return status, body
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': dict(self.requests),
+                'errors': dict(self.errors),
+                'faces': len(self._faces),
+                'facesets': len(self._facesets),
+            }
+
+
+def parse_form(content_type, body):
+    """解析 application/x-www-form-urlencoded 或 multipart/form-data 请求体，文件字段的值为bytes"""
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f'Content-Type: {content_type}\r\n\r\n'.encode('utf-8') + body
+        )
+        form = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if not name:
+                continue
+            payload = part.get_payload(decode=True) or b''
+            form[name] = payload if part.get_filename() else payload.decode('utf-8')
+        return form
+    return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+
+def make_handler(emulator, prefix='/facepp/v3/'):
+    class EmulatorHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 响应头和响应体分两次写出，关闭Nagle算法避免延迟确认带来的额外延迟
+        disable_nagle_algorithm = True
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # 客户端已超时断开（截止时间、对冲请求中较慢的一个）
+                logger.debug('客户端已断开连接')
+
+        def do_GET(self):
+            if urlsplit(self.path).path.rstrip('/') == '/stats':
+                self._send(200, emulator.stats())
+            else:
+                self._send(404, {'error_message': 'API_NOT_FOUND'})
+
+        def do_POST(self):
+            path = urlsplit(self.path).path
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not path.startswith(prefix):
+                self._send(404, {'error_message': 'API_NOT_FOUND'})
+                return
+            try:
+                form = parse_form(self.headers.get('Content-Type', ''), body)
+            except Exception:
+                self._send(400, {'error_message': 'BAD_ARGUMENTS'})
+                return
+            status, response = emulator.handle(path[len(prefix):].strip('/'), form)
+            self._send(status, response)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return EmulatorHandler
+
+
+def create_server(host='127.0.0.1', port=8767, config=None):
+    """
+    创建模拟服务（调用 serve_forever() 启动）
+
+    返回:
+        tuple: (ThreadingHTTPServer, FacePPEmulator)
+    """
+    emulator = FacePPEmulator(config)
+    server = ThreadingHTTPServer((host, port), make_handler(emulator))
+    server.daemon_threads = True
+    return server, emulator
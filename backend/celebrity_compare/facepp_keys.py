@@ -0,0 +1,228 @@
+import time
+import hashlib
+import logging
+import threading
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 返回这些错误的密钥被暂时移出密钥池（认证失败、权限或额度不足）
+EVICT_ERRORS = ('AUTHENTICATION_ERROR', 'AUTHORIZATION_ERROR', 'INSUFFICIENT_PERMISSION')
+EVICT_KEYWORDS = ('QUOTA', 'BALANCE')
+# 返回这些错误的密钥短暂冷却（超出QPS限制）
+THROTTLE_ERRORS = ('CONCURRENCY_LIMIT_EXCEEDED',)
+
+
+def make_key_id(api_key):
+    """密钥标识，用于记录face_token属于哪个密钥，不暴露密钥本身"""
+    return hashlib.sha1(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def parse_api_keys(value):
+    """
+    解析密钥列表配置
+
+    参数:
+        value (str): 形如 "key1:secret1,key2:secret2" 的字符串
+
+    返回:
+        list: (api_key, api_secret) 的列表
+    """
+    keys = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item or ':' not in item:
+            continue
+        api_key, api_secret = item.split(':', 1)
+        keys.append((api_key.strip(), api_secret.strip()))
+    return keys
+
+
+class FacePPCredential:
+    """密钥池中的一个Face++密钥及其使用统计"""
+
+    def __init__(self, api_key, api_secret):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.key_id = make_key_id(api_key)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.total_latency = 0.0
+        self.cooldown_until = 0.0
+        self.throttle_streak = 0
+        self.evicted_until = 0.0
+        self.evict_reason = None
+        self.last_error = None
+
+    def is_evicted(self, now):
+        return self.evicted_until > now
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'key_id': self.key_id,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'avg_latency': round(self.total_latency / self.requests, 3) if self.requests else 0.0,
+            'cooling_down': self.cooldown_until > now,
+            'evicted': self.is_evicted(now),
+            'evict_reason': self.evict_reason if self.is_evicted(now) else None,
+            'last_error': self.last_error,
+        }
+
+
+class FacePPKeyPool:
+    """
+    Face++ 密钥池
+
+    - 按当前并发数选择最空闲的可用密钥，把请求分散到多个密钥上，总QPS随密钥数增加
+    - 超出QPS限制（CONCURRENCY_LIMIT_EXCEEDED）的密钥冷却一段时间，连续限流时冷却时间加倍
+    - 认证失败、额度不足的密钥在 EVICT_SECONDS 内不再使用
+    - face_token只在生成它的密钥下有效，使用已有token的请求必须指定该密钥（密钥亲和）
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, keys, cooldown=1.0, max_cooldown=30.0, evict_seconds=600):
+        self.credentials = [FacePPCredential(api_key, api_secret) for api_key, api_secret in keys]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.evict_seconds = evict_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'FACE_PLUS_PLUS', {})
+        keys = config.get('API_KEYS') or []
+        if isinstance(keys, str):
+            keys = parse_api_keys(keys)
+        # 兼容单密钥配置
+        if not keys and config.get('API_KEY'):
+            keys = [(config['API_KEY'], config.get('API_SECRET', ''))]
+        return cls(
+            keys,
+            cooldown=config.get('KEY_COOLDOWN', 1.0),
+            evict_seconds=config.get('KEY_EVICT_SECONDS', 600),
+        )
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的密钥池"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls.from_settings()
+        return cls._default
+
+    @property
+    def primary_key_id(self):
+        """主密钥（第一个配置的密钥），没有记录密钥的旧token属于主密钥"""
+        return self.credentials[0].key_id if self.credentials else None
+
+    def resolve_key_id(self, key_id):
+        return key_id or self.primary_key_id
+
+    def get(self, key_id):
+        key_id = self.resolve_key_id(key_id)
+        for credential in self.credentials:
+            if credential.key_id == key_id:
+                return credential
+        return None
+
+    def is_configured(self, key_id):
+        """密钥是否仍在配置中（密钥被移除后，用它生成的face_token无法再使用）"""
+        return self.get(key_id) is not None
+
+    def acquire(self, key_id=None, max_wait=5.0):
+        """
+        获取一个密钥并占用一个并发名额
+
+        参数:
+            key_id (str, 可选): 指定密钥（密钥亲和），为None时选择最空闲的可用密钥
+            max_wait (float): 所有候选密钥都在冷却时最多等待的秒数
+
+        返回:
+            FacePPCredential 或 None: 没有可用密钥时返回None
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if key_id is not None:
+                    credential = self.get(key_id)
+                    candidates = [credential] if credential and not credential.is_evicted(now) else []
+                else:
+                    candidates = [c for c in self.credentials if not c.is_evicted(now)]
+                if not candidates:
+                    return None
+
+                ready = [c for c in candidates if c.cooldown_until <= now]
+                if ready:
+                    # 并发数相同时选择累计请求最少的密钥，顺序调用也能均匀分布
+                    credential = min(ready, key=lambda c: (c.in_flight, c.requests))
+                    credential.in_flight += 1
+                    credential.requests += 1
+                    return credential
+                wait = min(c.cooldown_until for c in candidates) - now
+
+            if time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+
+    @staticmethod
+    def is_throttle_error(error):
+        return error.upper().startswith(THROTTLE_ERRORS)
+
+    @staticmethod
+    def is_evict_error(error):
+        upper = error.upper()
+        return upper.startswith(EVICT_ERRORS) or any(keyword in upper for keyword in EVICT_KEYWORDS)
+
+    @staticmethod
+    def is_key_error(error):
+        """错误是否与所用密钥有关（换一个密钥可能成功）"""
+        return FacePPKeyPool.is_throttle_error(error) or FacePPKeyPool.is_evict_error(error)
+
+    def release(self, credential, latency=0.0, error=None):
+        """
+        归还密钥并记录调用结果
+
+        参数:
+            credential (FacePPCredential): acquire 返回的密钥
+            latency (float): 调用耗时（秒）
+            error (str, 可选): Face++ 返回的 error_message 或异常描述
+        """
+        with self._lock:
+            credential.in_flight -= 1
+            credential.total_latency += latency
+            if not error:
+                credential.throttle_streak = 0
+                return
+
+            credential.errors += 1
+            credential.last_error = error
+            if self.is_throttle_error(error):
+                credential.throttled += 1
+                credential.throttle_streak += 1
+                cooldown = min(self.cooldown * (2 ** (credential.throttle_streak - 1)), self.max_cooldown)
+                credential.cooldown_until = time.monotonic() + cooldown
+            elif self.is_evict_error(error):
+                credential.evicted_until = time.monotonic() + self.evict_seconds
+                credential.evict_reason = error
+                logger.error(f"Face++密钥 {credential.key_id} 已暂停使用 {self.evict_seconds} 秒: {error}")
+
+    def available_key_ids(self):
+        """当前未被移出的密钥标识"""
+        now = time.monotonic()
+        with self._lock:
+            return [c.key_id for c in self.credentials if not c.is_evicted(now)]
+
+    def stats(self):
+        """各密钥的使用统计"""
+        with self._lock:
+            return [credential.stats() for credential in self.credentials]
@@ -1,42 +1,220 @@
+import time
 import requests
 import logging
+import threading
+from requests.adapters import HTTPAdapter
 from django.conf import settings
+from .photo_mirror import PhotoMirror
+from .facepp_keys import FacePPKeyPool
+from .circuit_breaker import CircuitBreaker
+from .hedging import RequestHedger
+from .concurrency_limiter import AdaptiveConcurrencyLimiter
+from .metrics import FACEPP_REQUESTS, FACEPP_REQUEST_SECONDS, FACEPP_SKIPPED
+from .accounting import record_facepp_call
 
 logger = logging.getLogger(__name__)
 
 class FacePPAPI:
     """
     Face++ API 工具类，提供统一的接口调用方法
+
+    所有请求经过 _post 发出：从密钥池中选择密钥、复用长连接，并记录各密钥的调用结果；
+    熔断器打开时请求立即失败，启用对冲时慢请求会被重复发出一次；
+    compare 调用的并发数由所有比对共享的自适应并发上限控制。
+    传入 deadline 时，各步骤的超时不超过剩余时间，截止后不再发起调用。
     """
     
+    _session = None
+    _session_lock = threading.Lock()
+    
     @staticmethod
     def get_api_config():
-        """获取 Face++ API 配置"""
+        """获取 Face++ API 配置（api_key为密钥池中的主密钥）"""
+        pool = FacePPKeyPool.get_default()
+        primary = pool.credentials[0] if pool.credentials else None
         return {
-            'api_key': settings.FACE_PLUS_PLUS.get('API_KEY', ''),
-            'api_secret': settings.FACE_PLUS_PLUS.get('API_SECRET', ''),
+            'api_key': primary.api_key if primary else '',
+            'api_secret': primary.api_secret if primary else '',
             'api_url': settings.FACE_PLUS_PLUS.get('API_URL', 'https://api-cn.faceplusplus.com/facepp/v3'),
             'return_attributes': settings.FACE_PLUS_PLUS.get('RETURN_ATTRIBUTES', 'gender,age,beauty'),
             'return_landmark': settings.FACE_PLUS_PLUS.get('RETURN_LANDMARK', '0')
         }
     
     @staticmethod
-    def detect_face_by_url(image_url, return_landmark=None):
+    def get_session():
+        """共享的HTTP会话，连接池大小足够容纳并行比对的线程"""
+        if FacePPAPI._session is None:
+            with FacePPAPI._session_lock:
+                if FacePPAPI._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=64)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    FacePPAPI._session = session
+        return FacePPAPI._session
+    
+    @staticmethod
+    def _post(endpoint, data, files=None, key_id=None, timeout=10, deadline=None):
+        """
+        调用Face++接口
+        
+        参数:
+            endpoint (str): 接口名称，如 detect、compare
+            data (dict): 请求参数（不含密钥）
+            files (dict, 可选): 上传的文件
+            key_id (str, 可选): 指定使用的密钥（使用已有face_token时必须指定生成它的密钥）
+            timeout (float): 超时时间（秒）
+            deadline (Deadline, 可选): 所属比对的截止时间
+        
+        返回:
+            tuple: (响应JSON或None, 使用的密钥标识)
+        """
+        if deadline is not None and deadline.expired():
+            logger.warning(f"比对已超时，跳过 {endpoint} 调用")
+            FACEPP_SKIPPED.inc(endpoint=endpoint, reason='deadline')
+            return None, None
+        
+        hedger = RequestHedger.get_default()
+        if hedger.applies_to(endpoint):
+            return hedger.run(
+                endpoint,
+                lambda on_start, hedge: FacePPAPI._post_once(
+                    endpoint, data, files, key_id, timeout, deadline, on_start, hedge
+                ),
+                max_wait=deadline.timeout(timeout) if deadline is not None else timeout
+            )
+        return FacePPAPI._post_once(endpoint, data, files, key_id, timeout, deadline)
+    
+    @staticmethod
+    def _post_once(endpoint, data, files=None, key_id=None, timeout=10, deadline=None, on_start=None, hedge=False):
+        """
+        发出一次Face++请求（被限流时换密钥重试），参数和返回值同 _post
+
+        每次实际发出的HTTP请求各占用一个自适应并发名额（包括对冲请求和换密钥的重试），
+        同时进行的Face++请求数不超过并发上限。
+
+        on_start (callable, 可选): 获得并发名额和密钥、实际发出请求前调用（对冲延迟从此时开始计算）
+        hedge (bool): 是否为对冲请求，对冲请求不等待并发名额，没有空闲名额时不发出
+        """
+        pool = FacePPKeyPool.get_default()
+        breaker = CircuitBreaker.get_default()
+        limiter = AdaptiveConcurrencyLimiter.get_default()
+        limited = limiter.applies_to(endpoint)
+        url = f"{FacePPAPI.get_api_config()['api_url']}/{endpoint}"
+        # 未指定密钥时，被限流或被移出的请求换一个密钥重试
+        attempts = 1 if key_id else max(len(pool.credentials), 1)
+        result, used_key_id = None, None
+        for attempt in range(attempts):
+            if limited:
+                acquire_timeout = 0 if hedge else (
+                    deadline.timeout(limiter.acquire_timeout) if deadline is not None else None
+                )
+                if not limiter.acquire(acquire_timeout):
+                    if hedge:
+                        FACEPP_SKIPPED.inc(endpoint=endpoint, reason='hedge_no_slot')
+                    else:
+                        logger.error(f"等待Face++并发名额超时，跳过 {endpoint} 调用")
+                        FACEPP_SKIPPED.inc(endpoint=endpoint, reason='concurrency_timeout')
+                    break
+            if not breaker.allow():
+                if limited:
+                    limiter.release()
+                logger.warning(f"Face++熔断中，跳过 {endpoint} 调用")
+                FACEPP_SKIPPED.inc(endpoint=endpoint, reason='breaker_open')
+                return None, None
+            if deadline is not None and deadline.expired():
+                breaker.cancel()
+                if limited:
+                    limiter.release()
+                FACEPP_SKIPPED.inc(endpoint=endpoint, reason='deadline')
+                break
+            max_wait = deadline.timeout(5.0) if deadline is not None else 5.0
+            credential = pool.acquire(key_id, max_wait=max_wait)
+            if credential is None:
+                breaker.cancel()
+                if limited:
+                    limiter.release()
+                logger.error(f"没有可用的Face++密钥（{key_id or '任意密钥'}）")
+                FACEPP_SKIPPED.inc(endpoint=endpoint, reason='no_key')
+                break
+            
+            payload = dict(data, api_key=credential.api_key, api_secret=credential.api_secret)
+            # 超时不超过比对的剩余时间
+            call_timeout = deadline.timeout(timeout) if deadline is not None else timeout
+            if on_start is not None:
+                on_start()
+            started = time.monotonic()
+            record_facepp_call(endpoint, data, files, retry=attempt > 0)
+            error = None
+            # 网络异常、超时和5xx计入熔断器的失败
+            failed = False
+            status = 'exception'
+            try:
+                response = FacePPAPI.get_session().post(url, data=payload, files=files, timeout=call_timeout)
+                try:
+                    result = response.json()
+                except ValueError:
+                    result = {'error_message': f'HTTP_{response.status_code}'}
+                if response.status_code == 429:
+                    error = 'CONCURRENCY_LIMIT_EXCEEDED'
+                else:
+                    error = result.get('error_message')
+                failed = response.status_code >= 500
+                status = FacePPAPI._metrics_status(response.status_code, error)
+            except Exception as e:
+                result = None
+                # 因剩余时间不足而缩短的超时不算Face++的失败
+                failed = not (isinstance(e, requests.exceptions.Timeout) and call_timeout < timeout)
+                error = f"{type(e).__name__}: {str(e)}"
+                logger.error(f"调用Face++ API时出错: {str(e)}")
+            finally:
+                latency = time.monotonic() - started
+                pool.release(credential, latency, error)
+                breaker.record(failed, latency)
+                if limited:
+                    # 只有成功的调用参与延迟调整
+                    limiter.release(latency if result is not None and not error else None)
+                FACEPP_REQUESTS.inc(endpoint=endpoint, status=status)
+                FACEPP_REQUEST_SECONDS.observe(latency, endpoint=endpoint, status=status)
+            used_key_id = credential.key_id
+            if error and FacePPKeyPool.is_throttle_error(error):
+                AdaptiveConcurrencyLimiter.get_default().on_throttle()
+            
+            if not (error and FacePPKeyPool.is_key_error(error)):
+                break
+        return result, used_key_id
+    
+    @staticmethod
+    def _metrics_status(status_code, error):
+        """Face++响应在指标中的状态：ok、throttled、http_5xx、error"""
+        if status_code >= 500:
+            return 'http_5xx'
+        if error and FacePPKeyPool.is_throttle_error(error):
+            return 'throttled'
+        return 'error' if error else 'ok'
+    
+    @staticmethod
+    def is_available():
+        """Face++是否可用（熔断器未打开）"""
+        return not CircuitBreaker.get_default().is_open()
+    
+    @staticmethod
+    def detect_face_by_url(image_url, return_landmark=None, key_id=None, deadline=None):
         """
         通过图片URL检测人脸并返回face_token
         
         参数:
             image_url (str): 图片URL
             return_landmark (str, 可选): 是否返回人脸关键点，可选值：0, 1, 2
+            key_id (str, 可选): 指定使用的密钥，为None时由密钥池选择
+            deadline (Deadline, 可选): 所属比对的截止时间
         
         返回:
-            dict 或 None: 检测结果或None（如果出错）
+            dict 或 None: 检测结果或None（如果出错），结果中的 key_id 为生成face_token的密钥
         """
         # 获取API配置
         config = FacePPAPI.get_api_config()
         api_key = config['api_key']
-        api_secret = config['api_secret']
-        api_base_url = config['api_url']
         
         # 验证API密钥
         if not api_key or len(api_key) <= 5:
@@ -56,10 +234,7 @@ class FacePPAPI:
             return None
         
         # 构建请求参数
-        detect_url = f"{api_base_url}/detect"
         detect_data = {
-            'api_key': api_key,
-            'api_secret': api_secret,
             'image_url': image_url,
             'return_attributes': config['return_attributes']
         }
@@ -73,8 +248,9 @@ class FacePPAPI:
         try:
             # 发送请求
             logger.info(f"正在通过URL调用Face++ API检测人脸: {image_url[:50]}...")
-            response = requests.post(detect_url, data=detect_data, timeout=10)
-            result = response.json()
+            result, used_key_id = FacePPAPI._post('detect', detect_data, key_id=key_id, deadline=deadline)
+            if result is None:
+                return None
             
             # 处理错误
             if 'error_message' in result:
@@ -83,6 +259,7 @@ class FacePPAPI:
                 
             # 检查是否检测到人脸
             if 'faces' in result and result['faces']:
+                result['key_id'] = used_key_id
                 return result
             else:
                 logger.warning(f"未在图片中检测到人脸")
@@ -93,7 +270,8 @@ class FacePPAPI:
             return None
             
     @staticmethod
-    def detect_face_by_file(image_data, file_name='image.jpg', mime_type=None, return_landmark=None):
+    def detect_face_by_file(image_data, file_name='image.jpg', mime_type=None, return_landmark=None, key_id=None,
+                            deadline=None):
         """
         通过图片文件数据检测人脸并返回face_token
         
@@ -102,15 +280,15 @@ class FacePPAPI:
             file_name (str): 文件名
             mime_type (str, 可选): MIME类型，如果为None则根据文件名推断
             return_landmark (str, 可选): 是否返回人脸关键点，可选值：0, 1, 2
+            key_id (str, 可选): 指定使用的密钥，为None时由密钥池选择
+            deadline (Deadline, 可选): 所属比对的截止时间
             
         返回:
-            dict 或 None: 检测结果或None（如果出错）
+            dict 或 None: 检测结果或None（如果出错），结果中的 key_id 为生成face_token的密钥
         """
         # 获取API配置
         config = FacePPAPI.get_api_config()
         api_key = config['api_key']
-        api_secret = config['api_secret']
-        api_base_url = config['api_url']
         
         # 验证API密钥
         if not api_key or len(api_key) <= 5:
@@ -132,13 +310,10 @@ class FacePPAPI:
                 mime_type = 'image/jpeg'  # 默认为JPEG
                 
         # 构建请求参数
-        detect_url = f"{api_base_url}/detect"
         detect_files = {
             'image_file': (file_name, image_data, mime_type)
         }
         detect_data = {
-            'api_key': api_key,
-            'api_secret': api_secret,
             'return_attributes': config['return_attributes']
         }
         
@@ -151,8 +326,11 @@ class FacePPAPI:
         try:
             # 发送请求
             logger.info(f"正在通过文件调用Face++ API检测人脸，文件名: {file_name}")
-            response = requests.post(detect_url, data=detect_data, files=detect_files, timeout=10)
-            result = response.json()
+            result, used_key_id = FacePPAPI._post(
+                'detect', detect_data, files=detect_files, key_id=key_id, deadline=deadline
+            )
+            if result is None:
+                return None
             
             # 处理错误
             if 'error_message' in result:
@@ -161,6 +339,7 @@ class FacePPAPI:
                 
             # 检查是否检测到人脸
             if 'faces' in result and result['faces']:
+                result['key_id'] = used_key_id
                 return result
             else:
                 logger.warning(f"未在图片中检测到人脸")
@@ -171,9 +350,10 @@ class FacePPAPI:
             return None
 
     @staticmethod
-    def get_face_token(image_url=None, image_data=None, file_name='image.jpg', mime_type=None, return_landmark=None):
+    def get_face_token_with_key(image_url=None, image_data=None, file_name='image.jpg', mime_type=None,
+                                return_landmark=None, key_id=None, deadline=None):
         """
-        获取人脸token，支持URL和文件两种方式
+        获取人脸token及生成它的密钥，支持URL和文件两种方式
         
         参数:
             image_url (str, 可选): 图片URL
@@ -181,87 +361,94 @@ class FacePPAPI:
             file_name (str): 文件名，仅当提供image_data时使用
             mime_type (str, 可选): MIME类型，如果为None则根据文件名推断
             return_landmark (str, 可选): 是否返回人脸关键点，可选值：0, 1, 2
+            key_id (str, 可选): 指定使用的密钥，为None时由密钥池选择
+            deadline (Deadline, 可选): 所属比对的截止时间
             
         返回:
-            str 或 None: face_token或None（如果出错）
+            tuple: (face_token, 密钥标识)，出错时为 (None, None)
         """
         result = None
         
         # 优先使用直接提供的图片数据
         if image_data:
-            result = FacePPAPI.detect_face_by_file(image_data, file_name, mime_type, return_landmark)
+            result = FacePPAPI.detect_face_by_file(image_data, file_name, mime_type, return_landmark, key_id, deadline)
         
-        # 如果没有图片数据但有URL，先尝试URL方式
+        # 如果没有图片数据但有URL，优先使用本地镜像
         elif image_url:
             # 确保URL格式正确
             if image_url.startswith('//'):
                 image_url = 'https:' + image_url
                 
-            # 先尝试使用URL直接调用API
-            result = FacePPAPI.detect_face_by_url(image_url, return_landmark)
-            
-            # 如果URL方式失败，尝试下载图片后用文件方式
-            if not result:
-                logger.info(f"URL方式检测失败，尝试下载图片: {image_url[:50]}...")
-                try:
-                    response = requests.get(image_url, timeout=10)
-                    if response.status_code == 200:
-                        downloaded_image_data = response.content
-                        result = FacePPAPI.detect_face_by_file(
-                            downloaded_image_data, 
-                            'downloaded_image.jpg', 
-                            None, 
-                            return_landmark
-                        )
-                    else:
-                        logger.error(f"下载图片失败，状态码: {response.status_code}")
-                except Exception as e:
-                    logger.error(f"下载图片时出错: {str(e)}")
+            # 从本地镜像读取图片（未镜像时下载一次并写入镜像），避免每次重新生成token都回源下载
+            mirrored_image_data = PhotoMirror.fetch(image_url)
+            if mirrored_image_data:
+                result = FacePPAPI.detect_face_by_file(
+                    mirrored_image_data, 
+                    'mirrored_image.jpg', 
+                    None, 
+                    return_landmark,
+                    key_id,
+                    deadline
+                )
+            else:
+                # 无法获取图片时，尝试让Face++直接通过URL获取
+                logger.info(f"无法获取图片到本地镜像，尝试URL方式检测: {image_url[:50]}...")
+                result = FacePPAPI.detect_face_by_url(image_url, return_landmark, key_id, deadline)
         else:
             logger.error("未提供图片URL或图片数据")
-            return None
+            return None, None
             
         # 提取face_token
         if result and 'faces' in result and result['faces']:
-            return result['faces'][0]['face_token']
-        return None
+            return result['faces'][0]['face_token'], result.get('key_id')
+        return None, None
         
     @staticmethod
-    def compare_faces(face_token1, face_token2):
+    def get_face_token(image_url=None, image_data=None, file_name='image.jpg', mime_type=None, return_landmark=None):
+        """
+        获取人脸token，支持URL和文件两种方式（不关心密钥时使用）
+        
+        返回:
+            str 或 None: face_token或None（如果出错）
+        """
+        face_token, _ = FacePPAPI.get_face_token_with_key(
+            image_url, image_data, file_name, mime_type, return_landmark
+        )
+        return face_token
+        
+    @staticmethod
+    def compare_faces(face_token1, face_token2, key_id=None, deadline=None):
         """
         比较两个人脸的相似度
         
         参数:
             face_token1 (str): 第一个face_token
             face_token2 (str): 第二个face_token
+            key_id (str, 可选): 两个face_token所属的密钥，为None时使用主密钥
+            deadline (Deadline, 可选): 所属比对的截止时间
             
         返回:
             float 或 None: 相似度(0-100)或None（如果出错）
         """
-        # 获取API配置
-        config = FacePPAPI.get_api_config()
-        api_key = config['api_key']
-        api_secret = config['api_secret']
-        api_base_url = config['api_url']
-        
         # 验证参数
         if not face_token1 or not face_token2:
             logger.error("无效的face_token")
             return None
             
         # 构建请求参数
-        compare_url = f"{api_base_url}/compare"
         compare_data = {
-            'api_key': api_key,
-            'api_secret': api_secret,
             'face_token1': face_token1,
             'face_token2': face_token2
         }
         
+        # face_token只在生成它的密钥下有效
+        key_id = FacePPKeyPool.get_default().resolve_key_id(key_id)
+        
         try:
             # 发送请求
-            response = requests.post(compare_url, data=compare_data, timeout=10)
-            result = response.json()
+            result, _ = FacePPAPI._post('compare', compare_data, key_id=key_id, deadline=deadline)
+            if result is None:
+                return None
             
             # 处理错误
             if 'error_message' in result:
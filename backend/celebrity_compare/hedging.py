@@ -0,0 +1,293 @@
+import time
+import logging
+import threading
+import contextvars
+import concurrent.futures
+from collections import deque
+from django.conf import settings
+from .accounting import CostTracker
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """记录某个接口最近 window 次调用的耗时，用于计算百分位延迟"""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self._samples.append(latency)
+
+    def count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, percent):
+        """
+        最近调用耗时的百分位数
+
+        返回:
+            float 或 None: 没有样本时返回None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(int(len(samples) * percent / 100), len(samples) - 1)
+        return samples[index]
+
+
+class HedgeBudget:
+    """
+    对冲请求预算（令牌桶）
+
+    每个正常请求向桶中加入 percent/100 个令牌，每次对冲消耗一个令牌，
+    长期来看对冲请求数不超过正常请求数的 percent%。桶的容量限制了突发对冲的数量。
+    """
+
+    def __init__(self, percent=5.0, burst=10):
+        self.ratio = percent / 100.0
+        self.burst = burst
+        self._tokens = float(burst) if percent > 0 else 0.0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.burst)
+
+    def withdraw(self):
+        """取出一个令牌，预算不足时返回False"""
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    @property
+    def tokens(self):
+        with self._lock:
+            return self._tokens
+
+
+class RequestHedger:
+    """
+    Face++ 对冲请求
+
+    一次比对要等所有明星的 compare 调用返回，整体耗时取决于单次调用的长尾延迟。
+    启用后，请求在发出 PERCENTILE 百分位延迟（按该接口最近的调用统计）后仍未返回时，
+    再发出一个相同的请求，使用先返回的结果；对冲请求数受 BUDGET_PERCENT 预算限制。
+
+    较慢的那个请求不会被取消：返回结果后它仍占用一个并发名额和所用密钥的进行中请求数，直到HTTP请求结束
+    （不超过请求超时），结果照常计入密钥池和熔断器的统计。stats() 中 abandoned_in_flight 为当前仍在进行的落败请求数。
+
+    主请求和对冲请求都在线程池中执行。线程池按所有运行中比对的调用线程数设置大小，主请求通常不需要排队；
+    线程池占满时主请求最多等待 max_wait 秒（调用方传入请求超时与比对剩余时间中较小的一个），超时后放弃该请求。
+    对冲延迟和延迟统计都从请求实际发出时（获得并发名额和密钥之后）开始计算，
+    排队等待的时间不会被当作慢请求而触发对冲。
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, enabled=False, endpoints=('detect', 'compare'), percentile=95, min_delay=0.05,
+                 min_samples=20, budget_percent=5.0, budget_burst=10, max_workers=32):
+        self.enabled = enabled
+        self.endpoints = set(endpoints)
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.budget = HedgeBudget(budget_percent, budget_burst)
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._trackers = {}
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+        self.queue_timeouts = 0
+        self.abandoned = 0
+        self.abandoned_in_flight = 0
+
+    @staticmethod
+    def get_config():
+        """获取对冲请求配置"""
+        config = getattr(settings, 'FACE_PLUS_PLUS_HEDGING', {})
+        endpoints = config.get('ENDPOINTS', 'detect,compare')
+        if isinstance(endpoints, str):
+            endpoints = [endpoint.strip() for endpoint in endpoints.split(',') if endpoint.strip()]
+        # 每个运行中的比对最多有 MAX_LIMIT 个线程同时调用Face++，主请求和对冲请求各需要同样多的线程
+        admission = getattr(settings, 'COMPARISON_ADMISSION', {})
+        concurrency = getattr(settings, 'FACE_PLUS_PLUS_CONCURRENCY', {})
+        max_workers = config.get('MAX_WORKERS') or (
+            2 * admission.get('MAX_IN_FLIGHT', 4) * concurrency.get('MAX_LIMIT', 32)
+        )
+        return {
+            'enabled': config.get('ENABLED', False),
+            'endpoints': endpoints,
+            'percentile': config.get('PERCENTILE', 95),
+            'min_delay': config.get('MIN_DELAY', 0.05),
+            'min_samples': config.get('MIN_SAMPLES', 20),
+            'budget_percent': config.get('BUDGET_PERCENT', 5.0),
+            'max_workers': max_workers,
+        }
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的对冲请求控制器"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls(**cls.get_config())
+        return cls._default
+
+    def applies_to(self, endpoint):
+        return self.enabled and endpoint in self.endpoints
+
+    def _tracker(self, endpoint):
+        with self._lock:
+            if endpoint not in self._trackers:
+                self._trackers[endpoint] = LatencyTracker()
+            return self._trackers[endpoint]
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.max_workers, thread_name_prefix='facepp-hedge'
+                    )
+        return self._executor
+
+    def hedge_delay(self, endpoint):
+        """
+        发出对冲请求前等待的秒数
+
+        返回:
+            float 或 None: 样本不足时返回None（不对冲）
+        """
+        tracker = self._tracker(endpoint)
+        if tracker.count() < self.min_samples:
+            return None
+        return max(tracker.percentile(self.percentile), self.min_delay)
+
+    def _timed(self, endpoint, call, started=None, hedge=False):
+        """执行一次请求，记录从实际发出到返回的耗时；请求发出或结束时设置 started"""
+        sent_at = []
+
+        def on_start():
+            if not sent_at:
+                sent_at.append(time.monotonic())
+            if started is not None:
+                started.set()
+
+        try:
+            result = call(on_start, hedge)
+        finally:
+            if started is not None:
+                started.set()
+        # 熔断或没有可用密钥（没有实际发出请求）时不计入延迟统计
+        if result[0] is not None and sent_at:
+            self._tracker(endpoint).record(time.monotonic() - sent_at[0])
+        return result
+
+    def _abandon(self, futures):
+        """记录先返回的结果之后仍在进行的请求，请求结束时从 abandoned_in_flight 中减去"""
+        for future in futures:
+            if future.done():
+                continue
+            with self._lock:
+                self.abandoned += 1
+                self.abandoned_in_flight += 1
+            future.add_done_callback(self._abandoned_done)
+
+    def _abandoned_done(self, future):
+        with self._lock:
+            self.abandoned_in_flight -= 1
+
+    def run(self, endpoint, call, max_wait=None):
+        """
+        执行一次可对冲的调用
+
+        参数:
+            endpoint (str): 接口名称
+            call (callable): call(on_start, hedge) 发出一次请求，实际发出请求前调用 on_start()，
+                hedge 表示是否为对冲请求；返回 (响应JSON或None, 使用的密钥标识)
+            max_wait (float, 可选): 主请求在线程池中等待发出的最长秒数，None表示不限制
+
+        返回:
+            tuple: 先返回的有效结果，主请求等待超时时为 (None, None)
+        """
+        with self._lock:
+            self.requests += 1
+        self.budget.deposit()
+
+        delay = self.hedge_delay(endpoint)
+        if delay is None:
+            return self._timed(endpoint, call)
+
+        executor = self._get_executor()
+        # 线程池中的请求沿用调用方的上下文（日志字段、比对的资源统计），主请求和对冲请求各用一份
+        started = threading.Event()
+        primary = executor.submit(contextvars.copy_context().run, self._timed, endpoint, call, started)
+        # 对冲延迟从主请求实际发出时开始计算
+        if not started.wait(max_wait):
+            # 线程池已满，等待超过了请求超时或比对的剩余时间
+            if primary.cancel():
+                with self._lock:
+                    self.queue_timeouts += 1
+                logger.warning(f"对冲线程池已满，{endpoint} 请求等待 {max_wait:.2f} 秒后放弃")
+                return None, None
+            started.wait()
+        done, _ = concurrent.futures.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        if not self.budget.withdraw():
+            with self._lock:
+                self.budget_exhausted += 1
+            return primary.result()
+
+        with self._lock:
+            self.hedged += 1
+        tracker = CostTracker.current()
+        if tracker is not None:
+            tracker.record_hedge()
+        hedge = executor.submit(contextvars.copy_context().run, self._timed, endpoint, call, None, True)
+        pending = {primary, hedge}
+        result = (None, None)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result[0] is not None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    self._abandon(pending)
+                    return result
+        return result
+
+    def stats(self):
+        """各接口的对冲延迟和对冲次数"""
+        delays = {}
+        for endpoint in sorted(self.endpoints):
+            delay = self.hedge_delay(endpoint)
+            delays[endpoint] = round(delay, 3) if delay is not None else None
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'percentile': self.percentile,
+                'hedge_delay': delays,
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'budget_exhausted': self.budget_exhausted,
+                'queue_timeouts': self.queue_timeouts,
+                'abandoned': self.abandoned,
+                'abandoned_in_flight': self.abandoned_in_flight,
+                'budget_tokens': round(self.budget.tokens, 2),
+            }
@@ -0,0 +1,179 @@
+import copy
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from .metrics import counter, gauge, histogram
+
+# 日志的上下文字段：同一线程（和显式传递到线程池中）的日志都带有这些字段
+_context_fields = {
+    'comparison_id': contextvars.ContextVar('comparison_id', default=None),
+    'stage': contextvars.ContextVar('stage', default=None),
+}
+
+LOG_RECORDS = counter(
+    'facesim_log_records', '日志记录数（outcome: queued、sampled_out、dropped）', ['outcome']
+)
+# 调用方线程中写一条日志的耗时（过滤、入队），格式化和输出在后台线程中进行
+LOG_EMIT_SECONDS = histogram(
+    'facesim_log_emit_seconds', '写一条日志在调用方线程中的耗时（秒）', [],
+    buckets=(0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005)
+)
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    在代码块内为日志设置上下文字段（comparison_id、stage）
+
+    上下文保存在contextvars中，新线程和线程池中的任务不会继承，需要在线程内重新设置
+    """
+    tokens = [(_context_fields[name], _context_fields[name].set(value)) for name, value in fields.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def get_log_context():
+    """当前的日志上下文字段"""
+    return {name: var.get() for name, var in _context_fields.items()}
+
+
+class ContextFilter(logging.Filter):
+    """把当前的日志上下文字段写入日志记录（必须在调用方线程中执行）"""
+
+    def filter(self, record):
+        for name, var in _context_fields.items():
+            if not hasattr(record, name):
+                value = var.get()
+                setattr(record, name, str(value) if value is not None else None)
+        return True
+
+
+class StageSamplingFilter(logging.Filter):
+    """
+    按阶段对日志采样
+
+    rates 为 {阶段: 保留比例}，例如 {'fanout': 0.01} 只保留与明星比对阶段1%的日志；
+    ERROR及以上级别的日志始终保留，未配置的阶段不采样
+    """
+
+    def __init__(self, rates=None, name=''):
+        super().__init__(name)
+        self.rates = dict(rates or {})
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR or not self.rates:
+            return True
+        stage = getattr(record, 'stage', None) or _context_fields['stage'].get()
+        rate = self.rates.get(stage)
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        LOG_RECORDS.inc(outcome='sampled_out')
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，包含上下文字段"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for name in _context_fields:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """便于本地查看的文本格式，带有上下文字段"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(context)s] %(message)s')
+
+    def format(self, record):
+        record.context = ' '.join(
+            f'{name}={getattr(record, name)}' for name in _context_fields if getattr(record, name, None)
+        ) or '-'
+        return super().format(record)
+
+
+class _DrainingQueueListener(QueueListener):
+    """停止时等待队列腾出位置再放入结束标记（队列满时 put_nowait 会抛出 queue.Full）"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class NonBlockingHandler(QueueHandler):
+    """
+    非阻塞的日志处理器
+
+    调用方线程只做过滤和入队（有界队列，满时丢弃并计数），格式化和写入stderr/文件在后台线程中进行，
+    比对线程池中的日志不会因为同步I/O而互相等待。进程退出时写完队列中剩余的日志。
+
+    参数:
+        handlers (list, 可选): 实际输出的处理器，默认输出到stderr
+        log_format (str): 'json' 或 'text'，应用于未设置格式的输出处理器
+        queue_size (int): 队列容量
+    """
+
+    def __init__(self, handlers=None, log_format='json', queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        handlers = handlers or [logging.StreamHandler()]
+        for handler in handlers:
+            if handler.formatter is None:
+                handler.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+        self.listener = _DrainingQueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        self._closed = False
+        gauge('facesim_log_queue_size', '等待写出的日志数', self.queue.qsize)
+        atexit.register(self.close)
+
+    def handle(self, record):
+        started = time.perf_counter()
+        try:
+            return super().handle(record)
+        finally:
+            LOG_EMIT_SECONDS.observe(time.perf_counter() - started)
+
+    def prepare(self, record):
+        # 只在调用方线程中合并参数和格式化异常（之后线程的局部变量可能已变化），其余格式化交给后台线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            LOG_RECORDS.inc(outcome='queued')
+        except queue.Full:
+            LOG_RECORDS.inc(outcome='dropped')
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.listener.stop()
+        super().close()
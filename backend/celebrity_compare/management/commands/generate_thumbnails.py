@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from celebrity_compare.models import Celebrity, ComparisonResult
+from celebrity_compare.thumbnails import ThumbnailService
+
+
+class Command(BaseCommand):
+    help = '在进程池中批量生成明星照片和用户照片的缩略图（已生成的会跳过）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=str, default='', help='要生成的尺寸，逗号分隔，默认全部')
+        parser.add_argument('--workers', type=int, default=0, help='进程数，默认使用配置值')
+        parser.add_argument('--skip-celebrities', action='store_true', help='不处理明星照片')
+        parser.add_argument('--skip-user-photos', action='store_true', help='不处理用户照片')
+
+    def handle(self, *args, **options):
+        available_sizes = ThumbnailService.get_config()['sizes']
+        sizes = [size.strip() for size in options['sizes'].split(',') if size.strip()] or list(available_sizes)
+        unknown_sizes = [size for size in sizes if size not in available_sizes]
+        if unknown_sizes:
+            raise CommandError(f"未配置的缩略图尺寸: {', '.join(unknown_sizes)}")
+
+        image_fields = []
+        if not options['skip_celebrities']:
+            image_fields.extend(celebrity.photo for celebrity in Celebrity.objects.only('id', 'photo'))
+        if not options['skip_user_photos']:
+            image_fields.extend(comparison.user_photo for comparison in ComparisonResult.objects.only('id', 'user_photo'))
+
+        self.stdout.write(f"待处理图片: {len(image_fields)}，尺寸: {', '.join(sizes)}")
+        success_count, failed_count = ThumbnailService.generate_many(
+            image_fields, sizes, workers=options['workers'] or None
+        )
+        self.stdout.write(self.style.SUCCESS(f"缩略图生成完成: 成功 {success_count} 个，失败 {failed_count} 个"))
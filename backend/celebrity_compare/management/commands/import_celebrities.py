@@ -0,0 +1,42 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from celebrity_compare.catalogue import bulk_upsert_celebrities, iter_jsonl
+
+
+class Command(BaseCommand):
+    help = '从JSONL文件流式导入明星数据（常量内存，分批写入数据库）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='JSONL文件路径，每行一个明星记录')
+        parser.add_argument('--source', type=str, default=None, help='记录中没有source字段时使用的数据源名称')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批写入的记录数')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"文件不存在: {path}")
+
+        batch_size = options['batch_size']
+        totals = {'read': 0, 'created': 0, 'updated': 0}
+        batch = []
+
+        def flush():
+            result = bulk_upsert_celebrities(batch, options['source'], batch_size=batch_size)
+            totals['created'] += len(result['created'])
+            totals['updated'] += len(result['updated'])
+            batch.clear()
+            self.stdout.write(f"已读取 {totals['read']} 条，新建 {totals['created']} 条，更新 {totals['updated']} 条")
+
+        for record in iter_jsonl(path):
+            if not record.get('name'):
+                continue
+            batch.append(record)
+            totals['read'] += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"导入完成: 共读取 {totals['read']} 条，新建 {totals['created']} 条，更新 {totals['updated']} 条"
+        ))
@@ -0,0 +1,60 @@
+import concurrent.futures
+from django.core.management.base import BaseCommand
+from celebrity_compare.models import Celebrity
+from celebrity_compare.photo_mirror import PhotoMirror
+
+
+class Command(BaseCommand):
+    help = '将明星照片下载到本地内容寻址镜像（只需执行一次，已镜像的照片会跳过）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=0, help='最多处理的明星数，0表示不限制')
+        parser.add_argument('--workers', type=int, default=8, help='并发下载线程数')
+        parser.add_argument('--force', action='store_true', help='重新计算已有哈希的明星')
+
+    def handle(self, *args, **options):
+        celebrities = Celebrity.objects.only('id', 'name', 'photo', 'photo_hash').order_by('id')
+        if not options['force']:
+            celebrities = celebrities.filter(photo_hash__isnull=True)
+        if options['limit']:
+            celebrities = celebrities[:options['limit']]
+
+        celebrities = list(celebrities)
+        self.stdout.write(f"待镜像的明星照片: {len(celebrities)}")
+
+        mirrored_count = 0
+        failed_count = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(self.mirror_photo, celebrity): celebrity for celebrity in celebrities}
+            for future in concurrent.futures.as_completed(futures):
+                celebrity = futures[future]
+                try:
+                    photo_hash = future.result()
+                except Exception as e:
+                    photo_hash = None
+                    self.stderr.write(f"镜像 {celebrity.name} 的照片时出错: {str(e)}")
+
+                if photo_hash:
+                    # 在主线程中写数据库
+                    Celebrity.objects.filter(id=celebrity.id).update(photo_hash=photo_hash)
+                    mirrored_count += 1
+                else:
+                    failed_count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"镜像完成: 成功 {mirrored_count} 个，失败 {failed_count} 个"))
+
+    def mirror_photo(self, celebrity):
+        """镜像单个明星照片，返回内容哈希"""
+        photo = str(celebrity.photo) if celebrity.photo else ''
+        if not photo:
+            return None
+
+        # 外部URL：下载到镜像
+        if PhotoMirror.normalize_url(photo):
+            if not PhotoMirror.fetch(photo):
+                return None
+            return PhotoMirror.hash_for_url(photo)
+
+        # 本地媒体文件：直接读取后写入镜像
+        with celebrity.photo.open('rb') as f:
+            return PhotoMirror.store(f.read())
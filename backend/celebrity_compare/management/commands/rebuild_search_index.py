@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from celebrity_compare.models import Celebrity
+from celebrity_compare.search import create_fts_index, drop_fts_index
+
+
+class Command(BaseCommand):
+    help = '重建明星搜索的FTS5索引（SQLite），包括维护索引的触发器'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drop', action='store_true', help='先删除索引表和触发器再重新创建')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"当前数据库为 {connection.vendor}，明星搜索使用普通查询，不需要索引")
+        if options['drop']:
+            drop_fts_index(connection)
+        if not create_fts_index(connection, rebuild=True):
+            raise CommandError("当前SQLite不支持FTS5 trigram分词器（需要3.34以上），明星搜索使用普通查询")
+        self.stdout.write(self.style.SUCCESS(f"明星搜索索引已重建，共 {Celebrity.objects.count()} 个明星"))
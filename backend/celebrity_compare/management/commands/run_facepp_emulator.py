@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from celebrity_compare.facepp_emulator import EmulatorConfig, create_server
+from celebrity_compare.facepp_keys import parse_api_keys
+
+
+class Command(BaseCommand):
+    help = '启动本地Face++模拟服务，用于压测和集成测试（不消耗Face++额度）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址')
+        parser.add_argument('--port', type=int, default=8767, help='监听端口')
+        parser.add_argument('--latency-ms', type=float, default=80, help='典型延迟（毫秒）')
+        parser.add_argument('--latency-sigma', type=float, default=0.3, help='延迟对数正态分布的sigma，0表示固定延迟')
+        parser.add_argument('--tail-ratio', type=float, default=0.0, help='落入长尾延迟的请求比例')
+        parser.add_argument('--tail-ms', type=float, default=1000, help='长尾延迟的下限（毫秒）')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='返回500 INTERNAL_ERROR的请求比例')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='随机返回CONCURRENCY_LIMIT_EXCEEDED的请求比例')
+        parser.add_argument('--qps', type=float, default=0.0, help='每个密钥的QPS上限，0表示不限制')
+        parser.add_argument('--api-keys', type=str, default='', help='接受的密钥，形如 key1:secret1,key2:secret2，默认接受任意密钥')
+        parser.add_argument('--seed', type=int, default=None, help='随机数种子，用于复现延迟和错误序列')
+
+    def handle(self, *args, **options):
+        config = EmulatorConfig(
+            latency_ms=options['latency_ms'],
+            latency_sigma=options['latency_sigma'],
+            tail_ratio=options['tail_ratio'],
+            tail_ms=options['tail_ms'],
+            error_rate=options['error_rate'],
+            throttle_rate=options['throttle_rate'],
+            qps=options['qps'],
+            api_keys=dict(parse_api_keys(options['api_keys'])),
+            seed=options['seed'],
+        )
+        try:
+            server, _ = create_server(options['host'], options['port'], config)
+        except OSError as e:
+            raise CommandError(f"无法监听 {options['host']}:{options['port']}: {e}")
+
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"Face++模拟服务已启动: http://{host}:{port}/facepp/v3"))
+        self.stdout.write(f"设置 FACE_PLUS_PLUS_API_URL=http://{host}:{port}/facepp/v3 使用模拟服务，"
+                          f"GET http://{host}:{port}/stats 查看请求统计")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+import mimetypes
+import threading
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.encoding import filepath_to_uri
+
+logger = logging.getLogger(__name__)
+
+
+class MediaDelivery:
+    """
+    媒体文件的访问地址和私有文件的下发
+
+    明星照片、镜像和明星缩略图是公开的，由前端的nginx直接从媒体目录读取；用户照片及其缩略图
+    （user_photos/ 下的文件）是私有的，只通过短期有效的签名URL（/api/media/<路径>?e=过期时间&s=签名）访问。
+    Django只校验签名，开启 ACCEL_REDIRECT 时返回 X-Accel-Redirect 头，由nginx的内部location读取文件，
+    Django进程不读写图片内容；未开启时（本地开发）由Django直接返回文件。
+
+    过期时间按 URL_TTL 对齐到时间窗口，同一窗口内同一文件的签名URL相同，浏览器和结果渲染缓存都可以复用，
+    每个URL的剩余有效期在 URL_TTL 和 2*URL_TTL 之间。
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    # 私有文件的路径前缀（相对于MEDIA_ROOT）
+    PRIVATE_PREFIXES = ('user_photos/',)
+
+    def __init__(self, url_ttl=3600, accel_redirect=False, accel_prefix='/protected-media/'):
+        self.url_ttl = url_ttl
+        self.accel_redirect = accel_redirect
+        self.accel_prefix = accel_prefix
+
+    @staticmethod
+    def get_config():
+        """获取媒体文件下发配置"""
+        config = getattr(settings, 'MEDIA_DELIVERY', {})
+        return {
+            'url_ttl': config.get('URL_TTL', 3600),
+            'accel_redirect': config.get('ACCEL_REDIRECT', False),
+            'accel_prefix': config.get('ACCEL_PREFIX', '/protected-media/'),
+        }
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的媒体文件下发配置"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    config = cls.get_config()
+                    cls._default = cls(config['url_ttl'], config['accel_redirect'], config['accel_prefix'])
+        return cls._default
+
+    @classmethod
+    def is_private(cls, name):
+        return name.startswith(cls.PRIVATE_PREFIXES)
+
+    def expires_at(self, now=None):
+        """当前时间窗口的签名过期时间（Unix时间戳）"""
+        now = int(now if now is not None else time.time())
+        return (now // self.url_ttl + 2) * self.url_ttl
+
+    def signature(self, name, expires):
+        return salted_hmac('celebrity_compare.media', f'{name}:{expires}', algorithm='sha256').hexdigest()[:32]
+
+    def url(self, name, request=None):
+        """
+        媒体文件的访问地址，私有文件返回签名URL
+
+        参数:
+            name (str): 相对于MEDIA_ROOT的路径
+            request (HttpRequest, 可选): 提供时返回绝对地址
+        """
+        if not name:
+            return None
+        if self.is_private(name):
+            expires = self.expires_at()
+            url = (f"{reverse('signed-media', args=[name])}"
+                   f"?e={expires}&s={self.signature(name, expires)}")
+        else:
+            url = settings.MEDIA_URL + filepath_to_uri(name)
+        if request:
+            return request.build_absolute_uri(url)
+        return url
+
+    def verify(self, name, expires, signature):
+        """校验签名URL，返回剩余有效秒数（无效或已过期时返回None）"""
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return None
+        remaining = expires - int(time.time())
+        if remaining <= 0 or not signature or not constant_time_compare(signature, self.signature(name, expires)):
+            return None
+        return remaining
+
+    def serve(self, name, max_age):
+        """
+        返回私有文件的响应
+
+        开启 ACCEL_REDIRECT 时只返回 X-Accel-Redirect 头，文件由nginx读取；否则由Django读取文件。
+
+        返回:
+            HttpResponse 或 None: 文件不存在时返回None
+        """
+        path = os.path.normpath(os.path.join(settings.MEDIA_ROOT, name))
+        if not path.startswith(os.path.normpath(str(settings.MEDIA_ROOT)) + os.sep) or not os.path.isfile(path):
+            return None
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if self.accel_redirect:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = self.accel_prefix + quote(name)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        # 签名URL过期前浏览器可以直接使用缓存，不允许共享缓存
+        response['Cache-Control'] = f'private, max-age={max_age}'
+        return response
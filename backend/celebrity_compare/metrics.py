@@ -0,0 +1,210 @@
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的默认分桶（秒），覆盖从单次Face++调用到整个比对
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """指标基类，按标签值分别记录"""
+
+    type_name = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """返回 (后缀, 标签名, 标签值, 额外标签, 值) 列表"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for suffix, labelnames, labelvalues, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labelnames, labelvalues, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """只增不减的计数"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [('_total', self.labelnames, key, None, value) for key, value in values]
+
+
+class Histogram(Metric):
+    """耗时等数值的分布（累积分桶、总和和次数）"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各分桶计数..., +Inf计数, 总和]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块的耗时（无论是否抛出异常）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        samples = []
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += count
+                samples.append(('_bucket', self.labelnames, key, ('le', _format_value(float(bound))), cumulative))
+            samples.append(('_sum', self.labelnames, key, None, round(state[-1], 6)))
+            samples.append(('_count', self.labelnames, key, None, cumulative))
+        return samples
+
+
+class CallbackGauge(Metric):
+    """抓取时通过回调读取的当前值（并发上限、排队数等）"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.error(f"读取指标 {self.name} 时出错: {str(e)}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', self.labelnames, key, None, value) for key, value in sorted(values.items())]
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表，按Prometheus文本格式输出
+
+    指标保存在进程内存中；多进程部署时每个进程分别统计。
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的指标注册表"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    cls._default = cls()
+        return cls._default
+
+    def register(self, metric):
+        """注册指标，同名指标只注册一次（返回已注册的指标）"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def counter(name, documentation, labelnames=()):
+    return MetricsRegistry.get_default().register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return MetricsRegistry.get_default().register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name, documentation, callback, labelnames=()):
+    return MetricsRegistry.get_default().register(CallbackGauge(name, documentation, callback, labelnames))
+
+
+# 比对链路的各阶段：upload_read（读取上传文件）、preprocess（计算内容哈希）、queue_wait（排队）、
+# detect（检测用户照片）、convert（PIL格式转换）、detect_fallback（转换后重新检测）、
+# detect_other_keys（在其他密钥下检测）、fanout（与所有明星比对）、persist（保存结果）、total（从收到请求到结束）
+COMPARISON_STAGE_SECONDS = histogram(
+    'facesim_comparison_stage_seconds', '比对各阶段耗时（秒）', ['stage']
+)
+COMPARISONS = counter(
+    'facesim_comparisons', '比对请求数，按结果统计（completed、failed、rejected、unavailable、deduplicated）', ['outcome']
+)
+FACEPP_REQUEST_SECONDS = histogram(
+    'facesim_facepp_request_seconds', '单次Face++ HTTP请求耗时（秒）', ['endpoint', 'status']
+)
+FACEPP_REQUESTS = counter(
+    'facesim_facepp_requests', 'Face++ HTTP请求数（status: ok、error、throttled、http_5xx、exception）',
+    ['endpoint', 'status']
+)
+FACEPP_SKIPPED = counter(
+    'facesim_facepp_skipped', '未发出的Face++请求数（reason: breaker_open、no_key、deadline、concurrency_timeout、hedge_no_slot）',
+    ['endpoint', 'reason']
+)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celebrity_compare', '0006_comparisonresult_is_public_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celebrity',
+            name='photo_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='照片内容哈希'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 13:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celebrity_compare', '0007_celebrity_photo_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comparisonresult',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='照片内容哈希'),
+        ),
+        migrations.AddField(
+            model_name='comparisonresult',
+            name='idempotency_key',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True, verbose_name='幂等键'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celebrity_compare', '0008_comparisonresult_content_hash_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celebrity',
+            name='face_token_key',
+            field=models.CharField(blank=True, max_length=16, null=True, verbose_name='Token所属密钥'),
+        ),
+    ]
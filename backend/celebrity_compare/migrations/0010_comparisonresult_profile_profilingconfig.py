@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-19 14:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celebrity_compare', '0009_celebrity_face_token_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingConfig',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sample_rate', models.FloatField(default=0, verbose_name='采样比例')),
+                ('profile_next', models.PositiveIntegerField(default=0, verbose_name='分析接下来的比对数')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '采样分析设置',
+                'verbose_name_plural': '采样分析设置',
+            },
+        ),
+        migrations.AddField(
+            model_name='comparisonresult',
+            name='profile',
+            field=models.TextField(blank=True, null=True, verbose_name='采样分析'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-19 14:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celebrity_compare', '0010_comparisonresult_profile_profilingconfig'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComparisonCost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facepp_calls', models.IntegerField(default=0, verbose_name='Face++调用数')),
+                ('calls_by_endpoint', models.JSONField(blank=True, default=dict, verbose_name='各接口调用数')),
+                ('bytes_uploaded', models.BigIntegerField(default=0, verbose_name='上传字节数')),
+                ('retries', models.IntegerField(default=0, verbose_name='换密钥重试次数')),
+                ('hedges', models.IntegerField(default=0, verbose_name='对冲请求数')),
+                ('cache_hits', models.IntegerField(default=0, verbose_name='缓存命中次数')),
+                ('stage_seconds', models.JSONField(blank=True, default=dict, verbose_name='各阶段耗时（秒）')),
+                ('wall_seconds', models.FloatField(default=0, verbose_name='总耗时（秒）')),
+                ('worker_seconds', models.FloatField(default=0, verbose_name='线程池占用时间（秒）')),
+                ('cpu_seconds', models.FloatField(default=0, verbose_name='CPU时间（秒）')),
+                ('path', models.CharField(db_index=True, default='none', max_length=100, verbose_name='处理路径')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='创建时间')),
+                ('comparison', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cost', to='celebrity_compare.comparisonresult', verbose_name='比对结果')),
+            ],
+            options={
+                'verbose_name': '比对资源消耗',
+                'verbose_name_plural': '比对资源消耗',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-19 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('celebrity_compare', '0011_comparisoncost'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='celebrity',
+            index=models.Index(fields=['name', 'id'], name='celebrity_name_id_idx'),
+        ),
+    ]
@@ -8,6 +8,7 @@ class Celebrity(models.Model):
     photo = models.ImageField('照片', upload_to='celebrities/')
     description = models.TextField('描述', blank=True, null=True)
     face_token = models.CharField('Face++ Token', max_length=100, blank=True, null=True)
+    face_token_key = models.CharField('Token所属密钥', max_length=16, blank=True, null=True)  # face_token只在生成它的密钥下有效
     birth_date = models.DateField('出生日期', blank=True, null=True)
     detail_url = models.URLField('详情链接', max_length=500, blank=True, null=True)
     source = models.CharField('来源', max_length=50, blank=True, null=True)
@@ -15,6 +16,7 @@ class Celebrity(models.Model):
     nationality = models.CharField('国籍', max_length=50, blank=True, null=True)
     occupation = models.CharField('职业', max_length=100, blank=True, null=True)
     works = models.TextField('代表作品', blank=True, null=True)
+    photo_hash = models.CharField('照片内容哈希', max_length=64, blank=True, null=True, db_index=True)  # 本地镜像中的SHA-256
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
 
@@ -24,6 +26,9 @@ class Celebrity(models.Model):
     class Meta:
         verbose_name = '名人'
         verbose_name_plural = '名人列表'
+        indexes = [
+            models.Index(fields=['name', 'id'], name='celebrity_name_id_idx'),  # 明星列表按姓名的游标分页
+        ]
 
 
 class ComparisonResult(models.Model):
@@ -43,6 +48,9 @@ class ComparisonResult(models.Model):
     message = models.TextField('处理消息', blank=True, null=True)  # 添加消息字段，用于存储错误信息
     is_public = models.BooleanField('是否公开分享', default=False)  # 添加字段标记是否可公开访问
     share_code = models.CharField('分享码', max_length=20, blank=True, null=True)  # 可选的短分享码
+    content_hash = models.CharField('照片内容哈希', max_length=64, blank=True, null=True, db_index=True)  # 用于合并重复上传
+    idempotency_key = models.CharField('幂等键', max_length=100, blank=True, null=True, db_index=True)  # 客户端提供的Idempotency-Key
+    profile = models.TextField('采样分析', blank=True, null=True)  # 折叠调用栈格式，可用flamegraph.pl或speedscope生成火焰图
     
     def __str__(self):
         return f"比对结果 {self.id} ({self.created_at.strftime('%Y-%m-%d %H:%M')})"
@@ -69,9 +77,53 @@ class ComparisonDetail(models.Model):
     similarity = models.FloatField('相似度')
     
     def __str__(self):
-        return f"{self.comparison.id} - {self.celebrity.name} ({self.similarity:.1f}%)"
+        return f"{self.comparison_id} - {self.celebrity.name} ({self.similarity:.1f}%)"
     
     class Meta:
         verbose_name = '比对详情'
         verbose_name_plural = '比对详情列表'
         ordering = ['-similarity']
+
+
+class ProfilingConfig(models.Model):
+    """比对采样分析设置（只使用第一条记录）"""
+    sample_rate = models.FloatField('采样比例', default=0)  # 0-1，按比例随机对比对开启采样分析
+    profile_next = models.PositiveIntegerField('分析接下来的比对数', default=0)  # 每开启一次分析减1
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    def __str__(self):
+        return f"采样比例 {self.sample_rate:.2%}，待分析 {self.profile_next} 个比对"
+
+    class Meta:
+        verbose_name = '采样分析设置'
+        verbose_name_plural = '采样分析设置'
+
+
+class ComparisonCost(models.Model):
+    """比对的资源消耗（Face++调用数、上传字节数、各阶段耗时等）"""
+    comparison = models.OneToOneField(
+        ComparisonResult,
+        on_delete=models.CASCADE,
+        related_name='cost',
+        verbose_name='比对结果'
+    )
+    facepp_calls = models.IntegerField('Face++调用数', default=0)  # 实际发出的HTTP请求，包括重试和对冲
+    calls_by_endpoint = models.JSONField('各接口调用数', default=dict, blank=True)
+    bytes_uploaded = models.BigIntegerField('上传字节数', default=0)
+    retries = models.IntegerField('换密钥重试次数', default=0)
+    hedges = models.IntegerField('对冲请求数', default=0)
+    cache_hits = models.IntegerField('缓存命中次数', default=0)
+    stage_seconds = models.JSONField('各阶段耗时（秒）', default=dict, blank=True)
+    wall_seconds = models.FloatField('总耗时（秒）', default=0)  # 从收到请求到比对结束，包括排队
+    worker_seconds = models.FloatField('线程池占用时间（秒）', default=0)
+    cpu_seconds = models.FloatField('CPU时间（秒）', default=0)
+    path = models.CharField('处理路径', max_length=100, default='none', db_index=True)  # 如 fanout+pil_fallback
+    created_at = models.DateTimeField('创建时间', auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.comparison_id} ({self.path}, {self.facepp_calls} 次调用)"
+
+    class Meta:
+        verbose_name = '比对资源消耗'
+        verbose_name_plural = '比对资源消耗'
+        ordering = ['-created_at']
@@ -0,0 +1,14 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CelebrityCursorPagination(CursorPagination):
+    """
+    明星列表的游标分页
+
+    按姓名（相同时按ID）排序，翻页使用上一页最后一行的位置作为条件，
+    深翻页不需要OFFSET扫描之前的所有行，也不需要统计总数。
+    """
+    ordering = ('name', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,187 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoMirror:
+    """
+    明星照片本地镜像存储（按内容寻址）
+
+    - 图片内容按 SHA-256 存放在 objects/<哈希前两位>/<哈希><扩展名>，相同内容只保存一份
+    - 源URL到内容的映射存放在 refs/<URL的SHA-1>，文件内容为对象的相对路径
+    镜像只需填充一次，之后生成token、缩略图、重新检测都直接读取本地磁盘。
+    """
+
+    _session = None
+    _session_lock = threading.Lock()
+
+    @staticmethod
+    def get_root():
+        """获取镜像根目录"""
+        return getattr(settings, 'PHOTO_MIRROR_DIR', os.path.join(settings.MEDIA_ROOT, 'mirror'))
+
+    @staticmethod
+    def normalize_url(url):
+        """规范化图片URL，补全协议头"""
+        if not url or not isinstance(url, str):
+            return None
+        url = url.strip()
+        if url.startswith('//'):
+            url = 'https:' + url
+        if not (url.startswith('http://') or url.startswith('https://')):
+            return None
+        return url
+
+    @staticmethod
+    def guess_extension(data):
+        """根据文件头判断图片扩展名"""
+        if data[:3] == b'\xff\xd8\xff':
+            return '.jpg'
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            return '.png'
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return '.gif'
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return '.webp'
+        if data[:2] == b'BM':
+            return '.bmp'
+        return '.jpg'
+
+    @staticmethod
+    def _ref_path(url):
+        """URL映射文件路径"""
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(PhotoMirror.get_root(), 'refs', url_hash[:2], url_hash)
+
+    @staticmethod
+    def _atomic_write(path, data):
+        """先写临时文件再原子替换，避免并发写入时读到半个文件"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def object_path(object_name):
+        """内容对象的绝对路径"""
+        return os.path.join(PhotoMirror.get_root(), 'objects', object_name)
+
+    @staticmethod
+    def store(data, url=None):
+        """
+        保存图片内容到镜像
+
+        参数:
+            data (bytes): 图片数据
+            url (str, 可选): 图片源URL，提供时同时记录URL映射
+
+        返回:
+            str: 内容的SHA-256哈希
+        """
+        content_hash = hashlib.sha256(data).hexdigest()
+        object_name = f"{content_hash[:2]}/{content_hash}{PhotoMirror.guess_extension(data)}"
+        path = PhotoMirror.object_path(object_name)
+
+        # 内容已存在则不重复写入
+        if not os.path.exists(path):
+            PhotoMirror._atomic_write(path, data)
+
+        url = PhotoMirror.normalize_url(url)
+        if url:
+            PhotoMirror._atomic_write(PhotoMirror._ref_path(url), object_name.encode('utf-8'))
+        return content_hash
+
+    @staticmethod
+    def lookup(url):
+        """
+        查找URL对应的本地镜像文件
+
+        返回:
+            str 或 None: 本地文件路径或None（未镜像）
+        """
+        url = PhotoMirror.normalize_url(url)
+        if not url:
+            return None
+        ref_path = PhotoMirror._ref_path(url)
+        try:
+            with open(ref_path, 'r', encoding='utf-8') as f:
+                object_name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        path = PhotoMirror.object_path(object_name)
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def hash_for_url(url):
+        """获取已镜像URL的内容哈希，未镜像时返回None"""
+        path = PhotoMirror.lookup(url)
+        if not path:
+            return None
+        return os.path.splitext(os.path.basename(path))[0]
+
+    @staticmethod
+    def read(url):
+        """读取已镜像的图片数据，未镜像时返回None"""
+        path = PhotoMirror.lookup(url)
+        if not path:
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def get_session():
+        """共享的HTTP会话，复用连接"""
+        if PhotoMirror._session is None:
+            with PhotoMirror._session_lock:
+                if PhotoMirror._session is None:
+                    PhotoMirror._session = requests.Session()
+        return PhotoMirror._session
+
+    @staticmethod
+    def fetch(url, timeout=10, headers=None):
+        """
+        获取图片数据：优先读取本地镜像，未命中时从源站下载并写入镜像
+
+        返回:
+            bytes 或 None: 图片数据或None（如果出错）
+        """
+        normalized_url = PhotoMirror.normalize_url(url)
+        if not normalized_url:
+            logger.error(f"无效的图片URL: {url}")
+            return None
+        url = normalized_url
+
+        data = PhotoMirror.read(url)
+        if data:
+            return data
+
+        try:
+            logger.info(f"镜像未命中，正在从源站下载图片: {url[:50]}...")
+            response = PhotoMirror.get_session().get(url, headers=headers, timeout=timeout)
+            if response.status_code != 200 or not response.content:
+                logger.error(f"下载图片失败，状态码: {response.status_code}")
+                return None
+            data = response.content
+        except Exception as e:
+            logger.error(f"下载图片时出错: {str(e)}")
+            return None
+
+        try:
+            PhotoMirror.store(data, url)
+        except OSError as e:
+            # 写入镜像失败不影响本次使用
+            logger.error(f"写入图片镜像时出错: {str(e)}")
+        return data
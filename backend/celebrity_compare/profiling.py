@@ -0,0 +1,223 @@
+import os
+import sys
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SamplingProfiler:
+    """
+    比对任务的采样分析器
+
+    后台线程每隔 interval 秒读取一次被跟踪线程（请求线程、比对线程和比对线程池中的线程）的调用栈，
+    按折叠调用栈格式（每行“根;...;叶 样本数”）累计，可以直接用 flamegraph.pl 或 speedscope 生成火焰图。
+    只有开启分析的比对才会启动采样线程，未开启时没有额外开销。
+
+    开启方式（任一满足即可）：
+    - 请求头 X-Profile-Token 与 COMPARISON_PROFILING_TOKEN 一致（未配置令牌时不接受请求头）
+    - 管理后台“采样分析设置”中的“分析接下来的比对数”大于0，每开启一次减1
+    - 按采样比例随机开启（配置 COMPARISON_PROFILING_SAMPLE_RATE 与后台设置中较大的一个）
+    """
+
+    # 线程ident -> 该线程所属的分析器
+    _threads = {}
+    _threads_lock = threading.Lock()
+    # 后台设置的缓存：(读取时间, 采样比例, 待分析的比对数)
+    _admin_config = None
+    _admin_config_lock = threading.Lock()
+    ADMIN_CONFIG_TTL = 5.0
+
+    def __init__(self, interval=0.005, max_seconds=120.0, max_stacks=5000, reason=None):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.max_stacks = max_stacks
+        self.reason = reason
+        # 开启分析的比对ID，请求没有启动比对（重复请求、被拒绝）时为None
+        self.comparison_id = None
+        self._tracked = {}
+        self._stacks = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.samples = 0
+        self.started_at = None
+        self.duration = 0.0
+
+    @staticmethod
+    def get_config():
+        """获取采样分析配置"""
+        config = getattr(settings, 'COMPARISON_PROFILING', {})
+        return {
+            'sample_rate': config.get('SAMPLE_RATE', 0.0),
+            'token': config.get('TOKEN', ''),
+            'interval': config.get('INTERVAL_MS', 5) / 1000.0,
+            'max_seconds': config.get('MAX_SECONDS', 120.0),
+            'max_stacks': config.get('MAX_STACKS', 5000),
+        }
+
+    @classmethod
+    def for_request(cls, request):
+        """
+        判断请求是否开启采样分析
+
+        返回:
+            SamplingProfiler: 开启时返回尚未启动的分析器，否则返回None
+        """
+        config = cls.get_config()
+        token = config['token']
+        reason = None
+        if token and request.headers.get('X-Profile-Token') == token:
+            reason = 'header'
+        elif cls._claim_admin_request():
+            reason = 'admin'
+        else:
+            sample_rate = max(config['sample_rate'], cls._admin_sample_rate())
+            if sample_rate > 0 and random.random() < sample_rate:
+                reason = 'sampled'
+        if reason is None:
+            return None
+        return cls(config['interval'], config['max_seconds'], config['max_stacks'], reason=reason)
+
+    @classmethod
+    def _load_admin_config(cls):
+        """读取后台设置（缓存 ADMIN_CONFIG_TTL 秒，避免每个上传请求都查询数据库）"""
+        now = time.monotonic()
+        with cls._admin_config_lock:
+            if cls._admin_config is not None and now - cls._admin_config[0] < cls.ADMIN_CONFIG_TTL:
+                return cls._admin_config
+        from .models import ProfilingConfig
+        try:
+            config = ProfilingConfig.objects.order_by('id').first()
+        except Exception as e:
+            logger.error(f"读取采样分析设置时出错: {str(e)}")
+            config = None
+        cached = (now, config.sample_rate if config else 0.0, config.profile_next if config else 0,
+                  config.id if config else None)
+        with cls._admin_config_lock:
+            cls._admin_config = cached
+        return cached
+
+    @classmethod
+    def _admin_sample_rate(cls):
+        return cls._load_admin_config()[1]
+
+    @classmethod
+    def _claim_admin_request(cls):
+        """后台要求分析接下来的比对时占用一次（数据库中原子地减1）"""
+        _, _, profile_next, config_id = cls._load_admin_config()
+        if not profile_next:
+            return False
+        from django.db.models import F
+        from .models import ProfilingConfig
+        claimed = ProfilingConfig.objects.filter(id=config_id, profile_next__gt=0).update(
+            profile_next=F('profile_next') - 1
+        )
+        cls.invalidate_admin_config()
+        return claimed > 0
+
+    @classmethod
+    def invalidate_admin_config(cls):
+        """后台设置变更后清除缓存"""
+        with cls._admin_config_lock:
+            cls._admin_config = None
+
+    @classmethod
+    def current(cls):
+        """当前线程所属的分析器，未开启分析时为None"""
+        with cls._threads_lock:
+            return cls._threads.get(threading.get_ident())
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='comparison-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止采样，返回折叠调用栈文本"""
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self.started_at is not None:
+            self.duration = time.monotonic() - self.started_at
+        return self.collapsed()
+
+    @contextmanager
+    def attach(self, label):
+        """在代码块执行期间采样当前线程，label 作为调用栈的根"""
+        ident = threading.get_ident()
+        with self._lock:
+            self._tracked[ident] = label
+        with SamplingProfiler._threads_lock:
+            SamplingProfiler._threads[ident] = self
+        try:
+            yield self
+        finally:
+            with SamplingProfiler._threads_lock:
+                if SamplingProfiler._threads.get(ident) is self:
+                    del SamplingProfiler._threads[ident]
+            with self._lock:
+                self._tracked.pop(ident, None)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if time.monotonic() - self.started_at > self.max_seconds:
+                logger.warning(f"采样分析超过 {self.max_seconds} 秒，停止采样")
+                break
+            with self._lock:
+                tracked = list(self._tracked.items())
+            if not tracked:
+                continue
+            frames = sys._current_frames()
+            for ident, label in tracked:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self._record(self._collapse(frame, label))
+            del frames
+
+    def _record(self, stack):
+        with self._lock:
+            if stack not in self._stacks and len(self._stacks) >= self.max_stacks:
+                # 不同调用栈过多时不再细分，避免占用过多内存
+                stack = stack.split(';', 1)[0] + ';[其他]'
+            self._stacks[stack] = self._stacks.get(stack, 0) + 1
+            self.samples += 1
+
+    def _collapse(self, frame, label):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({self._short_path(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        names.append(label)
+        return ';'.join(reversed(names))
+
+    def _short_path(self, filename):
+        """源文件路径缩写为项目内或site-packages内的相对路径"""
+        path = self._paths.get(filename)
+        if path is None:
+            base_dir = str(settings.BASE_DIR)
+            if filename.startswith(base_dir + os.sep):
+                path = os.path.relpath(filename, base_dir)
+            elif 'site-packages' + os.sep in filename:
+                path = filename.split('site-packages' + os.sep, 1)[1]
+            else:
+                path = os.path.basename(filename)
+            self._paths[filename] = path
+        return path
+
+    def collapsed(self):
+        """折叠调用栈文本，按样本数降序"""
+        with self._lock:
+            stacks = sorted(self._stacks.items(), key=lambda item: item[1], reverse=True)
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+
+def profile_thread(profiler, label):
+    """profiler 不为None时在代码块执行期间采样当前线程"""
+    return profiler.attach(label) if profiler is not None else nullcontext()
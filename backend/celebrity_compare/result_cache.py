@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from rest_framework.renderers import JSONRenderer
+from .metrics import counter
+from .media_delivery import MediaDelivery
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_REQUESTS = counter(
+    'facesim_result_cache_requests', '比对结果详情的渲染缓存查询数（outcome: hit、miss、not_modified）', ['outcome']
+)
+
+
+class ResultRenderCache:
+    """
+    已完成比对结果的渲染缓存
+
+    比对完成后结果不再变化，详情接口把序列化后的JSON连同强ETag（内容的sha256）、session_id和is_public
+    一起缓存，之后的请求（包括分享链接的每次访问）只做权限检查，不再查询数据库和序列化明星数据；
+    请求带有匹配的 If-None-Match 时返回304。比对结果或其中明星的资料变更时通过信号清除缓存（见signals.py）。
+
+    缓存使用Django的缓存后端（未配置CACHES时为进程内存）；多进程部署时需要配置共享的缓存后端，
+    否则一个进程中的清除不会影响其他进程。
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    KEY_PREFIX = 'comparison_result:'
+
+    def __init__(self, timeout=3600, max_age=60):
+        self.timeout = timeout
+        self.max_age = max_age
+
+    @staticmethod
+    def get_config():
+        """获取渲染缓存配置"""
+        config = getattr(settings, 'COMPARISON_RESULT_CACHE', {})
+        return {
+            'timeout': config.get('TIMEOUT', 3600),
+            'max_age': config.get('MAX_AGE', 60),
+        }
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的渲染缓存"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    config = cls.get_config()
+                    cls._default = cls(config['timeout'], config['max_age'])
+        return cls._default
+
+    @property
+    def cache(self):
+        return caches['default']
+
+    def key(self, comparison_id):
+        return f'{self.KEY_PREFIX}{comparison_id}'
+
+    def get(self, comparison_id):
+        """
+        读取缓存的渲染结果
+
+        返回:
+            dict 或 None: body、etag、session_id、is_public，未缓存时为None
+        """
+        if self.timeout <= 0:
+            return None
+        try:
+            entry = self.cache.get(self.key(comparison_id))
+        except Exception as e:
+            logger.error(f"读取比对结果缓存时出错: {str(e)}")
+            entry = None
+        RESULT_CACHE_REQUESTS.inc(outcome='hit' if entry is not None else 'miss')
+        return entry
+
+    def store(self, comparison, data):
+        """
+        渲染并缓存已完成的比对结果
+
+        参数:
+            comparison (ComparisonResult): 比对结果
+            data (dict): 序列化后的数据
+
+        返回:
+            dict: 渲染结果
+        """
+        body = JSONRenderer().render(data)
+        entry = {
+            'body': body,
+            'etag': quote_etag(hashlib.sha256(body).hexdigest()),
+            'session_id': comparison.session_id,
+            'is_public': comparison.is_public,
+        }
+        if self.timeout > 0:
+            # 结果中用户照片的签名URL至少还有 URL_TTL 秒有效，缓存时间不超过它
+            timeout = min(self.timeout, MediaDelivery.get_default().url_ttl)
+            try:
+                self.cache.set(self.key(comparison.id), entry, timeout)
+            except Exception as e:
+                logger.error(f"写入比对结果缓存时出错: {str(e)}")
+        return entry
+
+    def invalidate(self, comparison_ids):
+        """清除比对结果的缓存（单个ID或ID列表）"""
+        if not isinstance(comparison_ids, (list, tuple, set)):
+            comparison_ids = [comparison_ids]
+        keys = [self.key(comparison_id) for comparison_id in comparison_ids]
+        if not keys:
+            return
+        try:
+            self.cache.delete_many(keys)
+        except Exception as e:
+            logger.error(f"清除比对结果缓存时出错: {str(e)}")
+
+    def respond(self, request, entry, is_public_request):
+        """
+        按缓存的渲染结果返回响应，If-None-Match 与ETag匹配时返回304
+
+        公开链接的响应允许共享缓存（public），通过session_id访问的响应只允许浏览器缓存（private）；
+        max-age 过后客户端带ETag重新验证。
+        """
+        cache_control = f"{'public' if is_public_request else 'private'}, max-age={self.max_age}"
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and _etag_matches(entry['etag'], if_none_match):
+            RESULT_CACHE_REQUESTS.inc(outcome='not_modified')
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(entry['body'], content_type='application/json')
+        response['ETag'] = entry['etag']
+        response['Cache-Control'] = cache_control
+        return response
+
+
+def _etag_matches(etag, if_none_match):
+    # If-None-Match 使用弱比较：忽略 W/ 前缀
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in etags)
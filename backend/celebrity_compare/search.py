@@ -0,0 +1,229 @@
+import logging
+import threading
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Q
+from .models import Celebrity
+from .metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+# SQLite FTS5 索引表（external content，不重复保存文本，rowid 即明星ID）
+FTS_TABLE = 'celebrity_search'
+FTS_COLUMNS = ('name', 'occupation', 'works')
+# 排序时各列的权重（bm25），姓名匹配优先
+FTS_WEIGHTS = (10.0, 2.0, 1.0)
+# 模糊匹配最多使用的三元组数
+MAX_FUZZY_TRIGRAMS = 16
+
+SEARCH_SECONDS = histogram(
+    'facesim_celebrity_search_seconds', '明星搜索耗时（秒）', ['backend'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+)
+
+
+def _fts_statements(celebrity_table):
+    columns = ', '.join(FTS_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in FTS_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in FTS_COLUMNS)
+    # 用触发器维护索引：bulk_create、bulk_update 和 update() 不发送信号，触发器对所有写入都生效
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{columns}, content='{celebrity_table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {celebrity_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {celebrity_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {celebrity_table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+    ]
+
+
+def create_fts_index(db_connection, rebuild=False):
+    """
+    创建FTS5索引表和维护索引的触发器（只支持SQLite，需要3.34以上的trigram分词器）
+
+    已存在的表和触发器会保留（迁移重建明星表时触发器会随旧表删除，需要重新创建）；
+    索引表是新建的或 rebuild 为True时从明星表重建索引。
+
+    返回:
+        bool: 是否可以使用索引（非SQLite或SQLite不支持时返回False）
+    """
+    if db_connection.vendor != 'sqlite':
+        return False
+    try:
+        with db_connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            existed = cursor.fetchone() is not None
+            for statement in _fts_statements(Celebrity._meta.db_table):
+                cursor.execute(statement)
+            if rebuild or not existed:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    except Exception as e:
+        logger.warning(f"当前SQLite不支持FTS5 trigram索引，明星搜索使用普通查询: {str(e)}")
+        return False
+    finally:
+        CelebritySearchIndex.get_default().reset()
+    return True
+
+
+def ensure_search_index(using='default', **kwargs):
+    """迁移后（post_migrate）确保索引表和触发器存在"""
+    create_fts_index(connections[using])
+
+
+def drop_fts_index(db_connection):
+    if db_connection.vendor != 'sqlite':
+        return
+    with db_connection.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    CelebritySearchIndex.get_default().reset()
+
+
+def _quote(term):
+    """FTS5查询中的短语（双引号内的双引号需要重复）"""
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _trigrams(text):
+    return list(dict.fromkeys(text[index:index + 3] for index in range(len(text) - 2)))
+
+
+class CelebritySearchIndex:
+    """
+    明星搜索（姓名、职业、代表作品）
+
+    按以下顺序合并结果，直到达到数量上限：
+    1. 姓名前缀匹配（用于输入联想，使用姓名索引的范围查询）
+    2. 子串匹配：SQLite上使用FTS5 trigram索引按bm25排序（姓名权重最高），查询不足3个字时只匹配姓名
+    3. 模糊匹配：查询的三元组任意命中即可（容忍个别错字），命中越多越靠前
+
+    非SQLite数据库或SQLite不支持FTS5 trigram时使用普通的前缀和 icontains 查询（需要扫描表，只适合较小的明星库）。
+    索引由触发器在写入明星时增量维护，python manage.py rebuild_search_index 可以重建。
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, backend='auto', default_limit=10, max_limit=50):
+        self.backend = backend
+        self.default_limit = default_limit
+        self.max_limit = max_limit
+        self._fts_available = None
+
+    @staticmethod
+    def get_config():
+        """获取明星搜索配置"""
+        config = getattr(settings, 'CELEBRITY_SEARCH', {})
+        return {
+            'backend': config.get('BACKEND', 'auto'),
+            'default_limit': config.get('DEFAULT_LIMIT', 10),
+            'max_limit': config.get('MAX_LIMIT', 50),
+        }
+
+    @classmethod
+    def get_default(cls):
+        """进程内共享的搜索实例"""
+        if cls._default is None:
+            with cls._default_lock:
+                if cls._default is None:
+                    config = cls.get_config()
+                    cls._default = cls(config['backend'], config['default_limit'], config['max_limit'])
+        return cls._default
+
+    def use_fts(self):
+        """是否使用FTS5索引（结果缓存，重建索引后调用 reset）"""
+        if self.backend == 'basic' or connection.vendor != 'sqlite':
+            return False
+        if self._fts_available is None:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                self._fts_available = cursor.fetchone() is not None
+            if not self._fts_available:
+                logger.warning("明星搜索索引不存在，使用普通查询（可运行 rebuild_search_index 创建）")
+        return self._fts_available
+
+    def reset(self):
+        self._fts_available = None
+
+    def search(self, query, limit=None):
+        """
+        搜索明星
+
+        返回:
+            tuple: (按相关性排序的明星ID列表, 使用的后端 fts5 或 basic)
+        """
+        query = ' '.join((query or '').split())
+        limit = min(limit or self.default_limit, self.max_limit)
+        if not query or limit <= 0:
+            return [], 'none'
+        backend = 'fts5' if self.use_fts() else 'basic'
+        with SEARCH_SECONDS.time(backend=backend):
+            ids = self._prefix(query, limit)
+            if len(ids) < limit:
+                search = self._search_fts if backend == 'fts5' else self._search_basic
+                for celebrity_id in search(query, limit):
+                    if celebrity_id not in ids:
+                        ids.append(celebrity_id)
+                        if len(ids) >= limit:
+                            break
+        return ids, backend
+
+    def _prefix(self, query, limit):
+        # 范围条件可以使用 (name, id) 索引，不受LIKE大小写规则影响
+        return list(
+            Celebrity.objects.filter(name__gte=query, name__lt=query + '\U0010ffff')
+            .order_by('name', 'id').values_list('id', flat=True)[:limit]
+        )
+
+    def _search_fts(self, query, limit):
+        if len(query) < 3:
+            # trigram索引无法匹配不足3个字的子串，只在姓名和职业中查找（找到足够的结果即停止扫描）
+            return list(
+                Celebrity.objects.filter(Q(name__contains=query) | Q(occupation__contains=query))
+                .values_list('id', flat=True)[:limit]
+            )
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        ids = self._fts_query(_quote(query), weights, limit)
+        if len(ids) < limit:
+            trigrams = _trigrams(query.replace(' ', ''))[:MAX_FUZZY_TRIGRAMS]
+            if len(trigrams) > 1:
+                fuzzy = self._fts_query(' OR '.join(_quote(trigram) for trigram in trigrams), weights, limit * 2)
+            elif not ids:
+                # 3个字的查询（常见的姓名长度）只有一个三元组，没有完全匹配时在姓名中匹配任意一个字不同的写法
+                fuzzy = self._fuzzy_name(query, limit * 2)
+            else:
+                fuzzy = []
+            ids.extend(celebrity_id for celebrity_id in fuzzy if celebrity_id not in ids)
+        return ids[:limit]
+
+    def _fts_query(self, match, weights, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s",
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _fuzzy_name(self, query, limit):
+        """姓名中任意一个字替换为通配符后匹配（扫描明星表，找到足够的结果即停止）"""
+        escaped = [char.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for char in query]
+        patterns = [
+            '%' + ''.join(escaped[:index]) + '_' + ''.join(escaped[index + 1:]) + '%' for index in range(len(query))
+        ]
+        where = ' OR '.join(["name LIKE %s ESCAPE '\\'"] * len(patterns))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT id FROM {Celebrity._meta.db_table} WHERE {where} LIMIT %s", patterns + [limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _search_basic(self, query, limit):
+        condition = Q()
+        for column in FTS_COLUMNS:
+            condition |= Q(**{f'{column}__icontains': query})
+        return list(Celebrity.objects.filter(condition).order_by('name', 'id').values_list('id', flat=True)[:limit])
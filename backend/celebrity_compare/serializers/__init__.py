@@ -1,19 +1,74 @@
+from django.conf import settings
+from django.db.models import Prefetch
+from django.utils.encoding import filepath_to_uri
 from rest_framework import serializers
 from celebrity_compare.models import Celebrity, ComparisonResult, ComparisonDetail
+from celebrity_compare.thumbnails import ThumbnailService
+from celebrity_compare.media_delivery import MediaDelivery
+
+
+def details_prefetch():
+    """比对详情连同明星一起预取（按相似度降序），序列化details时不再逐条查询明星"""
+    return Prefetch('details', queryset=ComparisonDetail.objects.select_related('celebrity'))
+
+
+def get_thumbnail_urls(image_field, request=None):
+    """获取图片各尺寸缩略图的URL，尚未生成的尺寸提交到进程池异步生成，本次为None"""
+    return {
+        size: ThumbnailService.get_thumbnail_url(image_field, size, request, generate=False)
+        for size in ThumbnailService.get_config()['sizes']
+    }
 
 
 class CelebritySerializer(serializers.ModelSerializer):
+    """
+    明星信息
+
+    参数 fields 只输出指定的字段（用于列表接口的 fields= 参数和精简列表）；
+    只返回已生成的缩略图，尚未生成的提交到进程池异步生成，不在请求中生成。
+    """
     # 添加自定义字段处理外部URL
     photo_url = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
+
+    # 列表接口默认输出的精简字段（不含较长的描述和代表作品）
+    COMPACT_FIELDS = ['id', 'name', 'photo_url', 'thumbnails', 'nationality', 'occupation']
+    # 序列化字段依赖的模型字段，用于 .only() 只读取需要的列
+    MODEL_FIELDS = {'photo': ['photo'], 'photo_url': ['photo'], 'thumbnails': ['photo']}
     
     class Meta:
         model = Celebrity
         fields = [
-            'id', 'name', 'photo', 'photo_url', 'description', 
+            'id', 'name', 'photo', 'photo_url', 'thumbnails', 'description', 
             'detail_url', 'birth_date', 'nationality', 
             'occupation', 'works', 'created_at'
         ]
         read_only_fields = ['id', 'created_at']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def model_fields_for(cls, fields):
+        """序列化字段对应的模型字段列表"""
+        model_fields = []
+        for name in fields:
+            for model_field in cls.MODEL_FIELDS.get(name, [name]):
+                if model_field not in model_fields:
+                    model_fields.append(model_field)
+        return model_fields
+
+    def media_url(self, name):
+        """媒体文件的URL，绝对地址前缀在同一次序列化中只构造一次（列表中不再逐行调用 build_absolute_uri）"""
+        base_url = getattr(self, '_media_base_url', None)
+        if base_url is None:
+            request = self.context.get('request')
+            base_url = request.build_absolute_uri(settings.MEDIA_URL) if request else settings.MEDIA_URL
+            self._media_base_url = base_url
+        return base_url + filepath_to_uri(name)
     
     def get_photo_url(self, obj):
         """
@@ -24,12 +79,19 @@ class CelebritySerializer(serializers.ModelSerializer):
             # 直接使用外部URL，不需要本地路径处理
             return str(obj.photo)
         elif obj.photo:
-            # 本地媒体文件，通过request构建完整URL
-            request = self.context.get('request')
-            if request:
-                return request.build_absolute_uri(obj.photo.url)
-            return obj.photo.url
+            # 本地媒体文件
+            return self.media_url(obj.photo.name)
         return None
+    
+    def get_thumbnails(self, obj):
+        """明星照片缩略图URL，按尺寸名索引，尚未生成的尺寸为None"""
+        if not obj.photo:
+            return None
+        thumbnails = {}
+        for size in ThumbnailService.get_config()['sizes']:
+            name = ThumbnailService.get_thumbnail(obj.photo, size, generate=False)
+            thumbnails[size] = self.media_url(name) if name else None
+        return thumbnails
 
 
 class ComparisonDetailSerializer(serializers.ModelSerializer):
@@ -42,11 +104,30 @@ class ComparisonDetailSerializer(serializers.ModelSerializer):
 
 class ComparisonResultSerializer(serializers.ModelSerializer):
     details = ComparisonDetailSerializer(many=True, read_only=True)
+    # 用户照片是私有文件，返回短期有效的签名URL
+    user_photo = serializers.SerializerMethodField()
+    user_photo_thumbnails = serializers.SerializerMethodField()
     
     class Meta:
         model = ComparisonResult
-        fields = ['id', 'user_photo', 'created_at', 'details']
+        fields = ['id', 'user_photo', 'user_photo_thumbnails', 'created_at', 'details']
         read_only_fields = ['id', 'created_at']
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """预取序列化所需的关联数据，查询数不随比对详情数增加"""
+        return queryset.prefetch_related(details_prefetch())
+    
+    def get_user_photo(self, obj):
+        if not obj.user_photo:
+            return None
+        return MediaDelivery.get_default().url(obj.user_photo.name, self.context.get('request'))
+
+    def get_user_photo_thumbnails(self, obj):
+        """用户照片缩略图URL，按尺寸名索引"""
+        if not obj.user_photo:
+            return None
+        return get_thumbnail_urls(obj.user_photo, self.context.get('request'))
         
 
 class PhotoUploadSerializer(serializers.Serializer):
@@ -0,0 +1,39 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Celebrity, ComparisonResult, ComparisonDetail
+from .result_cache import ResultRenderCache
+
+# 比对结果详情中展示的明星字段，只更新其他字段（如face_token）时不需要清除缓存
+RENDERED_CELEBRITY_FIELDS = {
+    'name', 'photo', 'description', 'detail_url', 'birth_date', 'nationality', 'occupation', 'works',
+}
+
+
+def invalidate_celebrity_results(celebrity_ids):
+    """清除包含这些明星的比对结果缓存"""
+    comparison_ids = set(
+        ComparisonDetail.objects.filter(celebrity_id__in=list(celebrity_ids)).values_list('comparison_id', flat=True)
+    )
+    ResultRenderCache.get_default().invalidate(list(comparison_ids))
+
+
+@receiver(post_save, sender=ComparisonResult, dispatch_uid='result_cache_comparison_saved')
+@receiver(post_delete, sender=ComparisonResult, dispatch_uid='result_cache_comparison_deleted')
+def comparison_changed(sender, instance, **kwargs):
+    # 包括设置公开分享（ShareComparisonAPIView）和后台的修改
+    ResultRenderCache.get_default().invalidate(instance.pk)
+
+
+@receiver(post_save, sender=ComparisonDetail, dispatch_uid='result_cache_detail_saved')
+@receiver(post_delete, sender=ComparisonDetail, dispatch_uid='result_cache_detail_deleted')
+def comparison_detail_changed(sender, instance, **kwargs):
+    # 删除明星时级联删除的比对详情也会触发
+    ResultRenderCache.get_default().invalidate(instance.comparison_id)
+
+
+@receiver(post_save, sender=Celebrity, dispatch_uid='result_cache_celebrity_saved')
+def celebrity_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not RENDERED_CELEBRITY_FIELDS.intersection(update_fields)):
+        return
+    invalidate_celebrity_results([instance.pk])
+
@@ -1,3 +1,1560 @@
-from django.test import TestCase
+import io
+import os
+import sys
+import json
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import concurrent.futures
+import requests
+from datetime import timedelta
+from unittest import mock
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+from .models import Celebrity, ComparisonResult, ComparisonDetail, ComparisonCost
+from .serializers import CelebritySerializer, ComparisonResultSerializer
+from .media_delivery import MediaDelivery
+from .catalogue import CelebrityJsonlWriter, bulk_upsert_celebrities
+from .photo_mirror import PhotoMirror
+from .thumbnails import ThumbnailService, render_thumbnail
+from .admission import AdmissionController, AdmissionRejected
+from .circuit_breaker import CircuitBreaker
+from .hedging import RequestHedger
+from .metrics import CallbackGauge, Counter, Histogram, MetricsRegistry
+from .logging_utils import (
+    LOG_RECORDS, ContextFilter, JsonFormatter, NonBlockingHandler, StageSamplingFilter, get_log_context, log_context
+)
+from .concurrency_limiter import AdaptiveConcurrencyLimiter
+from .deadline import Deadline
+from .facepp_emulator import EmulatorConfig, EmulatorError, FacePPEmulator, create_server
+from .facepp_keys import FacePPKeyPool, make_key_id
+from .facepp_utils import FacePPAPI
+from .profiling import SamplingProfiler, profile_thread
+from .views import FaceCompareAPIView
 
-# Create your tests here.
+
+class QueryCountTestMixin:
+    """构造带有K条比对详情的比对结果（照片文件不存在，不会生成缩略图）"""
+
+    session_id = 'query-count-session'
+
+    def setUp(self):
+        cache.clear()
+
+    def create_comparison(self, detail_count, **fields):
+        comparison = ComparisonResult.objects.create(
+            user_photo='user_photos/missing.jpg', session_id=self.session_id,
+            processing_status='completed', progress=100, **fields
+        )
+        for index in range(detail_count):
+            celebrity = Celebrity.objects.create(
+                name=f'明星{comparison.id.hex[:6]}-{index}', photo='celebrities/missing.jpg'
+            )
+            ComparisonDetail.objects.create(comparison=comparison, celebrity=celebrity, similarity=90 - index)
+        return comparison
+
+
+class ComparisonResultDetailQueryTests(QueryCountTestMixin, TestCase):
+
+    def test_query_count_does_not_grow_with_details(self):
+        for detail_count in (1, 3, 10):
+            with self.subTest(detail_count=detail_count):
+                comparison = self.create_comparison(detail_count)
+                url = reverse('comparison-detail', args=[comparison.id])
+                # 比对结果 + 比对详情和明星（一次JOIN查询）
+                with self.assertNumQueries(2):
+                    response = self.client.get(url, {'session_id': self.session_id})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['details']), detail_count)
+
+    def test_cached_result_needs_no_queries(self):
+        comparison = self.create_comparison(3)
+        url = reverse('comparison-detail', args=[comparison.id])
+        first = self.client.get(url, {'session_id': self.session_id})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'session_id': self.session_id}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_public_link_query_count(self):
+        comparison = self.create_comparison(5, is_public=True, share_code='abcd1234')
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('comparison-detail', args=[comparison.id]), {'public': 'true'})
+        self.assertEqual(response.status_code, 200)
+
+
+class ResultCacheInvalidationTests(QueryCountTestMixin, TestCase):
+
+    def get_result(self, comparison_id, **params):
+        url = reverse('comparison-detail', args=[comparison_id])
+        return self.client.get(url, params or {'session_id': self.session_id})
+
+    def test_detail_changes_invalidate(self):
+        comparison = self.create_comparison(2)
+        first = self.get_result(comparison.id)
+        detail = comparison.details.order_by('-similarity').first()
+        detail.similarity = 50
+        detail.save()
+        second = self.get_result(comparison.id)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual([item['similarity'] for item in second.json()['details']], [89, 50])
+
+        detail.delete()
+        third = self.get_result(comparison.id)
+        self.assertNotEqual(third['ETag'], second['ETag'])
+        self.assertEqual(len(third.json()['details']), 1)
+
+    def test_comparison_changes_invalidate(self):
+        comparison = self.create_comparison(1)
+        self.get_result(comparison.id)
+        # 缓存中的 is_public 随分享更新
+        self.assertEqual(self.get_result(comparison.id, public='true').status_code, 403)
+        comparison.is_public = True
+        comparison.save(update_fields=['is_public'])
+        self.assertEqual(self.get_result(comparison.id, public='true').status_code, 200)
+
+        comparison_id = comparison.id
+        comparison.delete()
+        self.assertEqual(self.get_result(comparison_id).status_code, 404)
+
+    def test_celebrity_changes(self):
+        comparison = self.create_comparison(1)
+        first = self.get_result(comparison.id)
+        celebrity = comparison.details.get().celebrity
+
+        # 只更新不展示的字段时缓存保持不变
+        celebrity.face_token = 'new-token'
+        celebrity.save(update_fields=['face_token'])
+        with self.assertNumQueries(0):
+            response = self.get_result(comparison.id)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        celebrity.name = '新名字'
+        celebrity.save(update_fields=['name'])
+        response = self.get_result(comparison.id)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json()['details'][0]['celebrity']['name'], '新名字')
+
+    def test_private_result_not_served_to_other_sessions(self):
+        comparison = self.create_comparison(1)
+        self.assertEqual(self.get_result(comparison.id).status_code, 200)
+        # 结果已缓存，其他会话、公开链接和未提供session_id的请求仍然被拒绝
+        for params in ({'session_id': 'other-session'}, {'public': 'true'}, {'public': 'false'}):
+            with self.subTest(params=params), self.assertNumQueries(0):
+                response = self.get_result(comparison.id, **params)
+                self.assertEqual(response.status_code, 403)
+                self.assertNotIn('ETag', response)
+
+
+class ComparisonHistoryQueryTests(QueryCountTestMixin, TestCase):
+
+    def test_query_count_does_not_grow_with_comparisons(self):
+        for comparison_count in (1, 5):
+            with self.subTest(comparison_count=comparison_count):
+                ComparisonResult.objects.all().delete()
+                for _ in range(comparison_count):
+                    self.create_comparison(3)
+                # 比对结果 + 比对详情和明星
+                with self.assertNumQueries(2):
+                    response = self.client.get(reverse('comparison-history'), {'session_id': self.session_id})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()), comparison_count)
+                self.assertEqual(response.json()[0]['top_match']['similarity'], 90)
+
+
+class ShareComparisonQueryTests(QueryCountTestMixin, TestCase):
+
+    def test_share_query_count(self):
+        comparison = self.create_comparison(3)
+        # 读取比对结果 + 只更新分享字段
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                reverse('share-comparison', args=[comparison.id]), {'session_id': self.session_id}
+            )
+        self.assertEqual(response.status_code, 200)
+        comparison.refresh_from_db()
+        self.assertTrue(comparison.is_public)
+
+
+class AdminQueryTests(QueryCountTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def changelist_query_count(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_detail_changelist_query_count_does_not_grow_with_rows(self):
+        url = reverse('admin:celebrity_compare_comparisondetail_changelist')
+        self.create_comparison(2)
+        baseline = self.changelist_query_count(url)
+        self.create_comparison(10)
+        self.assertEqual(self.changelist_query_count(url), baseline)
+
+    def test_detail_str_does_not_follow_comparison(self):
+        comparison = self.create_comparison(1)
+        detail = ComparisonDetail.objects.select_related('celebrity').get(comparison=comparison)
+        with self.assertNumQueries(0):
+            self.assertIn(str(comparison.id), str(detail))
+
+
+class CelebrityListQueryTests(TestCase):
+
+    def setUp(self):
+        Celebrity.objects.bulk_create([
+            Celebrity(name=f'明星{index:03d}', photo='celebrities/missing.jpg', description='描述' * 100)
+            for index in range(120)
+        ])
+
+    def test_cursor_pages_use_one_query(self):
+        url = reverse('celebrity-list')
+        with self.assertNumQueries(1):
+            page = self.client.get(url).json()
+        self.assertEqual(len(page['results']), 50)
+        self.assertEqual(set(page['results'][0]), set(CelebritySerializer.COMPACT_FIELDS))
+        with self.assertNumQueries(1):
+            next_page = self.client.get(page['next']).json()
+        self.assertEqual(next_page['results'][0]['name'], '明星050')
+
+    def test_fields_projection(self):
+        response = self.client.get(reverse('celebrity-list'), {'fields': 'id,name', 'page_size': 5})
+        self.assertEqual(response.json()['results'][0], {'id': Celebrity.objects.get(name='明星000').id, 'name': '明星000'})
+        response = self.client.get(reverse('celebrity-list'), {'fields': 'id,face_token'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CelebritySearchTests(TestCase):
+
+    def setUp(self):
+        Celebrity.objects.bulk_create([
+            Celebrity(name='刘德华', photo='celebrities/missing.jpg', occupation='演员、歌手', works='《无间道》、《天若有情》'),
+            Celebrity(name='刘德凯', photo='celebrities/missing.jpg', occupation='演员', works='《新白娘子传奇》'),
+            Celebrity(name='张学友', photo='celebrities/missing.jpg', occupation='歌手', works='《吻别》'),
+        ])
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('celebrity-search'), dict(params, q=query))
+        self.assertEqual(response.status_code, 200)
+        return [result['name'] for result in response.json()['results']]
+
+    def test_prefix_substring_and_fuzzy(self):
+        self.assertEqual(self.search('刘德'), ['刘德凯', '刘德华'])
+        self.assertEqual(self.search('无间道'), ['刘德华'])
+        self.assertEqual(self.search('歌手'), ['刘德华', '张学友'])
+        self.assertIn('刘德华', self.search('刘得华'))
+
+    def test_index_follows_writes(self):
+        response = self.client.get(reverse('celebrity-search'), {'q': '吻别'})
+        self.assertEqual(response.json()['backend'], 'fts5')
+        celebrity = Celebrity.objects.get(name='张学友')
+        celebrity.works = '《饿狼传说》'
+        celebrity.save()
+        self.assertEqual(self.search('饿狼传说'), ['张学友'])
+        self.assertEqual(self.search('吻别了'), [])
+        celebrity.delete()
+        self.assertEqual(self.search('饿狼传说'), [])
+
+
+class SignedMediaTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root, 'user_photos'))
+        with open(os.path.join(self.media_root, 'user_photos', 'photo.jpg'), 'wb') as f:
+            f.write(b'jpeg-bytes')
+        self.delivery = MediaDelivery(url_ttl=60)
+
+    def test_signed_url(self):
+        url = self.delivery.url('user_photos/photo.jpg')
+        self.assertTrue(url.startswith('/api/media/user_photos/photo.jpg?'))
+        with mock.patch.object(MediaDelivery, '_default', self.delivery):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'jpeg-bytes')
+            self.assertTrue(response['Cache-Control'].startswith('private'))
+            self.assertEqual(self.client.get(url[:-1] + '0').status_code, 403)
+            self.assertEqual(self.client.get(url.split('?')[0]).status_code, 403)
+
+            self.delivery.accel_redirect = True
+            response = self.client.get(url)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected-media/user_photos/photo.jpg')
+            self.assertEqual(response.content, b'')
+
+    def test_expired_url(self):
+        expires = self.delivery.expires_at() - 3 * 60
+        url = f"/api/media/user_photos/photo.jpg?e={expires}&s={self.delivery.signature('user_photos/photo.jpg', expires)}"
+        with mock.patch.object(MediaDelivery, '_default', self.delivery):
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_public_media_is_not_signed(self):
+        self.assertEqual(self.delivery.url('celebrities/a.jpg'), '/media/celebrities/a.jpg')
+
+
+@override_settings(THUMBNAILS={'SIZES': {'small': (100, 100), 'medium': (400, 400)}, 'FORMAT': 'JPEG'})
+class ThumbnailTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.source_path = self.save_image('celebrities/star.png')
+        self.addCleanup(ThumbnailService._pending.clear)
+
+    def save_image(self, name, size=(800, 600)):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGBA', size, 'red').save(path)
+        return path
+
+    def test_render_thumbnail_is_idempotent(self):
+        dest_path = os.path.join(self.media_root, 'thumbnails', 'small', 'ab', 'star.jpg')
+        self.assertTrue(render_thumbnail(self.source_path, dest_path, 100, 100, 'JPEG', 80))
+        with Image.open(dest_path) as img:
+            self.assertEqual((img.size, img.mode), ((100, 75), 'RGB'))
+        with open(dest_path, 'rb') as f:
+            content = f.read()
+        # 已存在的缩略图不再读取源图片
+        os.remove(self.source_path)
+        self.assertTrue(render_thumbnail(self.source_path, dest_path, 100, 100, 'JPEG', 80))
+        with open(dest_path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(os.path.dirname(dest_path)), ['star.jpg'])
+
+    def test_thumbnail_name_keeps_private_prefix(self):
+        public = ThumbnailService.thumbnail_name('celebrities/star.png', 'small')
+        private = ThumbnailService.thumbnail_name('user_photos/photo.jpg', 'small')
+        self.assertRegex(public, r'^thumbnails/small/[0-9a-f]{2}/[0-9a-f]{40}\.jpg$')
+        self.assertRegex(private, r'^user_photos/thumbnails/small/[0-9a-f]{2}/[0-9a-f]{40}\.jpg$')
+        self.assertFalse(MediaDelivery.is_private(public))
+        self.assertTrue(MediaDelivery.is_private(private))
+
+    def test_build_job(self):
+        celebrity = Celebrity(name='明星', photo='celebrities/star.png')
+        source_path, dest_path, width, height, image_format, quality = ThumbnailService.build_job(celebrity.photo, 'medium')
+        self.assertEqual(source_path, self.source_path)
+        self.assertEqual(dest_path, os.path.join(
+            self.media_root, ThumbnailService.thumbnail_name('celebrities/star.png', 'medium')
+        ))
+        self.assertEqual((width, height, image_format), (400, 400, 'JPEG'))
+        self.assertIsNone(ThumbnailService.build_job(celebrity.photo, 'huge'))
+        self.assertIsNone(ThumbnailService.build_job(Celebrity(photo='celebrities/missing.png').photo, 'small'))
+
+        # 外部URL使用本地镜像，未镜像时无法生成
+        remote = Celebrity(photo='https://example.com/star.png').photo
+        with mock.patch.object(PhotoMirror, 'lookup', return_value=None):
+            self.assertIsNone(ThumbnailService.build_job(remote, 'small'))
+        with mock.patch.object(PhotoMirror, 'lookup', return_value=self.source_path):
+            job = ThumbnailService.build_job(remote, 'small')
+        self.assertEqual(job[0], self.source_path)
+        self.assertTrue(job[1].startswith(os.path.join(self.media_root, 'thumbnails', 'small')))
+
+    def test_missing_thumbnail_is_submitted_not_rendered(self):
+        celebrity = Celebrity.objects.create(name='明星', photo='celebrities/star.png')
+        future = concurrent.futures.Future()
+        executor = mock.Mock()
+        executor.submit.return_value = future
+        with mock.patch.object(ThumbnailService, 'get_executor', return_value=executor), \
+                mock.patch('celebrity_compare.thumbnails.render_thumbnail') as render:
+            data = CelebritySerializer(celebrity).data
+            self.assertEqual(data['thumbnails'], {'small': None, 'medium': None})
+            self.assertEqual(executor.submit.call_count, 2)
+            # 任务完成前再次访问不会重复提交
+            CelebritySerializer(celebrity).data
+            self.assertEqual(executor.submit.call_count, 2)
+            render.assert_not_called()
+        future.set_result(True)
+        self.assertFalse(ThumbnailService._pending)
+
+    def test_serializer_returns_generated_thumbnails(self):
+        celebrity = Celebrity.objects.create(name='明星', photo='celebrities/star.png')
+        for size in ('small', 'medium'):
+            render_thumbnail(*ThumbnailService.build_job(celebrity.photo, size))
+        with mock.patch.object(ThumbnailService, 'get_executor') as get_executor:
+            data = CelebritySerializer(celebrity).data
+        get_executor.assert_not_called()
+        for size in ('small', 'medium'):
+            self.assertEqual(
+                data['thumbnails'][size], settings.MEDIA_URL + ThumbnailService.thumbnail_name('celebrities/star.png', size)
+            )
+
+        self.save_image('user_photos/photo.png')
+        comparison = ComparisonResult.objects.create(user_photo='user_photos/photo.png')
+        render_thumbnail(*ThumbnailService.build_job(comparison.user_photo, 'small'))
+        with mock.patch.object(ThumbnailService, 'get_executor') as get_executor:
+            thumbnails = ComparisonResultSerializer(comparison).data['user_photo_thumbnails']
+        # 用户照片的缩略图为签名URL
+        self.assertTrue(thumbnails['small'].startswith(
+            '/api/media/' + ThumbnailService.thumbnail_name('user_photos/photo.png', 'small') + '?'
+        ))
+        self.assertIsNone(thumbnails['medium'])
+        self.assertEqual(get_executor.return_value.submit.call_count, 1)
+
+    def test_admin_changelist_does_not_render_thumbnails(self):
+        Celebrity.objects.create(name='明星', photo='celebrities/star.png')
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        with mock.patch.object(ThumbnailService, 'get_executor') as get_executor, \
+                mock.patch('celebrity_compare.thumbnails.render_thumbnail') as render:
+            response = self.client.get(reverse('admin:celebrity_compare_celebrity_changelist'))
+        self.assertEqual(response.status_code, 200)
+        # 缩略图尚未生成时使用原图
+        self.assertContains(response, settings.MEDIA_URL + 'celebrities/star.png')
+        render.assert_not_called()
+        get_executor.return_value.submit.assert_called_once()
+
+
+class AdmissionControllerTests(TestCase):
+
+    def test_queued_jobs_are_admitted_in_order(self):
+        admission = AdmissionController(max_in_flight=1, max_per_session=5, max_queue=5)
+        first = admission.reserve('job-1', 's')
+        second = admission.reserve('job-2', 's')
+        third = admission.reserve('job-3', 's')
+        self.assertTrue(first.admitted)
+        self.assertEqual((admission.position('job-2'), admission.position('job-3')), (1, 2))
+
+        admission.release(first)
+        self.assertTrue(second.admitted)
+        self.assertFalse(third.admitted)
+        self.assertEqual(admission.position('job-3'), 1)
+        admission.release(second)
+        self.assertTrue(admission.wait(third, timeout=0))
+        self.assertEqual(admission.stats()['queued'], 0)
+
+    def test_new_job_waits_behind_queue(self):
+        admission = AdmissionController(max_in_flight=1, max_queue=5)
+        first = admission.reserve('job-1')
+        admission.reserve('job-2')
+        admission.release(first)
+        # job-2 被接纳后名额已满，新任务排在队列中
+        self.assertFalse(admission.reserve('job-3').admitted)
+
+    def test_max_per_session(self):
+        admission = AdmissionController(max_in_flight=1, max_per_session=2, max_queue=5)
+        first = admission.reserve('job-1', 's')
+        admission.reserve('job-2', 's')
+        with self.assertRaises(AdmissionRejected):
+            admission.reserve('job-3', 's')
+        admission.reserve('job-4', 'other')
+        admission.release(first)
+        admission.reserve('job-5', 's')
+        self.assertEqual(admission.stats()['rejected'], 1)
+
+    def test_full_queue_is_rejected_with_retry_after(self):
+        admission = AdmissionController(max_in_flight=1, max_queue=1, initial_duration=10)
+        admission.reserve('job-1')
+        admission.reserve('job-2')
+        with self.assertRaises(AdmissionRejected) as context:
+            admission.reserve('job-3')
+        self.assertEqual(context.exception.queued, 1)
+        self.assertEqual(context.exception.retry_after, 20)
+
+    def test_wait_timeout_leaves_queue(self):
+        admission = AdmissionController(max_in_flight=1, max_per_session=1, max_queue=5)
+        admission.reserve('job-1', 'a')
+        ticket = admission.reserve('job-2', 'b')
+        self.assertFalse(admission.wait(ticket, timeout=0.01))
+        self.assertIsNone(admission.position('job-2'))
+        # 超时后会话名额已释放
+        admission.reserve('job-3', 'b')
+
+
+class CompareUploadTestMixin:
+    """通过比对接口上传照片；后台比对线程被替换，只记录启动次数"""
+
+    session_id = 'upload-session'
+
+    def setUp(self):
+        super().setUp()
+        self.admission = AdmissionController(max_in_flight=4, max_per_session=4, max_queue=4)
+        patcher = mock.patch.object(AdmissionController, '_default', self.admission)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(FaceCompareAPIView, 'run_admitted_comparison')
+        self.run_comparison = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def photo(self, color='red'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), color).save(buffer, format='JPEG')
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def upload(self, color='red', session_id=None, **headers):
+        return self.client.post(
+            reverse('face-compare'), {'photo': self.photo(color), 'session_id': session_id or self.session_id},
+            **headers
+        )
+
+
+class CompareAdmissionAPITests(CompareUploadTestMixin, TestCase):
+
+    def test_rejected_upload_returns_429(self):
+        self.admission.max_in_flight = 1
+        self.admission.max_queue = 0
+        self.admission.reserve('running')
+        response = self.upload()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(response.json()['retry_after']))
+        self.assertEqual(response.json()['status'], 'rejected')
+        self.assertFalse(ComparisonResult.objects.exists())
+        self.run_comparison.assert_not_called()
+
+    def test_queued_upload_reports_position(self):
+        self.admission.max_in_flight = 1
+        self.admission.reserve('running')
+        response = self.upload()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['queue_position'], 1)
+        status_response = self.client.get(reverse('comparison-status', args=[response.json()['id']]))
+        self.assertEqual(status_response.json()['queue_position'], 1)
+
+
+class SingleFlightTests(CompareUploadTestMixin, TestCase):
+
+    def test_identical_uploads_share_one_comparison(self):
+        first = self.upload()
+        second = self.upload()
+        self.assertEqual(first.status_code, 202)
+        self.assertEqual(second.status_code, 202)
+        self.assertTrue(second.json()['deduplicated'])
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(ComparisonResult.objects.count(), 1)
+        self.run_comparison.assert_called_once()
+
+    def test_idempotency_key(self):
+        first = self.upload(HTTP_IDEMPOTENCY_KEY='key-1')
+        ComparisonResult.objects.filter(id=first.json()['id']).update(processing_status='completed')
+        # 比对完成后相同的幂等键仍返回原比对
+        second = self.upload(HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(ComparisonResult.objects.count(), 1)
+        self.run_comparison.assert_called_once()
+
+        self.upload(HTTP_IDEMPOTENCY_KEY='key-2')
+        self.upload(session_id='other-session', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(ComparisonResult.objects.count(), 3)
+
+    def test_different_photos_are_not_merged(self):
+        self.upload('red')
+        self.upload('blue')
+        self.assertEqual(ComparisonResult.objects.count(), 2)
+        self.assertEqual(self.run_comparison.call_count, 2)
+
+
+class FacePPKeyPoolTests(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('celebrity_compare.facepp_keys.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = FacePPKeyPool([('key-a', 'secret'), ('key-b', 'secret')], cooldown=1.0, evict_seconds=600)
+        self.key_a, self.key_b = make_key_id('key-a'), make_key_id('key-b')
+
+    def test_spreads_requests_over_keys(self):
+        first = self.pool.acquire()
+        second = self.pool.acquire()
+        self.assertNotEqual(first.key_id, second.key_id)
+        self.pool.release(first)
+        self.pool.release(second)
+        self.assertEqual([stats['requests'] for stats in self.pool.stats()], [1, 1])
+
+    def throttle(self, key_id):
+        self.pool.release(self.pool.acquire(key_id), error='CONCURRENCY_LIMIT_EXCEEDED')
+
+    def test_throttled_key_cools_down(self):
+        self.throttle(self.key_a)
+        # 冷却中：指定该密钥时不等待直接失败，不指定时使用其他密钥
+        self.assertIsNone(self.pool.acquire(self.key_a, max_wait=0))
+        self.assertEqual(self.pool.acquire().key_id, self.key_b)
+        self.now += 1.0
+        self.assertEqual(self.pool.acquire(self.key_a, max_wait=0).key_id, self.key_a)
+
+    def test_consecutive_throttling_doubles_cooldown(self):
+        self.throttle(self.key_a)
+        self.now += 1.0
+        self.throttle(self.key_a)
+        self.now += 1.0
+        self.assertIsNone(self.pool.acquire(self.key_a, max_wait=0))
+        self.now += 1.0
+        credential = self.pool.acquire(self.key_a, max_wait=0)
+        # 成功的调用重置连续限流计数
+        self.pool.release(credential)
+        self.throttle(self.key_a)
+        self.now += 1.0
+        self.assertIsNotNone(self.pool.acquire(self.key_a, max_wait=0))
+
+    def test_key_is_evicted_after_auth_error(self):
+        credential = self.pool.acquire(self.key_a)
+        self.pool.release(credential, error='AUTHENTICATION_ERROR')
+        self.assertIsNone(self.pool.acquire(self.key_a))
+        self.assertEqual(self.pool.available_key_ids(), [self.key_b])
+        self.now += 601
+        self.assertEqual(self.pool.available_key_ids(), [self.key_a, self.key_b])
+
+    def test_removed_key_is_not_configured(self):
+        self.assertTrue(self.pool.is_configured(None))
+        self.assertTrue(self.pool.is_configured(self.key_b))
+        self.assertFalse(self.pool.is_configured(make_key_id('removed')))
+
+
+class FanoutTestMixin:
+    """使用单个密钥和模拟的Face++调用执行比对"""
+
+    api_key = 'test-key-a'
+
+    def setUp(self):
+        super().setUp()
+        self.pool = FacePPKeyPool([(self.api_key, 'secret')])
+        patcher = mock.patch.object(FacePPKeyPool, '_default', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.key_a = make_key_id(self.api_key)
+        self.comparison = ComparisonResult.objects.create(
+            user_photo='user_photos/missing.jpg', processing_status='processing'
+        )
+
+    def add_celebrity(self, name, key_id=None):
+        return Celebrity.objects.create(
+            name=name, photo='celebrities/missing.jpg', face_token=f'token-{name}', face_token_key=key_id or self.key_a
+        )
+
+    def detect(self):
+        return mock.patch.object(FacePPAPI, 'get_face_token_with_key', return_value=('user-token', self.key_a))
+
+
+class DetectKeySelectionTests(FanoutTestMixin, TestCase):
+    """明星token所属的密钥已从配置中移除时，检测使用仍在配置中的密钥"""
+
+    def compare(self):
+        with self.detect() as detect, mock.patch.object(FacePPAPI, 'compare_faces', return_value=80.0) as compare:
+            matches = FaceCompareAPIView().call_face_plus_plus_api(b'jpeg', 'photo.jpg', 'image/jpeg', self.comparison)
+        return matches, detect, compare
+
+    def test_stale_key_celebrities_are_skipped(self):
+        kept = self.add_celebrity('A', self.key_a)
+        for name in ('B', 'C'):
+            self.add_celebrity(name, make_key_id('removed'))
+        matches, detect, compare = self.compare()
+        self.assertEqual(detect.call_args.kwargs['key_id'], self.key_a)
+        self.assertEqual(compare.call_count, 1)
+        self.assertEqual([match['celebrity_id'] for match in matches], [kept.id])
+
+    def test_regenerates_tokens_when_no_key_is_configured(self):
+        self.add_celebrity('B', make_key_id('removed'))
+        with mock.patch.object(FaceCompareAPIView, 'generate_face_tokens_for_celebrities', return_value=0) as generate:
+            matches, detect, _ = self.compare()
+        self.assertEqual(matches, [])
+        self.assertEqual(generate.call_args.kwargs['stale_key_ids'], [make_key_id('removed')])
+        detect.assert_not_called()
+
+
+class BreakerFanoutTests(FanoutTestMixin, TestCase):
+    """比对过程中熔断器打开时，未实际比对的明星不计入已完成数"""
+
+    def setUp(self):
+        super().setUp()
+        for index in range(6):
+            self.add_celebrity(f'明星{index}')
+        patcher = mock.patch('celebrity_compare.views.ThumbnailService.submit')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_comparison(self, successful_calls):
+        """前 successful_calls 次compare调用成功，之后熔断器打开，调用立即返回None"""
+        state = {'calls': 0, 'open': False}
+        lock = threading.Lock()
+
+        def compare_faces(*args, **kwargs):
+            with lock:
+                state['calls'] += 1
+                if state['calls'] > successful_calls:
+                    state['open'] = True
+                    return None
+                return 90.0 - state['calls']
+
+        with self.detect(), mock.patch.object(FacePPAPI, 'compare_faces', side_effect=compare_faces), \
+                mock.patch.object(FacePPAPI, 'is_available', side_effect=lambda: not state['open']):
+            FaceCompareAPIView().process_image_comparison(self.comparison, b'jpeg', 'photo.jpg', 'image/jpeg')
+        self.comparison.refresh_from_db()
+
+    def test_partial_result_has_message(self):
+        self.run_comparison(successful_calls=2)
+        self.assertEqual(self.comparison.processing_status, 'completed')
+        self.assertIn('2/6', self.comparison.message)
+        self.assertEqual(self.comparison.details.count(), 2)
+
+    def test_fails_without_any_completed_compare(self):
+        self.run_comparison(successful_calls=0)
+        self.assertEqual(self.comparison.processing_status, 'failed')
+        self.assertIn('Face++服务暂时不可用', self.comparison.message)
+
+
+class DeadlineFanoutTests(FanoutTestMixin, TestCase):
+    """截止后没有发出的compare调用不计入已完成数"""
+
+    def setUp(self):
+        super().setUp()
+        for index in range(6):
+            self.add_celebrity(f'明星{index}')
+        patcher = mock.patch('celebrity_compare.views.ThumbnailService.submit')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_calls_skipped_after_deadline_are_not_completed(self):
+        deadline = Deadline(30)
+        calls = []
+        lock = threading.Lock()
+
+        def compare_faces(*args, **kwargs):
+            # 前两次调用成功，之后已截止，调用立即返回None
+            with lock:
+                calls.append(1)
+                if len(calls) > 2:
+                    deadline.expires_at = time.monotonic() - 1
+                    return None
+                return 90.0 - len(calls)
+
+        with self.detect(), mock.patch.object(FacePPAPI, 'compare_faces', side_effect=compare_faces):
+            FaceCompareAPIView().process_image_comparison(
+                self.comparison, b'jpeg', 'photo.jpg', 'image/jpeg', deadline=deadline
+            )
+        self.comparison.refresh_from_db()
+        self.assertEqual(self.comparison.processing_status, 'completed')
+        self.assertIn('比对超时，结果基于已完成比对的 2/6 位明星', self.comparison.message)
+        self.assertEqual(self.comparison.details.count(), 2)
+
+
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.breaker = CircuitBreaker(
+            window=10, min_calls=4, failure_rate=0.5, slow_call_seconds=5.0, slow_call_rate=0.75,
+            open_seconds=30.0, half_open_probes=2, clock=lambda: self.now
+        )
+
+    def call(self, failed=False, latency=0.1):
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(failed, latency)
+
+    def test_min_calls(self):
+        for _ in range(3):
+            self.call(failed=True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.call(failed=True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_failure_rate_below_threshold_stays_closed(self):
+        for failed in (True, False, False, False, True, False):
+            self.call(failed=failed)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_slow_call_rate(self):
+        for latency in (6.0, 6.0, 0.1, 6.0):
+            self.call(latency=latency)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertIn('慢调用', self.breaker.last_open_reason)
+
+    def test_open_half_open_closed(self):
+        for _ in range(4):
+            self.call(failed=True)
+        self.assertFalse(self.breaker.allow())
+        self.now += 29.9
+        self.assertTrue(self.breaker.is_open())
+        self.now += 0.1
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # 半开时最多放行 half_open_probes 个探测调用
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.breaker.record(False, 0.1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(self.breaker.stats()['recent_calls'], 0)
+
+    def test_failed_probe_reopens(self):
+        for _ in range(4):
+            self.call(failed=True)
+        self.now += 30
+        self.call(latency=6.0)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(self.breaker.opened_count, 2)
+        self.assertEqual(self.breaker.stats()['open_remaining'], 30)
+
+
+class RequestHedgerTests(TestCase):
+
+    def setUp(self):
+        self.hedger = RequestHedger(enabled=True, min_delay=0.05, min_samples=1, budget_percent=100, max_workers=4)
+        self.hedger._tracker('compare').record(0.05)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def call(self, queued=0.0, latency=0.0, hedge_latency=0.0):
+        """第一次调用在 queued 秒后发出、耗时 latency 秒，之后的调用耗时 hedge_latency 秒"""
+        def call(on_start, hedge):
+            with self.lock:
+                self.calls += 1
+                first = self.calls == 1
+            if first:
+                time.sleep(queued)
+            on_start()
+            time.sleep(latency if first else hedge_latency)
+            return ({'confidence': 80.0 if first else 81.0}, 'key')
+        return call
+
+    def test_queueing_before_send_does_not_trigger_hedge(self):
+        result = self.hedger.run('compare', self.call(queued=0.3))
+        self.assertEqual(result[0]['confidence'], 80.0)
+        self.assertEqual(self.hedger.stats()['hedged'], 0)
+        # 延迟统计不包括排队时间
+        self.assertLess(self.hedger._tracker('compare').percentile(100), 0.2)
+
+    def test_slow_request_is_hedged(self):
+        result = self.hedger.run('compare', self.call(latency=0.5))
+        self.assertEqual(result[0]['confidence'], 81.0)
+        self.assertEqual(self.hedger.stats()['hedge_wins'], 1)
+
+    def test_losing_request_is_reported_until_it_finishes(self):
+        release = threading.Event()
+
+        def call(on_start, hedge):
+            on_start()
+            if not hedge:
+                release.wait(5)
+            return ({'confidence': 81.0 if hedge else 80.0}, 'key')
+
+        result = self.hedger.run('compare', call)
+        self.assertEqual(result[0]['confidence'], 81.0)
+        stats = self.hedger.stats()
+        self.assertEqual((stats['abandoned'], stats['abandoned_in_flight']), (1, 1))
+        release.set()
+        for _ in range(100):
+            if self.hedger.stats()['abandoned_in_flight'] == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.hedger.stats()['abandoned_in_flight'], 0)
+
+    def test_saturated_pool_is_bounded_by_max_wait(self):
+        hedger = RequestHedger(enabled=True, min_samples=1, budget_percent=100, max_workers=1)
+        hedger._tracker('compare').record(0.05)
+        release = threading.Event()
+        self.addCleanup(release.set)
+        # 占满线程池
+        blocker = hedger._get_executor().submit(release.wait, 5)
+
+        started = time.monotonic()
+        result = hedger.run('compare', self.call(), max_wait=0.1)
+        self.assertEqual(result, (None, None))
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(self.calls, 0)
+        self.assertEqual(hedger.stats()['queue_timeouts'], 1)
+
+        release.set()
+        blocker.result()
+        self.assertEqual(hedger.run('compare', self.call(), max_wait=1.0)[0]['confidence'], 80.0)
+        self.assertEqual(self.calls, 1)
+
+
+class AdaptiveConcurrencyLimiterTests(TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+
+    def limiter(self, **kwargs):
+        kwargs.setdefault('clock', lambda: self.now)
+        return AdaptiveConcurrencyLimiter(**kwargs)
+
+    def complete(self, limiter, latency, count=1):
+        for _ in range(count):
+            self.assertTrue(limiter.acquire(0))
+            limiter.release(latency)
+
+    def test_additive_increase(self):
+        limiter = self.limiter(initial_limit=4, max_limit=6)
+        # 每完成约 limit 次调用上限加1
+        self.complete(limiter, 0.1, count=4)
+        self.assertEqual(limiter.limit, 4)
+        self.complete(limiter, 0.1)
+        self.assertEqual(limiter.limit, 5)
+        self.complete(limiter, 0.1, count=100)
+        self.assertEqual(limiter.limit, 6)
+        self.assertEqual(limiter.stats()['decreases'], 0)
+
+    def test_failed_calls_do_not_increase(self):
+        limiter = self.limiter(initial_limit=4)
+        for _ in range(20):
+            limiter.acquire(0)
+            limiter.release(None)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_throttle_backs_off_once_per_round(self):
+        limiter = self.limiter(initial_limit=10, min_limit=2, backoff=0.7)
+        self.complete(limiter, 0.2)
+        limiter.on_throttle()
+        self.assertEqual(limiter.limit, 7)
+        # 同一轮调用中的其他限流不再减小
+        limiter.on_throttle()
+        self.assertEqual(limiter.limit, 7)
+        self.now += 0.2
+        limiter.on_throttle()
+        self.assertEqual(limiter.limit, 4)
+        for _ in range(10):
+            self.now += 1
+            limiter.on_throttle()
+        self.assertEqual(limiter.limit, 2)
+        stats = limiter.stats()
+        self.assertEqual((stats['throttled'], stats['decreases']), (13, 12))
+
+    def test_latency_inflation_decreases(self):
+        # 样本少于近期窗口时不判断延迟上升
+        limiter = self.limiter(initial_limit=10, latency_tolerance=2.0, recent_window=5)
+        self.complete(limiter, 0.1)
+        self.complete(limiter, 0.5, count=3)
+        self.assertEqual((limiter.limit, limiter.stats()['inflated']), (10, 0))
+
+        limiter = self.limiter(initial_limit=10, max_limit=10, latency_tolerance=2.0, recent_window=5)
+        self.complete(limiter, 0.1, count=40)
+        self.assertEqual(limiter.limit, 10)
+        # 个别长尾请求不会被当作延迟上升
+        self.complete(limiter, 0.5, count=2)
+        self.assertEqual((limiter.limit, limiter.stats()['inflated']), (10, 0))
+        self.complete(limiter, 0.5)
+        self.assertEqual(limiter.limit, 9)
+        stats = limiter.stats()
+        self.assertEqual((stats['inflated'], stats['baseline_latency'], stats['recent_latency']), (1, 0.1, 0.5))
+        # 间隔不足一个近期延迟时不再减小
+        self.complete(limiter, 0.5)
+        self.assertEqual(limiter.limit, 9)
+        self.now += 1
+        self.complete(limiter, 0.5)
+        self.assertEqual(limiter.limit, 8)
+
+    def test_throttled_response_backs_off(self):
+        limiter = self.limiter(initial_limit=10, backoff=0.5)
+        for target, value in (
+            (AdaptiveConcurrencyLimiter, limiter),
+            (FacePPKeyPool, FacePPKeyPool([('limiter-key', 'secret')])),
+            (CircuitBreaker, CircuitBreaker()),
+        ):
+            patcher = mock.patch.object(target, '_default', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        responses = (
+            (429, {}),
+            (403, {'error_message': 'CONCURRENCY_LIMIT_EXCEEDED'}),
+        )
+        for status_code, body in responses:
+            with self.subTest(status_code=status_code):
+                response = mock.Mock(status_code=status_code)
+                response.json.return_value = body
+                session = mock.Mock()
+                session.post.return_value = response
+                self.now += 10
+                before = limiter.limit
+                with mock.patch.object(FacePPAPI, 'get_session', return_value=session):
+                    FacePPAPI._post('compare', {'face_token1': 'a', 'face_token2': 'b'})
+                self.assertEqual(limiter.limit, before // 2)
+                self.assertEqual(limiter.stats()['in_flight'], 0)
+        self.assertEqual(limiter.stats()['throttled'], 2)
+
+
+class HedgeConcurrencyLimitTests(TestCase):
+    """对冲请求也占用自适应并发名额，同时进行的Face++请求数不超过上限"""
+
+    def setUp(self):
+        self.active = 0
+        self.max_active = 0
+        self.posts = 0
+        self.lock = threading.Lock()
+        hedger = RequestHedger(enabled=True, endpoints=('compare',), min_samples=1, budget_percent=100, max_workers=4)
+        hedger._tracker('compare').record(0.05)
+        session = mock.Mock()
+        session.post.side_effect = self.post
+        for target, value in (
+            (RequestHedger, hedger),
+            (CircuitBreaker, CircuitBreaker()),
+            (FacePPKeyPool, FacePPKeyPool([('test-key-a', 'secret')])),
+        ):
+            patcher = mock.patch.object(target, '_default', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(FacePPAPI, 'get_session', return_value=session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, url, **kwargs):
+        with self.lock:
+            self.posts += 1
+            first = self.posts == 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        # 第一个请求（主请求）很慢，之后的请求（对冲）很快
+        time.sleep(0.3 if first else 0.01)
+        with self.lock:
+            self.active -= 1
+        return mock.Mock(status_code=200, json=lambda: {'confidence': 80.0 if first else 81.0})
+
+    def compare(self, limit):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=limit, min_limit=limit, max_limit=limit)
+        with mock.patch.object(AdaptiveConcurrencyLimiter, '_default', limiter):
+            similarity = FacePPAPI.compare_faces('user-token', 'celebrity-token')
+            # 等待落后的请求结束
+            for _ in range(100):
+                if limiter.stats()['in_flight'] == 0:
+                    break
+                time.sleep(0.01)
+        return similarity, limiter
+
+    def test_hedge_is_skipped_without_free_slot(self):
+        similarity, limiter = self.compare(limit=1)
+        self.assertEqual(similarity, 80.0)
+        self.assertEqual(self.posts, 1)
+        self.assertEqual(self.max_active, 1)
+        self.assertEqual(limiter.stats()['in_flight'], 0)
+
+    def test_hedge_takes_its_own_slot(self):
+        similarity, limiter = self.compare(limit=2)
+        self.assertEqual(similarity, 81.0)
+        self.assertEqual(self.posts, 2)
+        self.assertEqual(limiter.stats()['in_flight'], 0)
+
+
+class EmulatorComparisonTestMixin:
+    """使用本地Face++模拟服务执行完整的比对"""
+
+    api_key = 'emulator-key'
+    celebrity_count = 20
+
+    def start_emulator(self, latency_ms):
+        server, emulator = create_server('127.0.0.1', 0, EmulatorConfig(latency_ms=latency_ms, latency_sigma=0, seed=1))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        override = override_settings(FACE_PLUS_PLUS=dict(
+            settings.FACE_PLUS_PLUS, API_URL=f'http://127.0.0.1:{server.server_address[1]}/facepp/v3'
+        ))
+        override.enable()
+        self.addCleanup(override.disable)
+        return emulator
+
+    def setUp(self):
+        # compare 调用逐个进行，耗时与明星数成正比
+        for target, value in (
+            (FacePPKeyPool, FacePPKeyPool([(self.api_key, 'secret')])),
+            (CircuitBreaker, CircuitBreaker()),
+            (RequestHedger, RequestHedger(enabled=False)),
+            (AdaptiveConcurrencyLimiter, AdaptiveConcurrencyLimiter(initial_limit=1, min_limit=1, max_limit=1)),
+        ):
+            patcher = mock.patch.object(target, '_default', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('celebrity_compare.views.ThumbnailService.submit')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.comparison = ComparisonResult.objects.create(
+            user_photo='user_photos/missing.jpg', processing_status='processing'
+        )
+
+    def add_celebrities(self, emulator):
+        for index in range(self.celebrity_count):
+            Celebrity.objects.create(
+                name=f'明星{index}', photo='celebrities/missing.jpg',
+                face_token=emulator.register_face(self.api_key, index * 0x0123456789abcdef % 2 ** 64),
+                face_token_key=make_key_id(self.api_key)
+            )
+
+    def user_photo(self, format='JPEG'):
+        buffer = io.BytesIO()
+        Image.linear_gradient('L').convert('RGB').save(buffer, format=format)
+        return buffer.getvalue()
+
+    def run_comparison(self, latency_ms, deadline_seconds, profiler=None):
+        emulator = self.start_emulator(latency_ms)
+        self.add_celebrities(emulator)
+        with override_settings(COMPARISON_DEADLINE_SECONDS=deadline_seconds), profile_thread(profiler, 'comparison'):
+            FaceCompareAPIView().process_image_comparison(self.comparison, self.user_photo(), 'photo.jpg', 'image/jpeg')
+        self.comparison.refresh_from_db()
+        return emulator
+
+
+class ComparisonDeadlineTests(EmulatorComparisonTestMixin, TestCase):
+    """在很短的总时间预算内执行比对"""
+
+    def test_partial_result_after_deadline(self):
+        emulator = self.run_comparison(latency_ms=30, deadline_seconds=0.3)
+        self.assertEqual(self.comparison.processing_status, 'completed')
+        self.assertIn('比对超时，结果基于已完成比对的', self.comparison.message)
+        self.assertIn(f'/{self.celebrity_count} 位明星', self.comparison.message)
+        self.assertLess(emulator.stats()['requests']['compare'], self.celebrity_count)
+        self.assertTrue(1 <= self.comparison.details.count() <= 3)
+
+    def test_fails_when_nothing_finished_before_deadline(self):
+        self.run_comparison(latency_ms=200, deadline_seconds=0.3)
+        self.assertEqual(self.comparison.processing_status, 'failed')
+        self.assertTrue(self.comparison.message.startswith('比对超时'), self.comparison.message)
+        self.assertFalse(self.comparison.details.exists())
+
+
+class ComparisonProfilingTests(EmulatorComparisonTestMixin, TestCase):
+
+    def test_profile_collects_stacks_from_comparison_and_fanout(self):
+        profiler = SamplingProfiler(interval=0.001, reason='header')
+        profiler.start()
+        self.run_comparison(latency_ms=5, deadline_seconds=30, profiler=profiler)
+        profile = profiler.stop()
+
+        self.assertEqual(self.comparison.processing_status, 'completed')
+        self.assertGreater(profiler.samples, 0)
+        lines = profile.splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+            self.assertIn(stack.split(';', 1)[0], ('comparison', 'fanout'))
+        self.assertIn('process_image_comparison (celebrity_compare/views.py:', profile)
+        # 比对线程池中的线程沿用比对的分析器
+        self.assertTrue(any(line.startswith('fanout;') for line in lines))
+
+
+class ComparisonCostTests(EmulatorComparisonTestMixin, TestCase):
+    """比对结束后保存的资源消耗"""
+
+    celebrity_count = 5
+
+    def run_admitted(self, photo_data, file_name, mime_type):
+        emulator = self.start_emulator(latency_ms=1)
+        self.add_celebrities(emulator)
+        admission = AdmissionController()
+        with mock.patch.object(AdmissionController, '_default', admission):
+            ticket = admission.reserve(self.comparison.id)
+            FaceCompareAPIView().run_admitted_comparison(
+                ticket, self.comparison, photo_data, file_name, mime_type, Deadline(30)
+            )
+        self.comparison.refresh_from_db()
+        self.assertEqual(self.comparison.processing_status, 'completed')
+        return emulator, ComparisonCost.objects.get(comparison=self.comparison)
+
+    def test_fanout_cost(self):
+        photo_data = self.user_photo()
+        _, cost = self.run_admitted(photo_data, 'photo.jpg', 'image/jpeg')
+        self.assertEqual(cost.path, 'fanout')
+        self.assertEqual(cost.calls_by_endpoint, {'detect': 1, 'compare': self.celebrity_count})
+        self.assertEqual(cost.facepp_calls, 1 + self.celebrity_count)
+        self.assertGreater(cost.bytes_uploaded, len(photo_data))
+        self.assertEqual((cost.retries, cost.hedges, cost.cache_hits), (0, 0, 0))
+        self.assertTrue({'queue_wait', 'detect', 'fanout', 'persist'} <= set(cost.stage_seconds))
+        self.assertGreater(cost.wall_seconds, 0)
+        self.assertGreater(cost.worker_seconds, 0)
+
+    def test_pil_fallback_cost(self):
+        emulator_detect = FacePPEmulator.detect
+
+        def detect(emulator, form):
+            # 模拟Face++不支持PNG，转换成JPEG后才能检测
+            if form.get('image_file', b'').startswith(b'\x89PNG'):
+                raise EmulatorError(400, 'IMAGE_ERROR_UNSUPPORTED_FORMAT')
+            return emulator_detect(emulator, form)
+
+        with mock.patch.object(FacePPEmulator, 'detect', detect):
+            _, cost = self.run_admitted(self.user_photo(format='PNG'), 'photo.png', 'image/png')
+        self.assertEqual(cost.path, 'fanout+pil_fallback')
+        self.assertEqual(cost.calls_by_endpoint, {'detect': 2, 'compare': self.celebrity_count})
+        self.assertTrue({'detect', 'convert', 'detect_fallback', 'fanout'} <= set(cost.stage_seconds))
+
+
+class ComparisonCostAPITests(TestCase):
+
+    def create_cost(self, path, facepp_calls, days_ago=0):
+        comparison = ComparisonResult.objects.create(user_photo='user_photos/missing.jpg')
+        cost = ComparisonCost.objects.create(
+            comparison=comparison, path=path, facepp_calls=facepp_calls,
+            calls_by_endpoint={'detect': 1, 'compare': facepp_calls - 1}, bytes_uploaded=1000, wall_seconds=2.0
+        )
+        if days_ago:
+            ComparisonCost.objects.filter(id=cost.id).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return cost
+
+    def login_admin(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+
+    def test_requires_admin(self):
+        response = self.client.get(reverse('comparison-costs'))
+        self.assertIn(response.status_code, (401, 403))
+        user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('comparison-costs')).status_code, 403)
+
+    def test_summary_by_path(self):
+        self.login_admin()
+        self.create_cost('fanout', 21)
+        self.create_cost('fanout', 11)
+        self.create_cost('fanout+pil_fallback', 22)
+        response = self.client.get(reverse('comparison-costs'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['days'], 7)
+        self.assertEqual(data['total']['comparisons'], 3)
+        self.assertEqual(data['total']['facepp_calls'], 54)
+        self.assertEqual(data['total']['calls_by_endpoint'], {'detect': 3, 'compare': 51})
+        # 按Face++调用数降序
+        self.assertEqual([group['path'] for group in data['paths']], ['fanout', 'fanout+pil_fallback'])
+        fanout = data['paths'][0]
+        self.assertEqual((fanout['comparisons'], fanout['facepp_calls'], fanout['avg_facepp_calls']), (2, 32, 16.0))
+        self.assertEqual(fanout['avg_bytes_uploaded'], 1000)
+
+    def test_days_limits_window(self):
+        self.login_admin()
+        self.create_cost('fanout', 21)
+        self.create_cost('fanout', 21, days_ago=3)
+        response = self.client.get(reverse('comparison-costs'), {'days': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total']['comparisons'], 1)
+        response = self.client.get(reverse('comparison-costs'), {'days': '7'})
+        self.assertEqual(response.json()['total']['comparisons'], 2)
+
+    def test_empty_window(self):
+        self.login_admin()
+        self.create_cost('fanout', 21, days_ago=10)
+        data = self.client.get(reverse('comparison-costs')).json()
+        self.assertEqual((data['total'], data['paths']), (None, []))
+
+    def test_invalid_days(self):
+        self.login_admin()
+        response = self.client.get(reverse('comparison-costs'), {'days': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+
+class AdminStatsAPITests(TestCase):
+    """准入状态和Face++调用统计包含密钥标识和错误信息，只允许管理员访问"""
+
+    def setUp(self):
+        patcher = mock.patch.object(FacePPKeyPool, '_default', FacePPKeyPool([('stats-key', 'secret')]))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_anonymous_and_non_staff_are_rejected(self):
+        user = get_user_model().objects.create_user('user', 'user@example.com', 'password')
+        for name in ('facepp-stats', 'comparison-admission'):
+            with self.subTest(name=name):
+                self.client.logout()
+                self.assertIn(self.client.get(reverse(name)).status_code, (401, 403))
+                self.client.force_login(user)
+                self.assertEqual(self.client.get(reverse(name)).status_code, 403)
+
+    def test_admin_can_read_stats(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.get(reverse('facepp-stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'breaker', 'concurrency', 'hedging', 'keys'})
+        self.assertEqual(self.client.get(reverse('comparison-admission')).status_code, 200)
+
+
+class CatalogueImportTests(TestCase):
+    """按姓名批量写入明星，已存在的只补充缺失字段"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir, ignore_errors=True)
+
+    def record(self, name, **fields):
+        return dict({'name': name, 'photo_url': f'https://example.com/{name}.jpg', 'source': 'sina'}, **fields)
+
+    def test_insert_and_update_by_name(self):
+        existing = Celebrity.objects.create(
+            name='刘德华', photo='https://example.com/old.jpg', face_token='token', face_token_key='key'
+        )
+        result = bulk_upsert_celebrities([
+            self.record('刘德华', raw_data={'国籍': '中国', '出生日期': '1961年9月27日'}),
+            self.record('张学友', occupation='歌手'),
+            self.record('张学友', occupation='演员'),
+        ], batch_size=1)
+        self.assertEqual([record['name'] for record in result['created']], ['张学友'])
+        self.assertEqual([record['name'] for record in result['updated']], ['刘德华'])
+        self.assertEqual(result['skipped'], [])
+        self.assertEqual({row['name'] for row in result['rows']}, {'刘德华', '张学友'})
+        self.assertEqual(Celebrity.objects.count(), 2)
+
+        existing.refresh_from_db()
+        self.assertEqual((existing.nationality, str(existing.birth_date)), ('中国', '1961-09-27'))
+        self.assertEqual((existing.face_token, existing.face_token_key), ('token', 'key'))
+        # 批内同名只保留第一条
+        self.assertEqual(Celebrity.objects.get(name='张学友').occupation, '歌手')
+
+    def test_changed_photo_url_does_not_clobber_face_token(self):
+        existing = Celebrity.objects.create(
+            name='刘德华', photo='https://example.com/old.jpg', face_token='token', face_token_key='key',
+            photo_hash='a' * 64, source='sina'
+        )
+        result = bulk_upsert_celebrities([
+            self.record('刘德华', photo_url='https://example.com/new.jpg', face_token='other', face_token_key='other')
+        ])
+        self.assertEqual((result['created'], result['updated']), ([], []))
+        self.assertEqual(result['rows'][0]['face_token'], 'token')
+        existing.refresh_from_db()
+        self.assertEqual(
+            (str(existing.photo), existing.face_token, existing.face_token_key, existing.photo_hash),
+            ('https://example.com/old.jpg', 'token', 'key', 'a' * 64)
+        )
+
+    def test_max_create(self):
+        result = bulk_upsert_celebrities([self.record(f'明星{index}') for index in range(3)], max_create=2)
+        self.assertEqual(len(result['created']), 2)
+        self.assertEqual([record['name'] for record in result['skipped']], ['明星2'])
+        self.assertEqual(len(result['rows']), 2)
+        self.assertFalse(Celebrity.objects.filter(name='明星2').exists())
+
+    def test_jsonl_round_trip(self):
+        path = os.path.join(self.data_dir, 'sina_celebrities.jsonl')
+        legacy_path = os.path.join(self.data_dir, 'sina_celebrities.json')
+        with open(legacy_path, 'w', encoding='utf-8') as f:
+            json.dump([self.record('刘德华', raw_data={'职业': '演员'})], f, ensure_ascii=False)
+
+        # 旧版JSON数组文件转换为JSONL，已有的姓名不再追加
+        writer = CelebrityJsonlWriter(path, legacy_json_path=legacy_path)
+        self.assertFalse(writer.append(self.record('刘德华')))
+        self.assertTrue(writer.append(self.record('张学友', birth_date='1961/7/10')))
+        writer.close()
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('not json\n\n')
+        writer = CelebrityJsonlWriter(path)
+        self.assertEqual(writer.names, {'刘德华', '张学友'})
+        writer.close()
+
+        out = io.StringIO()
+        call_command('import_celebrities', path, '--batch-size', '1', stdout=out)
+        self.assertIn('共读取 2 条，新建 2 条，更新 0 条', out.getvalue())
+        celebrity = Celebrity.objects.get(name='张学友')
+        self.assertEqual((str(celebrity.photo), str(celebrity.birth_date)), ('https://example.com/张学友.jpg', '1961-07-10'))
+        self.assertEqual(Celebrity.objects.get(name='刘德华').occupation, '演员')
+
+        # 再次导入不会重复创建
+        out = io.StringIO()
+        call_command('import_celebrities', path, stdout=out)
+        self.assertIn('新建 0 条，更新 0 条', out.getvalue())
+        self.assertEqual(Celebrity.objects.count(), 2)
+
+
+class BlockingLogHandler(logging.Handler):
+    """写出第一条日志时阻塞，直到测试放行（用于把日志队列填满）"""
+
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.records = []
+
+    def emit(self, record):
+        self.started.set()
+        self.released.wait(5)
+        self.records.append(json.loads(self.format(record)))
+
+
+class LoggingUtilsTests(TestCase):
+    def make_record(self, msg, args=(), level=logging.INFO, exc_info=None):
+        return logging.getLogger('celebrity_compare.tests').makeRecord(
+            'celebrity_compare.tests', level, __file__, 0, msg, args, exc_info
+        )
+
+    def log_records(self, outcome):
+        return dict((key, value) for _, _, key, _, value in LOG_RECORDS.samples()).get((outcome,), 0)
+
+    def test_json_formatter_fields(self):
+        with log_context(comparison_id=42, stage='fanout'):
+            record = self.make_record('比对 %s', ('完成',))
+            ContextFilter().filter(record)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(set(entry), {'time', 'level', 'logger', 'thread', 'message', 'comparison_id', 'stage'})
+        self.assertEqual(
+            (entry['level'], entry['logger'], entry['message'], entry['comparison_id'], entry['stage']),
+            ('INFO', 'celebrity_compare.tests', '比对 完成', '42', 'fanout')
+        )
+
+        # 没有上下文时不输出上下文字段，异常写入exception
+        try:
+            raise ValueError('坏照片')
+        except ValueError:
+            record = self.make_record('失败', level=logging.ERROR, exc_info=sys.exc_info())
+        ContextFilter().filter(record)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertNotIn('comparison_id', entry)
+        self.assertIn('ValueError: 坏照片', entry['exception'])
+
+    def test_log_context_nesting_and_threads(self):
+        with log_context(comparison_id=1, stage='detect'):
+            with log_context(stage='fanout'):
+                self.assertEqual(get_log_context(), {'comparison_id': 1, 'stage': 'fanout'})
+            self.assertEqual(get_log_context(), {'comparison_id': 1, 'stage': 'detect'})
+
+            # 新线程不继承上下文
+            seen = []
+            thread = threading.Thread(target=lambda: seen.append(get_log_context()))
+            thread.start()
+            thread.join()
+            self.assertEqual(seen, [{'comparison_id': None, 'stage': None}])
+        self.assertEqual(get_log_context(), {'comparison_id': None, 'stage': None})
+
+    def test_stage_sampling_keeps_errors(self):
+        sampling = StageSamplingFilter({'fanout': 0})
+        sampled_out = self.log_records('sampled_out')
+        with log_context(stage='fanout'):
+            self.assertFalse(sampling.filter(self.make_record('比对明星')))
+            self.assertTrue(sampling.filter(self.make_record('比对失败', level=logging.ERROR)))
+        with log_context(stage='detect'):
+            self.assertTrue(sampling.filter(self.make_record('检测')))
+        self.assertEqual(self.log_records('sampled_out'), sampled_out + 1)
+
+    def test_queue_full_drops_records(self):
+        target = BlockingLogHandler()
+        handler = NonBlockingHandler([target], queue_size=1)
+        self.addCleanup(handler.close)
+        self.addCleanup(target.released.set)
+        dropped = self.log_records('dropped')
+
+        handler.handle(self.make_record('first'))
+        self.assertTrue(target.started.wait(5))
+        # 后台线程阻塞在第一条日志上，第二条占满队列，第三条被丢弃
+        items = ['second']
+        handler.handle(self.make_record('%s', (items,)))
+        handler.handle(self.make_record('third'))
+        items.append('changed')
+        self.assertEqual(self.log_records('dropped'), dropped + 1)
+
+        target.released.set()
+        handler.close()
+        # 参数在调用方线程中合并，之后的修改不影响输出
+        self.assertEqual([record['message'] for record in target.records], ['first', "['second']"])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        patcher = mock.patch.object(MetricsRegistry, '_default', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_render_counter_and_histogram(self):
+        requests = self.registry.register(Counter('test_requests', '请求数', ['status']))
+        requests.inc(status='ok')
+        requests.inc(2, status='ok')
+        requests.inc(status='say "hi"\n')
+        with self.assertRaises(ValueError):
+            requests.inc(endpoint='compare')
+
+        seconds = self.registry.register(Histogram('test_seconds', '耗时', ['stage'], buckets=(1.0, 0.1)))
+        for value in (0.05, 0.1, 0.5, 2.5):
+            seconds.observe(value, stage='fanout')
+        self.registry.register(CallbackGauge('test_broken', '读取失败的指标', mock.Mock(side_effect=RuntimeError)))
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode().splitlines()
+        self.assertEqual(lines[:2], ['# HELP test_requests 请求数', '# TYPE test_requests counter'])
+        self.assertIn('test_requests_total{status="ok"} 3', lines)
+        self.assertIn('test_requests_total{status="say \\"hi\\"\\n"} 1', lines)
+        # 分桶为累积计数（边界值计入该分桶），最后是 +Inf、总和和次数
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertEqual([line for line in lines if line.startswith('test_seconds_')], [
+            'test_seconds_bucket{stage="fanout",le="0.1"} 2',
+            'test_seconds_bucket{stage="fanout",le="1"} 3',
+            'test_seconds_bucket{stage="fanout",le="+Inf"} 4',
+            'test_seconds_sum{stage="fanout"} 3.15',
+            'test_seconds_count{stage="fanout"} 4',
+        ])
+        # 回调出错的指标只输出说明，不影响其他指标
+        self.assertEqual(lines[-2:], ['# HELP test_broken 读取失败的指标', '# TYPE test_broken gauge'])
+
+    def test_register_returns_existing_metric(self):
+        first = self.registry.register(Counter('test_requests', '请求数'))
+        self.assertIs(self.registry.register(Counter('test_requests', '请求数')), first)
+        with MetricsRegistry.get_default().register(Histogram('test_seconds', '耗时', buckets=(1.0,))).time():
+            pass
+        self.assertIn('test_seconds_count 1', self.registry.render())
+
+
+class PhotoMirrorTests(TestCase):
+    def setUp(self):
+        self.mirror_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.mirror_dir, ignore_errors=True)
+        override = override_settings(PHOTO_MIRROR_DIR=self.mirror_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.data = b'\x89PNG\r\n\x1a\n' + b'photo'
+        self.session = mock.Mock()
+        patcher = mock.patch.object(PhotoMirror, 'get_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def object_files(self):
+        return [name for _, _, names in os.walk(os.path.join(self.mirror_dir, 'objects')) for name in names]
+
+    def test_store_and_lookup_by_url(self):
+        content_hash = PhotoMirror.store(self.data, '//img.example.com/a.png')
+        # 协议头补全后的URL指向同一份内容
+        path = PhotoMirror.lookup('https://img.example.com/a.png')
+        self.assertEqual(path, os.path.join(self.mirror_dir, 'objects', content_hash[:2], content_hash + '.png'))
+        self.assertEqual(PhotoMirror.read('https://img.example.com/a.png'), self.data)
+        self.assertEqual(PhotoMirror.hash_for_url('https://img.example.com/a.png'), content_hash)
+        self.assertIsNone(PhotoMirror.lookup('https://img.example.com/missing.png'))
+        self.assertIsNone(PhotoMirror.lookup('ftp://img.example.com/a.png'))
+
+    def test_identical_content_stored_once(self):
+        first = PhotoMirror.store(self.data, 'https://a.example.com/1.png')
+        second = PhotoMirror.store(self.data, 'https://b.example.com/2.png')
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.object_files()), 1)
+        self.assertEqual(
+            PhotoMirror.lookup('https://a.example.com/1.png'), PhotoMirror.lookup('https://b.example.com/2.png')
+        )
+
+    def test_fetch_downloads_once(self):
+        self.session.get.return_value = mock.Mock(status_code=200, content=self.data)
+        url = 'https://img.example.com/a.png'
+        self.assertEqual(PhotoMirror.fetch(url), self.data)
+        self.assertEqual(PhotoMirror.fetch(url), self.data)
+        self.assertEqual(self.session.get.call_count, 1)
+
+    def test_failed_fetch_not_mirrored(self):
+        url = 'https://img.example.com/a.png'
+        self.session.get.return_value = mock.Mock(status_code=404, content=b'not found')
+        self.assertIsNone(PhotoMirror.fetch(url))
+        self.session.get.side_effect = requests.ConnectionError('连接被重置')
+        self.assertIsNone(PhotoMirror.fetch(url))
+        self.assertIsNone(PhotoMirror.fetch('not a url'))
+        self.assertIsNone(PhotoMirror.lookup(url))
+        self.assertEqual(self.object_files(), [])
+
+        # 写入镜像失败时仍然返回下载的数据
+        self.session.get.side_effect = None
+        self.session.get.return_value = mock.Mock(status_code=200, content=self.data)
+        with mock.patch.object(PhotoMirror, '_atomic_write', side_effect=OSError('磁盘已满')):
+            self.assertEqual(PhotoMirror.fetch(url), self.data)
+        self.assertIsNone(PhotoMirror.lookup(url))
@@ -0,0 +1,250 @@
+import io
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import multiprocessing
+import concurrent.futures
+from django.conf import settings
+from .photo_mirror import PhotoMirror
+from .media_delivery import MediaDelivery
+
+logger = logging.getLogger(__name__)
+
+
+def render_thumbnail(source_path, dest_path, width, height, image_format, quality):
+    """
+    生成单个缩略图文件（在进程池中执行，只依赖PIL）
+
+    已存在的缩略图直接跳过，写入使用临时文件加原子替换，因此重复执行是幂等的。
+
+    返回:
+        bool: 是否生成（或已存在）缩略图
+    """
+    from PIL import Image
+
+    if os.path.exists(dest_path):
+        return True
+
+    with Image.open(source_path) as img:
+        img.thumbnail((width, height))
+        # WebP/JPEG不支持调色板和透明通道
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format=image_format, quality=quality)
+
+    directory = os.path.dirname(dest_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+class ThumbnailService:
+    """
+    缩略图服务，为明星照片和用户照片生成固定尺寸的衍生图片
+
+    缩略图保存在 MEDIA_ROOT/thumbnails/<尺寸>/ 下（私有的用户照片保存在 user_photos/thumbnails/<尺寸>/ 下，
+    与原图一样只能通过签名URL访问），文件名由源图片标识的哈希决定，
+    可以在入库时通过进程池预先生成；首次访问时不存在的缩略图提交到进程池异步生成，生成前调用方使用原图。
+    """
+
+    _executor = None
+    _executor_lock = threading.Lock()
+    # 已提交、尚未完成的缩略图路径，避免重复访问时重复提交
+    _pending = set()
+    _pending_lock = threading.Lock()
+
+    @staticmethod
+    def get_config():
+        """获取缩略图配置"""
+        config = getattr(settings, 'THUMBNAILS', {})
+        return {
+            'sizes': config.get('SIZES', {'small': (100, 100), 'medium': (400, 400)}),
+            'format': config.get('FORMAT', 'WEBP').upper(),
+            'quality': config.get('QUALITY', 80),
+            'workers': config.get('WORKERS') or os.cpu_count() or 1,
+        }
+
+    @staticmethod
+    def get_format():
+        """获取输出格式，PIL不支持WebP时回退为JPEG"""
+        image_format = ThumbnailService.get_config()['format']
+        if image_format == 'WEBP':
+            from PIL import features
+            if not features.check('webp'):
+                return 'JPEG'
+        return image_format
+
+    @staticmethod
+    def thumbnail_name(source_id, size):
+        """缩略图相对于MEDIA_ROOT的路径"""
+        extension = 'webp' if ThumbnailService.get_format() == 'WEBP' else 'jpg'
+        key = hashlib.sha1(source_id.encode('utf-8')).hexdigest()
+        prefix = next((prefix for prefix in MediaDelivery.PRIVATE_PREFIXES if source_id.startswith(prefix)), '')
+        return f"{prefix}thumbnails/{size}/{key[:2]}/{key}.{extension}"
+
+    @staticmethod
+    def resolve_source(image_field):
+        """
+        获取图片字段对应的本地源文件
+
+        外部URL读取本地镜像（未镜像时不回源下载），本地媒体文件直接使用其路径。
+
+        返回:
+            tuple: (源标识, 本地文件路径或None)
+        """
+        if not image_field:
+            return None, None
+        source_id = str(image_field)
+        if source_id.startswith(('http://', 'https://', '//')):
+            return source_id, PhotoMirror.lookup(source_id)
+        try:
+            path = image_field.path
+        except (ValueError, NotImplementedError):
+            return source_id, None
+        return source_id, path if os.path.exists(path) else None
+
+    @staticmethod
+    def build_job(image_field, size):
+        """构造缩略图生成任务参数，无法生成时返回None"""
+        config = ThumbnailService.get_config()
+        if size not in config['sizes']:
+            return None
+        source_id, source_path = ThumbnailService.resolve_source(image_field)
+        if not source_path:
+            return None
+        width, height = config['sizes'][size]
+        dest_path = os.path.join(settings.MEDIA_ROOT, ThumbnailService.thumbnail_name(source_id, size))
+        return (source_path, dest_path, width, height, ThumbnailService.get_format(), config['quality'])
+
+    @staticmethod
+    def get_thumbnail(image_field, size='small', generate=True):
+        """
+        获取缩略图相对路径
+
+        参数:
+            generate (bool): 不存在时是否在当前线程中生成；为False时提交到进程池异步生成，本次返回None
+
+        返回:
+            str 或 None: 相对于MEDIA_ROOT的路径或None（无法生成或尚未生成）
+        """
+        source_id = str(image_field) if image_field else None
+        if not source_id:
+            return None
+        name = ThumbnailService.thumbnail_name(source_id, size)
+        if os.path.exists(os.path.join(settings.MEDIA_ROOT, name)):
+            return name
+        if not generate:
+            try:
+                ThumbnailService.submit(image_field, [size])
+            except Exception as e:
+                logger.warning(f"提交缩略图生成任务时出错: {source_id}, 错误: {str(e)}")
+            return None
+
+        job = ThumbnailService.build_job(image_field, size)
+        if not job:
+            return None
+        try:
+            render_thumbnail(*job)
+            return name
+        except Exception as e:
+            logger.error(f"生成缩略图时出错: {source_id}, 错误: {str(e)}")
+            return None
+
+    @staticmethod
+    def get_thumbnail_url(image_field, size='small', request=None, generate=True):
+        """获取缩略图URL（用户照片的缩略图为签名URL），无法生成或尚未生成时返回None"""
+        name = ThumbnailService.get_thumbnail(image_field, size, generate)
+        if not name:
+            return None
+        return MediaDelivery.get_default().url(name, request)
+
+    @staticmethod
+    def get_executor():
+        """共享的缩略图进程池，使用spawn方式避免复制Django进程中的线程状态"""
+        if ThumbnailService._executor is None:
+            with ThumbnailService._executor_lock:
+                if ThumbnailService._executor is None:
+                    ThumbnailService._executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=ThumbnailService.get_config()['workers'],
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return ThumbnailService._executor
+
+    @staticmethod
+    def submit(image_field, sizes=None):
+        """
+        入库时异步生成缩略图，提交到进程池后立即返回
+
+        返回:
+            list: 已提交任务的Future列表
+        """
+        sizes = sizes or list(ThumbnailService.get_config()['sizes'])
+        futures = []
+        for size in sizes:
+            job = ThumbnailService.build_job(image_field, size)
+            if not job or os.path.exists(job[1]):
+                continue
+            dest_path = job[1]
+            with ThumbnailService._pending_lock:
+                if dest_path in ThumbnailService._pending:
+                    continue
+                ThumbnailService._pending.add(dest_path)
+            try:
+                future = ThumbnailService.get_executor().submit(render_thumbnail, *job)
+            except Exception:
+                ThumbnailService._discard_pending(dest_path)
+                raise
+            future.add_done_callback(lambda _, dest_path=dest_path: ThumbnailService._discard_pending(dest_path))
+            futures.append(future)
+        return futures
+
+    @staticmethod
+    def _discard_pending(dest_path):
+        with ThumbnailService._pending_lock:
+            ThumbnailService._pending.discard(dest_path)
+
+    @staticmethod
+    def generate_many(image_fields, sizes=None, workers=None):
+        """
+        批量生成缩略图，使用独立的进程池并等待全部完成
+
+        返回:
+            tuple: (成功数, 失败数)
+        """
+        sizes = sizes or list(ThumbnailService.get_config()['sizes'])
+        jobs = []
+        for image_field in image_fields:
+            for size in sizes:
+                job = ThumbnailService.build_job(image_field, size)
+                if job and not os.path.exists(job[1]):
+                    jobs.append(job)
+
+        if not jobs:
+            return 0, 0
+
+        success_count = 0
+        failed_count = 0
+        workers = workers or ThumbnailService.get_config()['workers']
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            futures = [executor.submit(render_thumbnail, *job) for job in jobs]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                    success_count += 1
+                except Exception as e:
+                    failed_count += 1
+                    logger.error(f"生成缩略图时出错: {str(e)}")
+        return success_count, failed_count
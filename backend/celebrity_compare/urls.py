@@ -5,8 +5,12 @@ from .views import (
     FaceCompareAPIView, 
     ComparisonResultDetailAPIView,
     ComparisonStatusAPIView,
+    ComparisonAdmissionAPIView,
+    ComparisonCostAPIView,
+    FacePPStatsAPIView,
     ComparisonHistoryAPIView,
-    ShareComparisonAPIView
+    ShareComparisonAPIView,
+    SignedMediaAPIView
 )
 
 router = routers.DefaultRouter()
@@ -17,6 +21,10 @@ urlpatterns = [
     path('compare/', FaceCompareAPIView.as_view(), name='face-compare'),
     path('compare/<uuid:pk>/', ComparisonResultDetailAPIView.as_view(), name='comparison-detail'),
     path('compare/status/<uuid:pk>/', ComparisonStatusAPIView.as_view(), name='comparison-status'),
+    path('compare/admission/', ComparisonAdmissionAPIView.as_view(), name='comparison-admission'),
+    path('compare/costs/', ComparisonCostAPIView.as_view(), name='comparison-costs'),
+    path('facepp/stats/', FacePPStatsAPIView.as_view(), name='facepp-stats'),
     path('compare/history/', ComparisonHistoryAPIView.as_view(), name='comparison-history'),
     path('compare/share/<uuid:pk>/', ShareComparisonAPIView.as_view(), name='share-comparison'),
+    path('media/<path:name>', SignedMediaAPIView.as_view(), name='signed-media'),
 ]
\ No newline at end of file
@@ -1,28 +1,150 @@
 import os
 import json
+import time
 import uuid
+import hashlib
+import logging
+from datetime import timedelta
 import requests
 import concurrent.futures  # 添加并行处理模块
 from django.conf import settings
-from django.http import JsonResponse
+from django.db.models import Q
+from django.http import JsonResponse, HttpResponse
 from django.shortcuts import render
+from django.utils import timezone
 from rest_framework import viewsets, status, permissions
 from rest_framework.views import APIView
+from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from .models import Celebrity, ComparisonResult, ComparisonDetail
-from .serializers import CelebritySerializer, ComparisonResultSerializer, PhotoUploadSerializer
+from .models import Celebrity, ComparisonResult, ComparisonDetail, ComparisonCost
+from .serializers import CelebritySerializer, ComparisonResultSerializer, PhotoUploadSerializer, details_prefetch
 from .facepp_utils import FacePPAPI
+from .facepp_keys import FacePPKeyPool
+from .photo_mirror import PhotoMirror
+from .thumbnails import ThumbnailService
+from .admission import AdmissionController, AdmissionRejected
+from .circuit_breaker import CircuitBreaker
+from .hedging import RequestHedger
+from .concurrency_limiter import AdaptiveConcurrencyLimiter
+from .deadline import Deadline, DeadlineExceeded
+from .metrics import MetricsRegistry, COMPARISONS, COMPARISON_STAGE_SECONDS, gauge
+from .profiling import SamplingProfiler, profile_thread
+from .logging_utils import log_context
+from .accounting import CostTracker, summarize_costs
+from .result_cache import ResultRenderCache
+from .pagination import CelebrityCursorPagination
+from .search import CelebritySearchIndex
+from .media_delivery import MediaDelivery
+from contextlib import contextmanager
 import threading
 
+logger = logging.getLogger(__name__)
+
+
+# 抓取时读取的当前状态
+gauge('facesim_admission_in_flight', '正在执行的比对数',
+      lambda: AdmissionController.get_default().stats()['in_flight'])
+gauge('facesim_admission_queued', '排队等待执行的比对数',
+      lambda: AdmissionController.get_default().stats()['queued'])
+gauge('facesim_facepp_concurrency_limit', 'Face++调用当前的自适应并发上限',
+      lambda: AdaptiveConcurrencyLimiter.get_default().stats()['limit'])
+gauge('facesim_facepp_in_flight', '占用并发名额的Face++调用数',
+      lambda: AdaptiveConcurrencyLimiter.get_default().stats()['in_flight'])
+gauge('facesim_facepp_breaker_state', 'Face++熔断器状态（当前状态为1）',
+      lambda: {
+          (state,): int(CircuitBreaker.get_default().state == state)
+          for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)
+      }, ['state'])
+
+
+@contextmanager
+def comparison_stage(stage):
+    """比对的一个阶段：耗时记入指标和比对的资源统计，阶段内的日志带有stage字段"""
+    started = time.perf_counter()
+    try:
+        with log_context(stage=stage):
+            yield
+    finally:
+        record_stage_time(stage, time.perf_counter() - started)
+
+
+def record_stage_time(stage, seconds):
+    COMPARISON_STAGE_SECONDS.observe(seconds, stage=stage)
+    tracker = CostTracker.current()
+    if tracker is not None:
+        tracker.add_stage_time(stage, seconds)
+
 
 class CelebrityViewSet(viewsets.ReadOnlyModelViewSet):
     """
     获取明星列表的API
+
+    列表使用游标分页（cursor、page_size参数），默认只返回精简字段；
+    fields=id,name,... 指定返回的字段，只读取这些字段对应的列。列表中的缩略图只返回已生成的。
+    search/?q= 按姓名、职业和代表作品搜索（前缀和模糊匹配，用于输入联想），同样支持 fields 参数。
     """
-    queryset = Celebrity.objects.all().order_by('name')
+    queryset = Celebrity.objects.all().order_by('name', 'id')
     serializer_class = CelebritySerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = CelebrityCursorPagination
+    # 支持 fields 参数和精简字段的操作
+    projected_actions = ('list', 'search')
+
+    def list(self, request, *args, **kwargs):
+        invalid = self.check_list_fields()
+        if invalid is not None:
+            return invalid
+        return super().list(request, *args, **kwargs)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """搜索明星，q 为搜索词，limit 为返回数量"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': '缺少必要参数: q'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit') or 0) or None
+        except ValueError:
+            return Response({'error': 'limit必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        invalid = self.check_list_fields()
+        if invalid is not None:
+            return invalid
+
+        ids, backend = CelebritySearchIndex.get_default().search(query, limit)
+        celebrities = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([celebrities[pk] for pk in ids if pk in celebrities], many=True)
+        return Response({'query': query, 'backend': backend, 'results': serializer.data})
+
+    def check_list_fields(self):
+        """检查 fields 参数，有未知字段时返回400响应，否则返回None"""
+        unknown = [name for name in self.get_list_fields() if name not in CelebritySerializer.Meta.fields]
+        if unknown:
+            return Response(
+                {'error': f"未知字段: {', '.join(unknown)}，可选字段: {', '.join(CelebritySerializer.Meta.fields)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return None
+
+    def get_list_fields(self):
+        """列表返回的字段：fields参数指定的字段，未指定时为精简字段"""
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return list(CelebritySerializer.COMPACT_FIELDS)
+        return [name.strip() for name in fields.split(',') if name.strip()]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.projected_actions:
+            # 分页排序需要name和id
+            model_fields = CelebritySerializer.model_fields_for(self.get_list_fields())
+            queryset = queryset.only(*dict.fromkeys(['id', 'name'] + model_fields))
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in self.projected_actions:
+            kwargs['fields'] = self.get_list_fields()
+        return super().get_serializer(*args, **kwargs)
 
 
 class FaceCompareAPIView(APIView):
@@ -31,21 +153,37 @@ class FaceCompareAPIView(APIView):
     """
     parser_classes = (MultiPartParser, FormParser)
 
+    # 保护“查找进行中的相同比对 + 创建新比对”，避免并发的重复上传各自启动比对
+    _single_flight_lock = threading.Lock()
+
     def post(self, request):
+        # 本次比对的资源统计（Face++调用数、上传字节数、各阶段耗时），没有启动比对时丢弃
+        cost = CostTracker()
+        profiler = SamplingProfiler.for_request(request)
+        if profiler is None:
+            with cost.activate():
+                return self.start_comparison(request, cost=cost)
+        
+        # 开启采样分析：请求线程和后台比对线程的调用栈保存到比对记录中
+        profiler.start()
+        try:
+            with profiler.attach('request'), cost.activate():
+                return self.start_comparison(request, profiler, cost)
+        finally:
+            # 没有启动比对（重复请求、被拒绝等）时丢弃分析结果；启动后由比对线程结束采样
+            if profiler.comparison_id is None:
+                profiler.stop()
+    
+    def start_comparison(self, request, profiler=None, cost=None):
+        """校验上传的照片，创建比对记录并在后台线程中执行比对"""
         serializer = PhotoUploadSerializer(data=request.data)
         if serializer.is_valid():
             user_photo = serializer.validated_data['photo']
             
             # 获取会话ID（如果前端提供）
             session_id = request.data.get('session_id', str(uuid.uuid4()))
-            
-            # 创建比对结果记录
-            comparison = ComparisonResult.objects.create(
-                user_photo=user_photo,
-                session_id=session_id,
-                processing_status='processing',
-                progress=0
-            )
+            # 客户端可选的幂等键，同一会话内相同的键只会创建一个比对
+            idempotency_key = request.headers.get('Idempotency-Key') or None
             
             # 在主线程中读取文件内容，避免在子线程中操作已关闭的文件
             try:
@@ -53,7 +191,9 @@ class FaceCompareAPIView(APIView):
                 user_photo.seek(0)
                 
                 # 读取文件内容
-                photo_data = user_photo.read()
+                with comparison_stage('upload_read'):
+                    photo_data = user_photo.read()
+                user_photo.seek(0)
                 
                 # 确定文件类型
                 file_name = user_photo.name if hasattr(user_photo, 'name') else 'user_photo.jpg'
@@ -64,45 +204,179 @@ class FaceCompareAPIView(APIView):
                 else:
                     mime_type = 'image/jpeg'  # 默认MIME类型
                 
-                print(f"成功读取用户照片，大小: {len(photo_data)} 字节，类型: {mime_type}")
-                
-                # 异步处理图片比对，传递已读取的文件数据而非文件对象
-                threading.Thread(
-                    target=self.process_image_comparison,
-                    args=(comparison, photo_data, file_name, mime_type)
-                ).start()
-                
+                logger.info(f"成功读取用户照片，大小: {len(photo_data)} 字节，类型: {mime_type}")
             except Exception as e:
                 error_message = f"读取用户照片时出错: {str(e)}"
-                print(error_message)
-                # 更新比对状态为失败
-                comparison.processing_status = 'failed'
-                comparison.progress = 0
-                comparison.message = error_message
-                comparison.save()
-                
+                logger.warning(error_message)
                 return Response({
-                    'id': comparison.id,
                     'status': 'failed',
                     'message': error_message
                 }, status=status.HTTP_400_BAD_REQUEST)
             
+            with comparison_stage('preprocess'):
+                content_hash = hashlib.sha256(photo_data).hexdigest()
+            admission = AdmissionController.get_default()
+            # 比对的总时间预算从收到请求开始计算（包括排队时间），前端最多等待60秒
+            deadline = Deadline(settings.COMPARISON_DEADLINE_SECONDS)
+            
+            with self._single_flight_lock:
+                # 相同的请求（重复点击、前端超时重试）合并到已有的比对，不再重新比对
+                existing = self.find_duplicate_comparison(session_id, content_hash, idempotency_key)
+                if existing:
+                    logger.info(f"合并重复的比对请求到 {existing.id}")
+                    COMPARISONS.inc(outcome='deduplicated')
+                    return self.duplicate_response(existing, admission)
+                
+                # Face++熔断中且没有可用的缓存结果时直接返回，不再排队
+                if not FacePPAPI.is_available() and not self.find_cached_comparison(content_hash):
+                    retry_after = max(1, int(CircuitBreaker.get_default().stats()['open_remaining']))
+                    COMPARISONS.inc(outcome='unavailable')
+                    return Response({
+                        'error': 'Face++服务暂时不可用，请稍后重试',
+                        'status': 'unavailable',
+                        'retry_after': retry_after
+                    }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': str(retry_after)})
+                
+                # 准入控制：超出并发和排队限制时直接拒绝，不创建记录
+                comparison_id = uuid.uuid4()
+                try:
+                    ticket = admission.reserve(comparison_id, session_id)
+                except AdmissionRejected as e:
+                    COMPARISONS.inc(outcome='rejected')
+                    return Response({
+                        'error': e.message,
+                        'status': 'rejected',
+                        'retry_after': e.retry_after,
+                        'queued': e.queued
+                    }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(e.retry_after)})
+                
+                # 创建比对结果记录
+                try:
+                    comparison = ComparisonResult.objects.create(
+                        id=comparison_id,
+                        user_photo=user_photo,
+                        session_id=session_id,
+                        processing_status='processing',
+                        progress=0,
+                        content_hash=content_hash,
+                        idempotency_key=idempotency_key
+                    )
+                except Exception:
+                    admission.release(ticket)
+                    raise
+            
+            # 异步处理图片比对，传递已读取的文件数据而非文件对象
+            if profiler:
+                profiler.comparison_id = comparison.id
+            threading.Thread(
+                target=self.run_admitted_comparison,
+                args=(ticket, comparison, photo_data, file_name, mime_type, deadline, profiler, cost)
+            ).start()
+            
             # 立即返回处理ID，前端可以轮询状态
-            return Response({
+            response_data = {
                 'id': comparison.id,
                 'status': 'processing',
                 'message': '照片上传成功，正在处理中...'
-            }, status=status.HTTP_202_ACCEPTED)
+            }
+            queue_position = admission.position(comparison.id)
+            if queue_position:
+                response_data['queue_position'] = queue_position
+                response_data['message'] = f'照片上传成功，正在排队（第 {queue_position} 位）...'
+            return Response(response_data, status=status.HTTP_202_ACCEPTED)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    def process_image_comparison(self, comparison, photo_data, file_name, mime_type):
+    def save_cost(self, comparison, cost, wall_seconds):
+        """保存比对的资源消耗"""
+        try:
+            ComparisonCost.objects.update_or_create(comparison_id=comparison.id, defaults=cost.as_fields(wall_seconds))
+        except Exception as e:
+            logger.exception(f"保存比对资源消耗时出错: {str(e)}")
+    
+    def save_profile(self, comparison, profiler):
+        """结束采样并保存折叠调用栈（只更新profile字段，不覆盖比对状态）"""
+        try:
+            profile = profiler.stop()
+            ComparisonResult.objects.filter(id=comparison.id).update(profile=profile)
+            logger.info(f"比对 {comparison.id} 的采样分析已保存（{profiler.reason}，{profiler.samples} 个样本，"
+                  f"{profiler.duration:.1f} 秒）")
+        except Exception as e:
+            logger.exception(f"保存采样分析时出错: {str(e)}")
+    
+    def find_duplicate_comparison(self, session_id, content_hash, idempotency_key=None):
+        """
+        查找可以合并的已有比对
+
+        提供了幂等键时按（会话, 幂等键）查找未失败的比对；
+        否则按（会话, 照片内容哈希）查找仍在处理中的比对。
+        """
+        comparisons = ComparisonResult.objects.filter(session_id=session_id)
+        if idempotency_key:
+            return comparisons.filter(idempotency_key=idempotency_key).exclude(
+                processing_status='failed'
+            ).order_by('-created_at').first()
+        return comparisons.filter(
+            content_hash=content_hash, processing_status='processing'
+        ).order_by('-created_at').first()
+    
+    def duplicate_response(self, comparison, admission):
+        """返回已有比对的状态，调用方与原请求轮询同一个结果"""
+        response_data = {
+            'id': comparison.id,
+            'status': comparison.processing_status,
+            'progress': comparison.progress,
+            'deduplicated': True,
+            'message': '相同的照片已在处理中，已合并到该比对'
+        }
+        if comparison.processing_status == 'processing':
+            queue_position = admission.position(comparison.id)
+            if queue_position:
+                response_data['queue_position'] = queue_position
+            return Response(response_data, status=status.HTTP_202_ACCEPTED)
+        response_data['message'] = '该请求已处理'
+        return Response(response_data, status=status.HTTP_200_OK)
+    
+    def run_admitted_comparison(self, ticket, comparison, photo_data, file_name, mime_type, deadline,
+                                profiler=None, cost=None):
+        """等待准入后执行比对，结束时释放名额"""
+        cost = cost or CostTracker()
+        with profile_thread(profiler, 'comparison'), log_context(comparison_id=comparison.id), \
+                cost.activate(measure_cpu=True):
+            self._run_admitted_comparison(ticket, comparison, photo_data, file_name, mime_type, deadline)
+        self.save_cost(comparison, cost, deadline.elapsed())
+        if profiler:
+            self.save_profile(comparison, profiler)
+    
+    def _run_admitted_comparison(self, ticket, comparison, photo_data, file_name, mime_type, deadline):
+        admission = AdmissionController.get_default()
+        try:
+            with comparison_stage('queue_wait'):
+                admitted = admission.wait(ticket, timeout=deadline.timeout(admission.queue_timeout))
+            if not admitted:
+                self.update_comparison_status(comparison, 'failed', '当前比对请求过多，排队等待超时，请稍后重试')
+                return
+            self.process_image_comparison(comparison, photo_data, file_name, mime_type, deadline)
+        finally:
+            admission.release(ticket)
+            # 从收到请求到比对结束（包括排队时间）
+            COMPARISON_STAGE_SECONDS.observe(deadline.elapsed(), stage='total')
+    
+    def process_image_comparison(self, comparison, photo_data, file_name, mime_type, deadline=None):
         """异步处理图片比对的方法"""
+        if deadline is None:
+            deadline = Deadline(settings.COMPARISON_DEADLINE_SECONDS)
         try:
             # 更新进度
             comparison.progress = 10
             comparison.save()
             
+            # 在进程池中异步生成用户照片缩略图，不阻塞比对流程
+            try:
+                ThumbnailService.submit(comparison.user_photo)
+            except Exception as e:
+                logger.warning(f"提交缩略图生成任务时出错: {str(e)}")
+            
             # 检查是否配置了Face++ API密钥
             api_config = FacePPAPI.get_api_config()
             if not api_config['api_key'] or len(api_config['api_key']) <= 5:
@@ -115,12 +389,30 @@ class FaceCompareAPIView(APIView):
                 self.update_comparison_status(comparison, 'failed', '数据库中没有明星数据，请先导入明星')
                 return
             
+            # Face++熔断中，不再发起调用
+            if not FacePPAPI.is_available():
+                self.serve_degraded_result(comparison)
+                return
+            
             # 更新进度
             comparison.progress = 20
             comparison.save()
                 
             # 调用Face++ API进行比对
-            matched_celebrities = self.call_face_plus_plus_api(photo_data, file_name, mime_type, comparison)
+            try:
+                matched_celebrities = self.call_face_plus_plus_api(
+                    photo_data, file_name, mime_type, comparison, deadline
+                )
+            except Exception:
+                # 比对过程中熔断器打开，改用降级结果
+                if not FacePPAPI.is_available():
+                    self.serve_degraded_result(comparison)
+                    return
+                raise
+            
+            # 比对过程中熔断器打开，部分明星未比对，优先使用完整的缓存结果
+            if not FacePPAPI.is_available() and self.serve_degraded_result(comparison, fail_if_missing=False):
+                return
             
             # 处理比对结果
             if not matched_celebrities or len(matched_celebrities) == 0:
@@ -128,7 +420,8 @@ class FaceCompareAPIView(APIView):
                 return
             
             # 存储比对结果
-            self.save_comparison_details(comparison, matched_celebrities)
+            with comparison_stage('persist'):
+                self.save_comparison_details(comparison, matched_celebrities)
             
             # 检查是否存储成功
             if not ComparisonDetail.objects.filter(comparison=comparison).exists():
@@ -141,9 +434,48 @@ class FaceCompareAPIView(APIView):
         except Exception as e:
             # 记录错误信息
             error_message = str(e)
-            print(f"比对处理失败: {error_message}")
+            logger.exception(f"比对处理失败: {error_message}")
             self.update_comparison_status(comparison, 'failed', error_message)
     
+    def find_cached_comparison(self, content_hash, exclude_id=None):
+        """查找相同照片（任意会话）已完成且有详情的比对"""
+        if not content_hash:
+            return None
+        comparisons = ComparisonResult.objects.filter(
+            content_hash=content_hash, processing_status='completed', details__isnull=False
+        )
+        if exclude_id:
+            comparisons = comparisons.exclude(id=exclude_id)
+        return comparisons.order_by('-created_at').first()
+    
+    def serve_degraded_result(self, comparison, fail_if_missing=True):
+        """
+        Face++不可用时的降级处理：复用相同照片此前的比对结果，没有时立即失败
+
+        返回:
+            bool: 是否使用了缓存结果
+        """
+        cached = self.find_cached_comparison(comparison.content_hash, exclude_id=comparison.id)
+        if not cached:
+            if fail_if_missing:
+                self.update_comparison_status(comparison, 'failed', 'Face++服务暂时不可用，请稍后重试')
+            return False
+        
+        ComparisonDetail.objects.filter(comparison=comparison).delete()
+        ComparisonDetail.objects.bulk_create([
+            ComparisonDetail(comparison=comparison, celebrity_id=detail.celebrity_id, similarity=detail.similarity)
+            for detail in cached.details.all()
+        ])
+        comparison.face_token = comparison.face_token or cached.face_token
+        comparison.message = 'Face++服务暂时不可用，结果来自此前相同照片的比对'
+        tracker = CostTracker.current()
+        if tracker is not None:
+            tracker.mark_path(CostTracker.DEGRADED)
+            tracker.record_cache_hit()
+        logger.warning(f"Face++不可用，比对 {comparison.id} 使用缓存结果 {cached.id}")
+        self.update_comparison_status(comparison, 'completed')
+        return True
+    
     def update_comparison_status(self, comparison, status, error_message=None):
         """更新比对状态和进度"""
         comparison.processing_status = status
@@ -153,8 +485,10 @@ class FaceCompareAPIView(APIView):
             comparison.progress = 0
             # 保存错误信息到数据库，方便前端显示具体错误原因
             comparison.message = error_message
-            print(f"比对失败: {error_message}")
+            logger.warning(f"比对失败: {error_message}")
         comparison.save()
+        if status in ('completed', 'failed'):
+            COMPARISONS.inc(outcome=status)
     
     def save_comparison_details(self, comparison, matched_celebrities):
         """保存比对结果详情"""
@@ -162,27 +496,35 @@ class FaceCompareAPIView(APIView):
             comparison.progress = 90
             comparison.save()
             
-            # 存储比对结果
-            for match in matched_celebrities:
-                try:
-                    celebrity = Celebrity.objects.get(id=match['celebrity_id'])
-                    ComparisonDetail.objects.create(
-                        comparison=comparison,
-                        celebrity=celebrity,
-                        similarity=match['similarity']
-                    )
-                except Celebrity.DoesNotExist:
-                    continue
+            # 存储比对结果（跳过比对期间被删除的明星），一次查询和一次批量写入
+            existing_ids = set(Celebrity.objects.filter(
+                id__in=[match['celebrity_id'] for match in matched_celebrities]
+            ).values_list('id', flat=True))
+            ComparisonDetail.objects.bulk_create([
+                ComparisonDetail(
+                    comparison=comparison,
+                    celebrity_id=match['celebrity_id'],
+                    similarity=match['similarity']
+                )
+                for match in matched_celebrities if match['celebrity_id'] in existing_ids
+            ])
                 
         except Exception as e:
-            print(f"保存比对详情时出错: {str(e)}")
+            logger.exception(f"保存比对详情时出错: {str(e)}")
             raise
     
-    def call_face_plus_plus_api(self, photo_data, file_name, mime_type, comparison):
+    def call_face_plus_plus_api(self, photo_data, file_name, mime_type, comparison, deadline=None):
         """
         调用Face++ API进行人脸比对
         需要配置Face++ API的密钥和基础URL
+
+        超过截止时间时停止尚未开始的比对，返回已完成部分中的前三名，并在比对记录的消息中说明
         """
+        if deadline is None:
+            deadline = Deadline(settings.COMPARISON_DEADLINE_SECONDS)
+        # 本次比对的资源统计（在比对线程外调用时单独统计）
+        cost = CostTracker.current() or CostTracker()
+
         # 获取API配置
         api_config = FacePPAPI.get_api_config()
         
@@ -191,126 +533,200 @@ class FaceCompareAPIView(APIView):
         comparison.save()
         
         # 获取所有已存储的明星人脸数据
+        key_pool = FacePPKeyPool.get_default()
         celebrities = Celebrity.objects.filter(face_token__isnull=False)
+        # face_token只在生成它的密钥下有效，所属密钥已从配置中移除的明星无法比对，需要重新生成face_token
+        stale_key_ids = [
+            key_id for key_id in celebrities.order_by().values_list('face_token_key', flat=True).distinct()
+            if key_id and not key_pool.is_configured(key_id)
+        ]
+        if stale_key_ids:
+            logger.warning(f"密钥 {', '.join(stale_key_ids)} 已不在配置中，跳过这些密钥下的明星")
+            celebrities = celebrities.exclude(face_token_key__in=stale_key_ids)
         if not celebrities.exists():
             # 如果没有face_token，尝试生成一些
-            print("未找到任何face_token，尝试生成...")
+            logger.warning("未找到任何face_token，尝试生成...")
             comparison.progress = 15
             comparison.save()
             
+            cost.mark_path(CostTracker.TOKEN_GENERATION)
             try:
-                processed_count = self.generate_face_tokens_for_celebrities(limit=20)
+                processed_count = self.generate_face_tokens_for_celebrities(limit=20, stale_key_ids=stale_key_ids)
                 if processed_count > 0:
-                    print(f"成功为 {processed_count} 个明星生成face_token")
-                    celebrities = Celebrity.objects.filter(face_token__isnull=False)
+                    logger.info(f"成功为 {processed_count} 个明星生成face_token")
+                    celebrities = Celebrity.objects.filter(face_token__isnull=False).exclude(
+                        face_token_key__in=stale_key_ids
+                    )
                 else:
-                    print("没有成功生成任何face_token")
+                    logger.warning("没有成功生成任何face_token")
             except Exception as e:
-                print(f"生成明星face_token时出错: {str(e)}")
+                logger.exception(f"生成明星face_token时出错: {str(e)}")
             
             if not celebrities.exists():
-                print("无法生成face_token，返回空结果")
+                logger.warning("无法生成face_token，返回空结果")
                 return []
         
         comparison.progress = 20
         comparison.save()
         
         # 创建一个线程安全的结构来存储前三名
-        import threading
         top_matches_lock = threading.Lock()  # 线程锁用于保护top_matches更新
         # top_matches存储前三名，初始化为空列表
         top_matches = []
         
+        # 按明星token所属的密钥分组，用户照片在每个密钥下各检测一次
+        key_counts = {}
+        for key_id in celebrities.values_list('face_token_key', flat=True):
+            key_id = key_pool.resolve_key_id(key_id)
+            key_counts[key_id] = key_counts.get(key_id, 0) + 1
+        # 先在明星最多的密钥下检测
+        celebrity_key_ids = sorted(key_counts, key=key_counts.get, reverse=True)
+        detect_key_id = celebrity_key_ids[0] if celebrity_key_ids else key_pool.primary_key_id
+        
         # 上传用户照片并获取face_token
         try:
             # 使用 FacePPAPI 工具类检测人脸
             user_face_token = None
+            user_key_id = None
+            # 检测成功时使用的图片（原图或转换后的JPEG），用于在其他密钥下检测
+            detect_image = (photo_data, file_name, mime_type)
             
             try:
                 # 告知用户正在进行人脸检测
-                print("正在检测用户照片中的人脸...")
+                logger.info("正在检测用户照片中的人脸...")
                 comparison.progress = 25
                 comparison.save()
                 
                 # 直接使用图片数据检测人脸
-                user_face_token = FacePPAPI.get_face_token(
-                    image_data=photo_data, 
-                    file_name=file_name,
-                    mime_type=mime_type,
-                    return_landmark=api_config['return_landmark']
-                )
+                with comparison_stage('detect'):
+                    user_face_token, user_key_id = FacePPAPI.get_face_token_with_key(
+                        image_data=photo_data, 
+                        file_name=file_name,
+                        mime_type=mime_type,
+                        return_landmark=api_config['return_landmark'],
+                        key_id=detect_key_id,
+                        deadline=deadline
+                    )
                 
                 # 检测成功后更新进度
                 comparison.progress = 40
                 comparison.save()
                 
-                if not user_face_token:
+                if not user_face_token and not deadline.expired():
                     # 如果文件方式失败，可能需要转换图片格式
-                    print("文件检测失败，尝试转换格式...")
+                    logger.info("文件检测失败，尝试转换格式...")
                     try:
                         from PIL import Image
                         import io
                         
-                        # 使用PIL打开并转换图片
-                        img = Image.open(io.BytesIO(photo_data))
-                        
-                        # 转换为RGB模式（移除透明通道）
-                        if img.mode != 'RGB':
-                            img = img.convert('RGB')
-                        
-                        # 保存为JPEG格式到内存缓冲区
-                        buffer = io.BytesIO()
-                        img.save(buffer, format='JPEG')
-                        buffer.seek(0)
+                        cost.mark_path(CostTracker.PIL_FALLBACK)
+                        with comparison_stage('convert'):
+                            # 使用PIL打开并转换图片
+                            img = Image.open(io.BytesIO(photo_data))
+                            
+                            # 转换为RGB模式（移除透明通道）
+                            if img.mode != 'RGB':
+                                img = img.convert('RGB')
+                            
+                            # 保存为JPEG格式到内存缓冲区
+                            buffer = io.BytesIO()
+                            img.save(buffer, format='JPEG')
+                            buffer.seek(0)
                         
                         # 使用转换后的图片重新尝试
-                        user_face_token = FacePPAPI.get_face_token(
-                            image_data=buffer.getvalue(),
-                            file_name='converted_image.jpg',
-                            mime_type='image/jpeg',
-                            return_landmark=api_config['return_landmark']
-                        )
+                        detect_image = (buffer.getvalue(), 'converted_image.jpg', 'image/jpeg')
+                        with comparison_stage('detect_fallback'):
+                            user_face_token, user_key_id = FacePPAPI.get_face_token_with_key(
+                                image_data=detect_image[0],
+                                file_name=detect_image[1],
+                                mime_type=detect_image[2],
+                                return_landmark=api_config['return_landmark'],
+                                key_id=detect_key_id,
+                                deadline=deadline
+                            )
                         
                         # 转换后检测成功的进度
                         if user_face_token:
                             comparison.progress = 40
                             comparison.save()
                     except ImportError:
-                        print("无法导入PIL库进行图片转换")
+                        logger.error("无法导入PIL库进行图片转换")
                         raise Exception("不支持的图片格式，请上传JPG或PNG格式的图片")
                     except Exception as e:
-                        print(f"转换图片格式时出错: {str(e)}")
+                        logger.warning(f"转换图片格式时出错: {str(e)}")
                         raise Exception(f"图片格式转换失败: {str(e)}")
             except Exception as e:
-                print(f"检测人脸出错: {str(e)}")
+                logger.warning(f"检测人脸出错: {str(e)}")
                 raise Exception(f"人脸检测失败: {str(e)}")
             
             if not user_face_token:
+                deadline.check('比对超时：人脸检测未能在规定时间内完成，请稍后重试')
                 raise Exception("未能检测到人脸，请上传包含清晰人脸的照片")
                 
             # 保存用户的face_token
             comparison.face_token = user_face_token
             comparison.save()
             
-            print("人脸检测完成，准备进行人脸比对...")
+            # 在其他密钥下检测用户照片，供这些密钥下的明星比对使用
+            user_face_tokens = {user_key_id: user_face_token}
+            for key_id in celebrity_key_ids:
+                if key_id in user_face_tokens:
+                    continue
+                cost.mark_path(CostTracker.MULTI_KEY)
+                with comparison_stage('detect_other_keys'):
+                    token, _ = FacePPAPI.get_face_token_with_key(
+                        image_data=detect_image[0],
+                        file_name=detect_image[1],
+                        mime_type=detect_image[2],
+                        return_landmark=api_config['return_landmark'],
+                        key_id=key_id,
+                        deadline=deadline
+                    )
+                if token:
+                    user_face_tokens[key_id] = token
+                else:
+                    logger.warning(f"密钥 {key_id} 下检测用户照片失败，跳过该密钥下的 {key_counts[key_id]} 个明星")
+            
+            logger.info("人脸检测完成，准备进行人脸比对...")
             
             # 与每个明星进行比对
             total_celebrities = celebrities.count()
             processed_celebrities = 0
+            # 熔断器打开后被立即拒绝、没有实际比对的明星数
+            skipped_celebrities = 0
+            # 截止后没有发出比对请求的明星数
+            expired_celebrities = 0
             
             # 比对开始，进度达到50%
             comparison.progress = 50
             comparison.save()
             
+            # 截止后设置，之后返回的比对结果不再计入
+            fanout_closed = threading.Event()
+            # 开启采样分析时线程池中的线程也要采样，线程池中的调用也记入本次比对的资源统计
+            profiler = SamplingProfiler.current()
+            cost.mark_path(CostTracker.FANOUT)
+            
             def compare_with_celebrity(celebrity):
+                """与一位明星比对，因熔断或截止而没有比对时返回 'breaker' 或 'deadline'，否则返回None"""
                 # 跳过没有face_token的明星
-                if not celebrity.face_token:
-                    return
+                if not celebrity.face_token or fanout_closed.is_set():
+                    return None
                     
-                # 执行人脸比对
-                similarity = FacePPAPI.compare_faces(user_face_token, celebrity.face_token)
+                # 使用明星token所属密钥下的用户token进行比对
+                key_id = key_pool.resolve_key_id(celebrity.face_token_key)
+                if key_id not in user_face_tokens:
+                    return None
+                similarity = FacePPAPI.compare_faces(
+                    user_face_tokens[key_id], celebrity.face_token, key_id, deadline=deadline
+                )
                 if similarity is None:
-                    return
+                    # 熔断器打开或已截止时调用立即返回None，这位明星没有实际比对
+                    if not FacePPAPI.is_available():
+                        return 'breaker'
+                    if deadline.expired():
+                        return 'deadline'
+                    return None
                     
                 # 获取比对结果对象
                 result = {
@@ -320,6 +736,8 @@ class FaceCompareAPIView(APIView):
                 
                 # 使用线程锁来保护更新top_matches的操作
                 with top_matches_lock:
+                    if fanout_closed.is_set():
+                        return 'deadline'
                     # 根据相似度动态维护前三名
                     if len(top_matches) < 3:
                         # 如果不足三个，直接添加
@@ -331,46 +749,106 @@ class FaceCompareAPIView(APIView):
                         top_matches[-1] = result
                         # 替换后重新排序
                         top_matches.sort(key=lambda x: x['similarity'], reverse=True)
+                return None
+            
+            # 线程池中的线程不继承日志上下文
+            comparison_id = comparison.id
             
-            # 使用线程池并行执行比对
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                futures = [executor.submit(compare_with_celebrity, celebrity) for celebrity in celebrities]
-                for future in concurrent.futures.as_completed(futures):
+            def compare_in_worker(celebrity):
+                started = time.perf_counter()
+                with profile_thread(profiler, 'fanout'), log_context(comparison_id=comparison_id, stage='fanout'), \
+                        cost.activate(measure_cpu=True):
                     try:
-                        # 捕获任何可能的异常
-                        future.result()
-                    except Exception as e:
-                        print(f"比对过程中发生错误: {str(e)}")
-                    
-                    # 更新进度
-                    processed_celebrities += 1
-                    if processed_celebrities % 5 == 0 or processed_celebrities == total_celebrities:
-                        progress = 50 + int((processed_celebrities / total_celebrities) * 40)
-                        comparison.progress = min(progress, 90)
-                        comparison.save()
+                        return compare_with_celebrity(celebrity)
+                    finally:
+                        cost.add_worker_time(time.perf_counter() - started)
+            
+            # 使用线程池并行执行比对；实际同时进行的compare调用数由所有比对共享的自适应并发上限控制，
+            # 线程数取上限的最大值，超出当前上限的线程等待名额
+            fanout_workers = AdaptiveConcurrencyLimiter.get_default().max_limit
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=fanout_workers)
+            fanout_started = time.perf_counter()
+            try:
+                futures = [executor.submit(compare_in_worker, celebrity) for celebrity in celebrities]
+                try:
+                    for future in concurrent.futures.as_completed(futures, timeout=deadline.remaining()):
+                        try:
+                            # 捕获任何可能的异常
+                            skipped = future.result()
+                        except Exception as e:
+                            skipped = None
+                            logger.warning(f"比对过程中发生错误: {str(e)}", extra={'stage': 'fanout'})
+                        
+                        if skipped == 'breaker':
+                            skipped_celebrities += 1
+                        elif skipped == 'deadline':
+                            expired_celebrities += 1
+                        else:
+                            processed_celebrities += 1
+                        
+                        # 更新进度
+                        finished = processed_celebrities + skipped_celebrities + expired_celebrities
+                        if finished % 5 == 0 or finished == total_celebrities:
+                            progress = 50 + int((finished / total_celebrities) * 40)
+                            comparison.progress = min(progress, 90)
+                            comparison.save()
+                except concurrent.futures.TimeoutError:
+                    pass
+            finally:
+                # 截止时取消尚未开始的比对，正在进行的调用超时不超过剩余时间，结果被丢弃
+                with top_matches_lock:
+                    fanout_closed.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                record_stage_time('fanout', time.perf_counter() - fanout_started)
+            
+            if skipped_celebrities:
+                # 比对过程中熔断器打开，结果只基于熔断前完成的部分明星
+                logger.warning(
+                    f"Face++熔断，{skipped_celebrities} 位明星未比对，已完成 {processed_celebrities}/{total_celebrities} 位明星"
+                )
+                cost.mark_path(CostTracker.DEGRADED)
+                if not top_matches:
+                    raise Exception('Face++服务暂时不可用，请稍后重试')
+                comparison.message = (
+                    f'Face++服务暂时不可用，结果基于已完成比对的 {processed_celebrities}/{total_celebrities} 位明星'
+                )
+            elif processed_celebrities < total_celebrities:
+                logger.warning(f"比对超时，已完成 {processed_celebrities}/{total_celebrities} 位明星")
+                cost.mark_path(CostTracker.TIMEOUT)
+                if not top_matches:
+                    raise DeadlineExceeded('比对超时，未能在规定时间内完成与明星的比对，请稍后重试')
+                comparison.message = (
+                    f'比对超时，结果基于已完成比对的 {processed_celebrities}/{total_celebrities} 位明星'
+                )
             
             # 如果没有任何匹配结果
             if not top_matches:
-                print("没有找到任何匹配结果")
+                logger.info("没有找到任何匹配结果")
                 return []
             
             # 直接返回已排序好的前三名
             return top_matches
             
         except requests.exceptions.RequestException as e:
-            print(f"网络请求错误: {str(e)}")
+            logger.error(f"网络请求错误: {str(e)}")
             raise Exception(f"连接Face++ API服务失败，请检查网络连接: {str(e)}")
         except Exception as e:
-            print(f"Face++ API调用错误: {str(e)}")
+            logger.warning(f"Face++ API调用错误: {str(e)}")
             # 将异常信息向上传递
             raise
 
-    def generate_face_tokens_for_celebrities(self, limit=50):
+    def generate_face_tokens_for_celebrities(self, limit=50, stale_key_ids=()):
         """
         为已有的名人数据生成Face++ token
+
+        参数:
+            limit (int): 最多处理的明星数
+            stale_key_ids (list): 已从配置中移除的密钥，这些密钥下的face_token也重新生成
         """
-        # 获取需要处理的明星列表（没有face_token的）
-        celebrities = Celebrity.objects.filter(face_token__isnull=True)[:limit]
+        # 获取需要处理的明星列表（没有face_token或token所属密钥已移除的）
+        celebrities = Celebrity.objects.filter(
+            Q(face_token__isnull=True) | Q(face_token_key__in=stale_key_ids)
+        )[:limit]
         processed_count = 0
         
         for celebrity in celebrities:
@@ -378,15 +856,18 @@ class FaceCompareAPIView(APIView):
                 # 检查photo字段是否是URL
                 if celebrity.photo and (str(celebrity.photo).startswith('http://') or str(celebrity.photo).startswith('https://')):
                     # 使用URL方式生成face_token
-                    face_token = FacePPAPI.get_face_token(image_url=str(celebrity.photo))
+                    face_token, key_id = FacePPAPI.get_face_token_with_key(image_url=str(celebrity.photo))
                     
                     if face_token:
                         celebrity.face_token = face_token
-                        celebrity.save()
+                        celebrity.face_token_key = key_id
+                        if not celebrity.photo_hash:
+                            celebrity.photo_hash = PhotoMirror.hash_for_url(str(celebrity.photo))
+                        celebrity.save(update_fields=['face_token', 'face_token_key', 'photo_hash'])
                         processed_count += 1
-                        print(f"成功为 {celebrity.name} 生成Face++ token")
+                        logger.info(f"成功为 {celebrity.name} 生成Face++ token")
                     else:
-                        print(f"未在 {celebrity.name} 的照片中检测到人脸")
+                        logger.warning(f"未在 {celebrity.name} 的照片中检测到人脸")
                     
                     # 添加延迟，避免API请求过于频繁
                     import time
@@ -396,7 +877,7 @@ class FaceCompareAPIView(APIView):
                     continue
                     
             except Exception as e:
-                print(f"处理名人 {celebrity.name} 时出错: {str(e)}")
+                logger.exception(f"处理名人 {celebrity.name} 时出错: {str(e)}")
         
         return processed_count
 
@@ -404,28 +885,33 @@ class FaceCompareAPIView(APIView):
 class ComparisonResultDetailAPIView(APIView):
     """
     获取单个比对结果的详情
+
+    已完成的结果从渲染缓存返回，响应带有ETag和Cache-Control，支持 If-None-Match 条件请求（304）
     """
     def get(self, request, pk):
         try:
-            # 查询指定ID的比对结果
-            comparison = ComparisonResult.objects.get(pk=pk)
-            
             # 检查是否为公开分享链接
             is_public_request = request.query_params.get('public') == 'true'
+            session_id = request.query_params.get('session_id')
+            render_cache = ResultRenderCache.get_default()
+
+            # 已完成的结果优先使用缓存，只做权限检查
+            entry = render_cache.get(pk)
+            if entry is not None:
+                denied = self.check_access(entry['is_public'], entry['session_id'], is_public_request, session_id)
+                if denied is not None:
+                    return denied
+                return render_cache.respond(request, entry, is_public_request and entry['is_public'])
+
+            # 查询指定ID的比对结果，同时预取比对详情和明星（不读取较大的采样分析字段）
+            comparison = ComparisonResultSerializer.setup_eager_loading(
+                ComparisonResult.objects.defer('profile')
+            ).get(pk=pk)
             
             # 安全检查：如果不是公开访问，且提供了session_id，验证是否匹配
-            if not (is_public_request and comparison.is_public):
-                session_id = request.query_params.get('session_id')
-                if session_id and comparison.session_id and session_id != comparison.session_id:
-                    return Response(
-                        {'error': '无权限查看此结果'}, 
-                        status=status.HTTP_403_FORBIDDEN
-                    )
-                elif not session_id:
-                    return Response(
-                        {'error': '请提供session_id或通过公开链接访问'}, 
-                        status=status.HTTP_403_FORBIDDEN
-                    )
+            denied = self.check_access(comparison.is_public, comparison.session_id, is_public_request, session_id)
+            if denied is not None:
+                return denied
             
             # 检查处理状态
             if comparison.processing_status == 'processing':
@@ -443,16 +929,17 @@ class ComparisonResultDetailAPIView(APIView):
                     'message': comparison.message or '比对处理失败'
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
-            # 处理已完成，检查是否有比对详情
-            if not ComparisonDetail.objects.filter(comparison=comparison).exists():
+            # 处理已完成，检查是否有比对详情（使用预取的数据）
+            if not comparison.details.all():
                 return Response(
                     {'error': '未找到该比对结果的详情数据'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # 使用序列化器返回数据
+            # 序列化并写入渲染缓存
             serializer = ComparisonResultSerializer(comparison)
-            return Response(serializer.data)
+            entry = render_cache.store(comparison, serializer.data)
+            return render_cache.respond(request, entry, is_public_request and comparison.is_public)
             
         except ComparisonResult.DoesNotExist:
             return Response(
@@ -460,12 +947,48 @@ class ComparisonResultDetailAPIView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         except Exception as e:
-            print(f"获取比对结果发生错误: {str(e)}")
+            logger.exception(f"获取比对结果发生错误: {str(e)}")
             return Response(
                 {'error': f'获取比对结果时发生错误: {str(e)}'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @staticmethod
+    def check_access(is_public, owner_session_id, is_public_request, session_id):
+        """检查访问权限，无权限时返回403响应，否则返回None"""
+        if is_public_request and is_public:
+            return None
+        if session_id and owner_session_id and session_id != owner_session_id:
+            return Response(
+                {'error': '无权限查看此结果'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        elif not session_id:
+            return Response(
+                {'error': '请提供session_id或通过公开链接访问'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return None
+
+
+class SignedMediaAPIView(APIView):
+    """
+    通过签名URL访问私有媒体文件（用户照片及其缩略图）
+
+    签名有效时由nginx读取文件（X-Accel-Redirect），本地开发时直接返回文件
+    """
+    def get(self, request, name):
+        media_delivery = MediaDelivery.get_default()
+        if not media_delivery.is_private(name):
+            return Response({'error': '未找到该文件'}, status=status.HTTP_404_NOT_FOUND)
+        remaining = media_delivery.verify(name, request.query_params.get('e'), request.query_params.get('s'))
+        if remaining is None:
+            return Response({'error': '链接无效或已过期'}, status=status.HTTP_403_FORBIDDEN)
+        response = media_delivery.serve(name, remaining)
+        if response is None:
+            return Response({'error': '未找到该文件'}, status=status.HTTP_404_NOT_FOUND)
+        return response
+
 
 class ComparisonStatusAPIView(APIView):
     """
@@ -490,6 +1013,12 @@ class ComparisonStatusAPIView(APIView):
                 'created_at': comparison.created_at
             }
             
+            # 排队中的比对返回排队位置
+            if comparison.processing_status == 'processing':
+                queue_position = AdmissionController.get_default().position(comparison.id)
+                if queue_position:
+                    response_data['queue_position'] = queue_position
+            
             # 如果处理失败，添加错误信息
             if comparison.processing_status == 'failed' and comparison.message:
                 response_data['message'] = comparison.message
@@ -508,6 +1037,65 @@ class ComparisonStatusAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class ComparisonAdmissionAPIView(APIView):
+    """
+    比对任务准入状态（运行中、排队中的任务数），只允许管理员访问
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(AdmissionController.get_default().stats())
+
+
+class ComparisonCostAPIView(APIView):
+    """
+    比对资源消耗汇总（按处理路径统计Face++调用数、上传字节数、重试、缓存命中和耗时）
+
+    参数 days 为统计最近多少天的比对，默认7。只允许管理员访问
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        try:
+            days = float(request.query_params.get('days', 7))
+        except ValueError:
+            return Response({'error': 'days 必须是数字'}, status=status.HTTP_400_BAD_REQUEST)
+        since = timezone.now() - timedelta(days=days)
+        summary = summarize_costs(ComparisonCost.objects.filter(created_at__gte=since))
+        return Response(dict(summary, days=days))
+
+
+class FacePPStatsAPIView(APIView):
+    """
+    Face++ 调用统计（熔断器状态，自适应并发上限，对冲请求，各密钥的请求数、错误数、限流次数和状态）
+
+    包含密钥标识和最近的错误信息，只允许管理员访问
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'breaker': CircuitBreaker.get_default().stats(),
+            'concurrency': AdaptiveConcurrencyLimiter.get_default().stats(),
+            'hedging': RequestHedger.get_default().stats(),
+            'keys': FacePPKeyPool.get_default().stats()
+        })
+
+
+class MetricsAPIView(APIView):
+    """
+    Prometheus格式的指标（各阶段耗时、Face++请求数和耗时、比对结果数、并发和排队状态）
+
+    指标保存在进程内存中，多进程部署时每个进程分别统计
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        return HttpResponse(
+            MetricsRegistry.get_default().render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
+
+
 class ComparisonHistoryAPIView(APIView):
     """
     获取用户历史比对记录的API
@@ -522,14 +1110,20 @@ class ComparisonHistoryAPIView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # 查询指定会话的历史记录
-            comparisons = ComparisonResult.objects.filter(session_id=session_id).order_by('-created_at')
+            # 查询指定会话的历史记录，比对详情和明星一次预取（详情按相似度降序，第一条即最相似的明星）
+            comparisons = list(
+                ComparisonResult.objects.filter(session_id=session_id)
+                .defer('profile')
+                .prefetch_related(details_prefetch())
+                .order_by('-created_at')
+            )
             
             # 如果没有记录，返回空列表而不是404
-            if not comparisons.exists():
+            if not comparisons:
                 return Response([])
             
             # 构建响应数据
+            media_delivery = MediaDelivery.get_default()
             results = []
             for comparison in comparisons:
                 result_data = {
@@ -538,30 +1132,31 @@ class ComparisonHistoryAPIView(APIView):
                     'processing_status': comparison.processing_status
                 }
                 
-                # 添加用户照片URL（如果有）
+                # 添加用户照片的签名URL（如果有）
                 if comparison.user_photo:
-                    result_data['user_photo_url'] = request.build_absolute_uri(comparison.user_photo.url)
+                    result_data['user_photo_url'] = media_delivery.url(comparison.user_photo.name, request)
                 else:
                     result_data['user_photo_url'] = None
                 
                 # 如果处理完成，添加匹配结果最高的明星信息
                 if comparison.processing_status == 'completed':
                     try:
-                        top_match = ComparisonDetail.objects.filter(comparison=comparison).order_by('-similarity').first()
+                        details = comparison.details.all()
+                        top_match = details[0] if details else None
                         if top_match:
                             result_data['top_match'] = {
                                 'celebrity_name': top_match.celebrity.name,
                                 'similarity': top_match.similarity
                             }
                     except Exception as e:
-                        print(f"获取匹配信息出错: {str(e)}")
+                        logger.exception(f"获取匹配信息出错: {str(e)}")
                 
                 results.append(result_data)
             
             return Response(results)
             
         except Exception as e:
-            print(f"获取历史记录时出错: {str(e)}")
+            logger.exception(f"获取历史记录时出错: {str(e)}")
             return Response(
                 {'error': f'获取历史记录失败: {str(e)}'}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -574,7 +1169,7 @@ class ShareComparisonAPIView(APIView):
     """
     def post(self, request, pk):
         try:
-            comparison = ComparisonResult.objects.get(pk=pk)
+            comparison = ComparisonResult.objects.defer('profile').get(pk=pk)
             
             # 安全检查：如果提供了session_id，验证是否匹配
             session_id = request.query_params.get('session_id') or request.data.get('session_id')
@@ -602,7 +1197,8 @@ class ShareComparisonAPIView(APIView):
                 share_code = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
                 comparison.share_code = share_code
                 
-            comparison.save()
+            # 保存时通过信号清除该结果的渲染缓存（缓存中记录了是否公开）
+            comparison.save(update_fields=['is_public', 'share_code'])
             
             # 构建分享URL
             host = request.get_host()
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
 import dotenv
 
 # 加载.env文件
@@ -143,13 +144,18 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# 测试时媒体文件写入临时目录
+TEST_RUNNER = 'facesim.test_runner.TempMediaTestRunner'
+
 # 添加媒体文件配置
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
 
 # 配置CORS
 CORS_ALLOW_ALL_ORIGINS = DEBUG  # 开发环境下允许所有来源，生产环境应限制
 CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', 'http://localhost:8080,http://127.0.0.1:8080').split(',')
+CORS_EXPOSE_HEADERS = ['Retry-After']
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
 
 # 配置Rest Framework
 REST_FRAMEWORK = {
@@ -164,6 +170,20 @@ REST_FRAMEWORK = {
 # 明星照片存储路径
 CELEBRITY_PHOTOS_DIR = os.path.join(MEDIA_ROOT, 'celebrities')
 
+# 明星照片本地镜像目录（按内容寻址）
+PHOTO_MIRROR_DIR = os.environ.get('PHOTO_MIRROR_DIR', os.path.join(MEDIA_ROOT, 'mirror'))
+
+# 缩略图配置
+THUMBNAILS = {
+    'SIZES': {
+        'small': (100, 100),   # 管理后台列表
+        'medium': (400, 400),  # 结果页卡片、移动端
+    },
+    'FORMAT': os.environ.get('THUMBNAIL_FORMAT', 'WEBP'),  # WEBP 或 JPEG
+    'QUALITY': int(os.environ.get('THUMBNAIL_QUALITY', '80')),
+    'WORKERS': int(os.environ.get('THUMBNAIL_WORKERS', '2')),
+}
+
 # Face++ API配置
 FACE_PLUS_PLUS = {
     'API_KEY': os.environ.get('FACE_PLUS_PLUS_API_KEY', ''),
@@ -171,8 +191,122 @@ FACE_PLUS_PLUS = {
     'API_URL': os.environ.get('FACE_PLUS_PLUS_API_URL', 'https://api-cn.faceplusplus.com/facepp/v3'),
     'RETURN_ATTRIBUTES': os.environ.get('FACE_PLUS_PLUS_RETURN_ATTRIBUTES', 'gender,age,beauty'),
     'RETURN_LANDMARK': os.environ.get('FACE_PLUS_PLUS_RETURN_LANDMARK', '0'),
+    # 密钥池，形如 key1:secret1,key2:secret2；未配置时使用上面的单个密钥
+    'API_KEYS': os.environ.get('FACE_PLUS_PLUS_API_KEYS', ''),
+    'KEY_COOLDOWN': float(os.environ.get('FACE_PLUS_PLUS_KEY_COOLDOWN', '1')),         # 限流后的冷却秒数（连续限流时加倍）
+    'KEY_EVICT_SECONDS': int(os.environ.get('FACE_PLUS_PLUS_KEY_EVICT_SECONDS', '600')),  # 认证/额度错误后暂停使用的秒数
+}
+
+# Face++熔断器：最近 WINDOW 次调用中失败率或慢调用比例超过阈值时熔断 OPEN_SECONDS 秒
+FACE_PLUS_PLUS_BREAKER = {
+    'WINDOW': int(os.environ.get('FACE_PLUS_PLUS_BREAKER_WINDOW', '50')),
+    'MIN_CALLS': int(os.environ.get('FACE_PLUS_PLUS_BREAKER_MIN_CALLS', '10')),
+    'FAILURE_RATE': float(os.environ.get('FACE_PLUS_PLUS_BREAKER_FAILURE_RATE', '0.5')),
+    'SLOW_CALL_SECONDS': float(os.environ.get('FACE_PLUS_PLUS_BREAKER_SLOW_CALL_SECONDS', '5')),
+    'SLOW_CALL_RATE': float(os.environ.get('FACE_PLUS_PLUS_BREAKER_SLOW_CALL_RATE', '0.8')),
+    'OPEN_SECONDS': float(os.environ.get('FACE_PLUS_PLUS_BREAKER_OPEN_SECONDS', '30')),
+    'HALF_OPEN_PROBES': int(os.environ.get('FACE_PLUS_PLUS_BREAKER_HALF_OPEN_PROBES', '3')),
+}
+
+# Face++对冲请求：请求超过最近调用的 PERCENTILE 百分位延迟仍未返回时再发一次，对冲请求数不超过正常请求的 BUDGET_PERCENT%
+FACE_PLUS_PLUS_HEDGING = {
+    'ENABLED': os.environ.get('FACE_PLUS_PLUS_HEDGING', 'False') == 'True',
+    'ENDPOINTS': os.environ.get('FACE_PLUS_PLUS_HEDGING_ENDPOINTS', 'detect,compare'),
+    'PERCENTILE': float(os.environ.get('FACE_PLUS_PLUS_HEDGING_PERCENTILE', '95')),
+    'MIN_DELAY': float(os.environ.get('FACE_PLUS_PLUS_HEDGING_MIN_DELAY', '0.05')),    # 对冲前至少等待的秒数
+    'MIN_SAMPLES': int(os.environ.get('FACE_PLUS_PLUS_HEDGING_MIN_SAMPLES', '20')),    # 样本数达到后才开始对冲
+    'BUDGET_PERCENT': float(os.environ.get('FACE_PLUS_PLUS_HEDGING_BUDGET_PERCENT', '5')),
+    # 线程池大小，0为按 2 × 同时运行的比对数 × 并发上限计算
+    'MAX_WORKERS': int(os.environ.get('FACE_PLUS_PLUS_HEDGING_MAX_WORKERS', '0')),
+}
+
+# Face++调用的自适应并发上限（所有比对共享）：延迟稳定时逐步提高，被限流或延迟上升时降低
+FACE_PLUS_PLUS_CONCURRENCY = {
+    'ENDPOINTS': os.environ.get('FACE_PLUS_PLUS_CONCURRENCY_ENDPOINTS', 'compare'),
+    'INITIAL_LIMIT': int(os.environ.get('FACE_PLUS_PLUS_CONCURRENCY_INITIAL', '8')),
+    'MIN_LIMIT': int(os.environ.get('FACE_PLUS_PLUS_CONCURRENCY_MIN', '1')),
+    'MAX_LIMIT': int(os.environ.get('FACE_PLUS_PLUS_CONCURRENCY_MAX', '32')),            # 也是每个比对的线程数
+    'BACKOFF': float(os.environ.get('FACE_PLUS_PLUS_CONCURRENCY_BACKOFF', '0.7')),       # 被限流时上限乘以该系数
+    'LATENCY_TOLERANCE': float(os.environ.get('FACE_PLUS_PLUS_CONCURRENCY_LATENCY_TOLERANCE', '2')),  # 近期延迟超过基线的倍数
+    'ACQUIRE_TIMEOUT': float(os.environ.get('FACE_PLUS_PLUS_CONCURRENCY_ACQUIRE_TIMEOUT', '30')),
+}
+
+# 比对任务准入控制（单个服务进程内的限制）
+COMPARISON_ADMISSION = {
+    'MAX_IN_FLIGHT': int(os.environ.get('COMPARISON_MAX_IN_FLIGHT', '4')),      # 同时运行的比对数
+    'MAX_PER_SESSION': int(os.environ.get('COMPARISON_MAX_PER_SESSION', '2')),  # 每个会话运行中和排队中的比对数
+    'MAX_QUEUE': int(os.environ.get('COMPARISON_MAX_QUEUE', '16')),             # 等待队列容量，满时返回429
+    'QUEUE_TIMEOUT': int(os.environ.get('COMPARISON_QUEUE_TIMEOUT', '120')),    # 排队超时（秒）
+}
+
+# 每个比对的总时间预算（秒，从收到请求开始计算，包括排队），超时后返回已完成部分的结果；应小于前端60秒的请求超时
+COMPARISON_DEADLINE_SECONDS = float(os.environ.get('COMPARISON_DEADLINE_SECONDS', '55'))
+
+# 媒体文件下发：用户照片只通过短期有效的签名URL访问；部署在nginx后时开启ACCEL_REDIRECT，由nginx读取文件
+MEDIA_DELIVERY = {
+    'URL_TTL': int(os.environ.get('MEDIA_URL_TTL', '3600')),  # 签名URL的有效期（秒），实际为1到2倍
+    'ACCEL_REDIRECT': os.environ.get('MEDIA_ACCEL_REDIRECT', 'False').lower() in ('true', '1', 'yes'),
+    'ACCEL_PREFIX': os.environ.get('MEDIA_ACCEL_PREFIX', '/protected-media/'),  # nginx中internal的location
+}
+
+# 明星搜索：SQLite上使用FTS5 trigram索引（迁移时自动创建），其他数据库或不支持时使用普通查询
+CELEBRITY_SEARCH = {
+    'BACKEND': os.environ.get('CELEBRITY_SEARCH_BACKEND', 'auto'),  # auto 或 basic（不使用索引）
+    'DEFAULT_LIMIT': int(os.environ.get('CELEBRITY_SEARCH_LIMIT', '10')),
+    'MAX_LIMIT': int(os.environ.get('CELEBRITY_SEARCH_MAX_LIMIT', '50')),
+}
+
+# 已完成比对结果的渲染缓存（使用Django缓存后端，未配置CACHES时为进程内存；多进程部署需配置共享缓存）
+COMPARISON_RESULT_CACHE = {
+    'TIMEOUT': int(os.environ.get('COMPARISON_RESULT_CACHE_TIMEOUT', '3600')),  # 服务端缓存时间（秒），0为不缓存
+    'MAX_AGE': int(os.environ.get('COMPARISON_RESULT_MAX_AGE', '60')),          # Cache-Control的max-age（秒）
+}
+
+# 比对采样分析：开启后记录请求线程和比对线程的调用栈（折叠格式），在管理后台的比对结果中下载
+COMPARISON_PROFILING = {
+    'SAMPLE_RATE': float(os.environ.get('COMPARISON_PROFILING_SAMPLE_RATE', '0')),  # 随机开启的比例（0-1）
+    'TOKEN': os.environ.get('COMPARISON_PROFILING_TOKEN', ''),      # 请求头X-Profile-Token与之一致时开启，为空时不接受请求头
+    'INTERVAL_MS': float(os.environ.get('COMPARISON_PROFILING_INTERVAL_MS', '5')),  # 采样间隔（毫秒）
+    'MAX_SECONDS': float(os.environ.get('COMPARISON_PROFILING_MAX_SECONDS', '120')),
+    'MAX_STACKS': int(os.environ.get('COMPARISON_PROFILING_MAX_STACKS', '5000')),   # 保存的不同调用栈数上限
+}
+
+# 日志：celebrity_compare的日志经队列由后台线程输出到stderr，每条日志带有比对ID和阶段字段
+# LOG_STAGE_SAMPLE_RATES 按阶段设置保留比例，如 fanout=0.01（ERROR及以上始终保留）
+LOG_STAGE_SAMPLE_RATES = {
+    stage.strip(): float(rate)
+    for stage, _, rate in (
+        item.partition('=') for item in os.environ.get('LOG_STAGE_SAMPLE_RATES', 'fanout=0.1').split(',') if '=' in item
+    )
+}
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'context': {'()': 'celebrity_compare.logging_utils.ContextFilter'},
+        'stage_sampling': {
+            '()': 'celebrity_compare.logging_utils.StageSamplingFilter',
+            'rates': LOG_STAGE_SAMPLE_RATES,
+        },
+    },
+    'handlers': {
+        'nonblocking': {
+            'class': 'celebrity_compare.logging_utils.NonBlockingHandler',
+            'log_format': os.environ.get('LOG_FORMAT', 'json'),   # json 或 text
+            'queue_size': int(os.environ.get('LOG_QUEUE_SIZE', '10000')),  # 队列满时丢弃日志
+            'filters': ['context', 'stage_sampling'],
+        },
+    },
+    'loggers': {
+        'celebrity_compare': {
+            'handlers': ['nonblocking'],
+            'level': os.environ.get('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
 }
 
 # 创建必要的目录
 os.makedirs(CELEBRITY_PHOTOS_DIR, exist_ok=True)
+os.makedirs(PHOTO_MIRROR_DIR, exist_ok=True)
 os.makedirs(os.path.join(MEDIA_ROOT, 'user_photos'), exist_ok=True)
@@ -0,0 +1,37 @@
+import os
+import logging
+import shutil
+import tempfile
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TempMediaTestRunner(DiscoverRunner):
+    """
+    测试运行器：测试期间把媒体目录指向临时目录
+
+    测试中生成的缩略图、镜像和上传的用户照片不会写入真实的MEDIA_ROOT，测试结束后删除临时目录。
+    celebrity_compare 的日志在测试期间不输出（verbosity为3时保留），assertLogs 不受影响。
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.media_root = tempfile.mkdtemp(prefix='facesim-test-media-')
+        for name in ('celebrities', 'mirror', 'user_photos'):
+            os.makedirs(os.path.join(self.media_root, name))
+        self.media_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            CELEBRITY_PHOTOS_DIR=os.path.join(self.media_root, 'celebrities'),
+            PHOTO_MIRROR_DIR=os.path.join(self.media_root, 'mirror'),
+        )
+        self.media_override.enable()
+        self.app_logger = logging.getLogger('celebrity_compare')
+        self.app_log_handlers = self.app_logger.handlers[:]
+        if self.verbosity < 3:
+            self.app_logger.handlers = [logging.NullHandler()]
+
+    def teardown_test_environment(self, **kwargs):
+        self.app_logger.handlers = self.app_log_handlers
+        self.media_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -14,13 +14,16 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
+from django.views.static import serve
 from django.conf import settings
 from django.conf.urls.static import static
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from celebrity_compare.views import MetricsAPIView
 
 # 创建API文档视图
 schema_view = get_schema_view(
@@ -39,6 +42,8 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('celebrity_compare.urls')),
+    # Prometheus抓取的指标
+    path('metrics', MetricsAPIView.as_view(), name='metrics'),
     
     # API文档URL
     path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
@@ -46,7 +51,10 @@ urlpatterns = [
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
 ]
 
-# 添加媒体文件的URL配置
+# 本地开发时由Django提供公开的媒体文件（部署时由nginx提供）；用户照片只能通过签名URL（/api/media/）访问
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += [
+        re_path(r'^%s(?!user_photos/)(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve,
+                {'document_root': settings.MEDIA_ROOT}),
+    ]
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
@@ -21,7 +21,8 @@ const getSessionId = () => {
 };
 
 // 上传照片并获取相似度比对
-export const uploadPhoto = async (photo) => {
+// idempotencyKey: 同一张照片的重试使用相同的键，服务端会合并到同一个比对
+export const uploadPhoto = async (photo, idempotencyKey = null) => {
   const formData = new FormData()
   formData.append('photo', photo)
   
@@ -31,10 +32,14 @@ export const uploadPhoto = async (photo) => {
   
   try {
     console.log('开始上传照片，大小: ' + (photo.size / 1024).toFixed(2) + ' KB')
+    const headers = {
+      'Content-Type': 'multipart/form-data'
+    }
+    if (idempotencyKey) {
+      headers['Idempotency-Key'] = idempotencyKey
+    }
     const response = await apiClient.post('/api/compare/', formData, {
-      headers: {
-        'Content-Type': 'multipart/form-data'
-      },
+      headers,
       // 添加上传进度事件处理
       onUploadProgress: (progressEvent) => {
         const percentCompleted = Math.round((progressEvent.loaded * 100) / progressEvent.total)
@@ -67,6 +72,11 @@ export const uploadPhoto = async (photo) => {
       } else if (error.response.data.detail) {
         errorMessage = error.response.data.detail;
       }
+      // 服务器繁忙时提示建议的重试时间
+      const retryAfter = (error.response.headers && error.response.headers['retry-after']) || error.response.data.retry_after;
+      if (error.response.status === 429 && retryAfter) {
+        errorMessage = `${errorMessage}（约 ${retryAfter} 秒后可重试）`;
+      }
     } else if (error.code === 'ECONNABORTED') {
       errorMessage = '上传超时，请确保网络稳定并重试';
     }
@@ -144,10 +154,10 @@ export const getComparisonStatus = async (id) => {
   }
 }
 
-// 获取所有名人列表
-export const getCelebrities = async () => {
+// 获取名人列表（游标分页，返回 { next, previous, results }；params 可包含 cursor、page_size、fields）
+export const getCelebrities = async (params = {}) => {
   try {
-    const response = await apiClient.get('/api/celebrities/')
+    const response = await apiClient.get('/api/celebrities/', { params })
     return response.data
   } catch (error) {
     console.error('获取名人列表失败:', error)
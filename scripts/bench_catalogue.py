@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+明星列表接口基准
+
+在临时数据库中写入指定数量的明星（带有较长的描述和代表作品），在本进程中通过Django测试客户端请求
+GET /api/celebrities/，比较不同参数下的响应时间和响应体大小：
+
+- compact: 默认的精简字段
+- fields: fields=id,name
+- full: 全部字段
+- deep: 沿 next 链接连续翻页（游标分页，不随页数变慢）
+- unpaginated: 改版前的行为（全部明星、全部字段、不分页），只在指定 --unpaginated 时运行
+
+示例:
+    python bench_catalogue.py --rows 100000 --requests 50
+    python bench_catalogue.py --rows 100000 --requests 5 --unpaginated
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import django
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+sys.path.append(BACKEND_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "facesim.settings")
+
+FULL_FIELDS = 'id,name,photo,photo_url,thumbnails,description,detail_url,birth_date,nationality,occupation,works,created_at'
+
+
+def percentile(samples, percent):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * percent / 100), len(samples) - 1)]
+
+
+def seed(rows, batch_size=5000):
+    """写入明星记录（照片文件不存在，不会生成缩略图）"""
+    from celebrity_compare.models import Celebrity
+    started = time.perf_counter()
+    for start in range(0, rows, batch_size):
+        Celebrity.objects.bulk_create([
+            Celebrity(
+                name=f'明星{index:07d}',
+                photo=f'celebrities/bench_{index}.jpg',
+                description='演员、歌手，' * 40,
+                works='《作品》、' * 30,
+                nationality='中国',
+                occupation='演员',
+                detail_url=f'https://example.com/star/{index}',
+            )
+            for index in range(start, min(start + batch_size, rows))
+        ])
+    print(f"写入 {rows} 条明星记录，耗时 {time.perf_counter() - started:.1f} 秒")
+
+
+def measure(client, path, params, count):
+    """重复请求同一地址，返回 (耗时列表, 响应体字节数, 行数)"""
+    samples = []
+    size = rows = 0
+    for _ in range(count):
+        started = time.perf_counter()
+        response = client.get(path, params)
+        samples.append(time.perf_counter() - started)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} {params} 返回 {response.status_code}")
+        size = len(response.content)
+        data = response.json()
+        rows = len(data['results'] if isinstance(data, dict) else data)
+    return samples, size, rows
+
+
+def measure_deep(client, pages):
+    """沿 next 链接翻页，返回每页的耗时"""
+    samples = []
+    url = '/api/celebrities/'
+    for _ in range(pages):
+        started = time.perf_counter()
+        response = client.get(url)
+        samples.append(time.perf_counter() - started)
+        url = response.json()['next']
+        if not url:
+            break
+    return samples, len(response.content), len(response.json()['results'])
+
+
+def report(name, samples, size, rows):
+    print(
+        f"{name:<14}{len(samples):>6}{rows:>8}{size / 1024:>12.1f}"
+        f"{percentile(samples, 50) * 1000:>10.1f}{percentile(samples, 95) * 1000:>10.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="明星列表接口基准")
+    parser.add_argument('--rows', type=int, default=100000, help='明星数量')
+    parser.add_argument('--requests', type=int, default=50, help='每种参数的请求次数')
+    parser.add_argument('--page-size', type=int, default=50, help='每页行数')
+    parser.add_argument('--deep-pages', type=int, default=200, help='连续翻页的页数')
+    parser.add_argument('--unpaginated', action='store_true', help='同时测量改版前不分页的全量响应（很慢）')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-catalogue-')
+    os.environ['DB_NAME'] = os.path.join(work_dir, 'db.sqlite3')
+    os.environ['MEDIA_ROOT'] = os.path.join(work_dir, 'media')
+    try:
+        django.setup()
+        from django.core.management import call_command
+        from django.test import Client
+        call_command('migrate', verbosity=0)
+        seed(args.rows)
+
+        client = Client(HTTP_HOST='localhost')
+        page = {'page_size': args.page_size}
+        print(f"{'模式':<12}{'请求数':>6}{'行数':>8}{'响应(KB)':>10}{'p50(ms)':>10}{'p95(ms)':>10}")
+        report('compact', *measure(client, '/api/celebrities/', page, args.requests))
+        report('fields', *measure(client, '/api/celebrities/', dict(page, fields='id,name'), args.requests))
+        report('full', *measure(client, '/api/celebrities/', dict(page, fields=FULL_FIELDS), args.requests))
+        report('deep', *measure_deep(client, args.deep_pages))
+
+        if args.unpaginated:
+            from rest_framework.test import APIRequestFactory
+            from celebrity_compare.views import CelebrityViewSet
+            # 改版前的接口：不分页、全部字段
+            view = CelebrityViewSet.as_view(
+                {'get': 'list'}, pagination_class=None, get_list_fields=lambda: FULL_FIELDS.split(',')
+            )
+            factory = APIRequestFactory()
+            samples = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                response = view(factory.get('/api/celebrities/', HTTP_HOST='localhost'))
+                response.render()
+                samples.append(time.perf_counter() - started)
+            report('unpaginated', samples, len(response.content), len(response.data))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
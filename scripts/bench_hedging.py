@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Face++对冲请求基准
+
+在本地启动一个延迟呈长尾分布的Face++桩服务（大部分请求几十毫秒，少数请求数百毫秒），
+分别在关闭和开启对冲时通过 FacePPAPI.compare_faces 发出相同数量的请求，
+比较各百分位延迟和桩服务实际收到的请求数（额外负载）。
+
+示例:
+    python bench_hedging.py --requests 2000 --concurrency 8 --budget 5
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "facesim.settings")
+
+
+class StubState:
+    """桩服务的延迟分布和请求计数"""
+
+    def __init__(self, base_ms, tail_ratio, tail_ms):
+        self.base_ms = base_ms
+        self.tail_ratio = tail_ratio
+        self.tail_ms = tail_ms
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def sample_latency(self):
+        # 主体为对数正态分布，少量请求落入帕累托长尾
+        if random.random() < self.tail_ratio:
+            return min(self.tail_ms * random.paretovariate(1.5), self.tail_ms * 10) / 1000.0
+        return random.lognormvariate(0, 0.3) * self.base_ms / 1000.0
+
+
+def make_handler(state):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 响应头和响应体分两次写出，关闭Nagle算法避免延迟确认带来的额外40毫秒
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+            with state.lock:
+                state.requests += 1
+            time.sleep(state.sample_latency())
+            if self.path.endswith('/detect'):
+                body = {'faces': [{'face_token': 'stub-token'}]}
+            else:
+                body = {'confidence': round(random.uniform(0, 100), 3)}
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def percentile(samples, percent):
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * percent / 100), len(samples) - 1)]
+
+
+def run_round(requests_count, concurrency):
+    """并发发出 compare 请求，返回每个请求的耗时"""
+    from celebrity_compare.facepp_utils import FacePPAPI
+
+    def one(_):
+        started = time.perf_counter()
+        FacePPAPI.compare_faces('token-a', 'token-b')
+        return time.perf_counter() - started
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(one, range(requests_count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face++对冲请求基准")
+    parser.add_argument('--requests', type=int, default=2000, help='每轮请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发请求数')
+    parser.add_argument('--base_ms', type=float, default=30, help='桩服务的典型延迟（毫秒）')
+    parser.add_argument('--tail_ratio', type=float, default=0.03, help='落入长尾的请求比例')
+    parser.add_argument('--tail_ms', type=float, default=400, help='长尾延迟的下限（毫秒）')
+    parser.add_argument('--percentile', type=float, default=95, help='对冲延迟使用的百分位')
+    parser.add_argument('--budget', type=float, default=5, help='对冲预算（占正常请求的百分比）')
+    args = parser.parse_args()
+
+    state = StubState(args.base_ms, args.tail_ratio, args.tail_ms)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    os.environ['FACE_PLUS_PLUS_API_URL'] = f'http://127.0.0.1:{server.server_port}/facepp/v3'
+    os.environ['FACE_PLUS_PLUS_API_KEYS'] = 'bench-key-000:bench-secret'
+    # 媒体目录使用临时目录，不写入真实的MEDIA_ROOT
+    media_root = tempfile.mkdtemp(prefix='bench-hedging-')
+    os.environ['MEDIA_ROOT'] = media_root
+    django.setup()
+    from celebrity_compare.hedging import RequestHedger
+
+    print(f"{'模式':<10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}{'额外负载':>10}")
+    for label, enabled in (('不对冲', False), ('对冲', True)):
+        RequestHedger._default = RequestHedger(
+            enabled=enabled, percentile=args.percentile, budget_percent=args.budget
+        )
+        # 预热：积累延迟样本
+        run_round(200, args.concurrency)
+        with state.lock:
+            state.requests = 0
+        latencies = run_round(args.requests, args.concurrency)
+        with state.lock:
+            extra = state.requests / args.requests - 1
+        print(
+            f"{label:<10}"
+            f"{percentile(latencies, 50) * 1000:>10.1f}"
+            f"{percentile(latencies, 95) * 1000:>10.1f}"
+            f"{percentile(latencies, 99) * 1000:>10.1f}"
+            f"{max(latencies) * 1000:>10.1f}"
+            f"{extra:>10.1%}"
+        )
+        if enabled:
+            print(f"对冲统计: {RequestHedger.get_default().stats()}")
+
+    server.shutdown()
+    shutil.rmtree(media_root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
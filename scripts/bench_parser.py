@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+爬虫HTML解析微基准
+
+使用 scripts/fixtures/ 下保存的列表页和详情页，比较各解析后端在线程内解析和进程池并行解析时的吞吐。
+不依赖Django和网络。
+
+示例:
+    python bench_parser.py --pages 200 --workers 4
+"""
+
+import os
+import sys
+import time
+import argparse
+import concurrent.futures
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from crawler_parsers import available_backends, parse_star_list, parse_star_detail, ParserPool
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def bench_inline(func, html, backend, pages):
+    """在当前线程中顺序解析"""
+    started = time.perf_counter()
+    for _ in range(pages):
+        func(html, backend)
+    return time.perf_counter() - started
+
+
+def bench_pool(method, html, pages, workers, backend):
+    """通过解析进程池并行解析（调用方使用与进程数相同的线程投递，与爬虫流水线一致）"""
+    pool = ParserPool(workers=workers, backend=backend)
+    try:
+        parse = getattr(pool, method)
+        # 预热：启动子进程并导入模块
+        list(concurrent.futures.ThreadPoolExecutor(workers).map(parse, [html] * workers))
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as threads:
+            list(threads.map(parse, [html] * pages))
+        return time.perf_counter() - started
+    finally:
+        pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="爬虫HTML解析微基准")
+    parser.add_argument('--pages', type=int, default=200, help='每种页面解析的次数')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='解析进程数')
+    args = parser.parse_args()
+
+    fixtures = [
+        ('列表页', parse_star_list, 'parse_list', load_fixture('sina_list.html')),
+        ('详情页', parse_star_detail, 'parse_detail', load_fixture('sina_detail.html')),
+    ]
+
+    # 各后端解析结果应一致
+    for label, func, _, html in fixtures:
+        results = [func(html, backend) for backend in available_backends()]
+        if any(result != results[0] for result in results[1:]):
+            print(f"警告: {label}在不同解析后端下结果不一致")
+
+    print(f"{'页面':<8}{'后端':<14}{'模式':<12}{'耗时(秒)':>10}{'页/秒':>10}")
+    for label, func, method, html in fixtures:
+        for backend in available_backends():
+            elapsed = bench_inline(func, html, backend, args.pages)
+            print(f"{label:<8}{backend:<14}{'线程内':<12}{elapsed:>10.3f}{args.pages / elapsed:>10.1f}")
+            if args.workers > 0:
+                elapsed = bench_pool(method, html, args.pages, args.workers, backend)
+                mode = f"进程池x{args.workers}"
+                print(f"{label:<8}{backend:<14}{mode:<12}{elapsed:>10.3f}{args.pages / elapsed:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,8 +5,8 @@ import os
 import sys
 import time
 import random
+import threading
 import requests
-from bs4 import BeautifulSoup
 import django
 import logging
 import json
@@ -15,6 +15,7 @@ import re
 
 # 设置Django环境
 sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "facesim.settings")
 django.setup()
 
@@ -22,16 +23,21 @@ django.setup()
 from celebrity_compare.models import Celebrity
 from django.conf import settings
 from celebrity_compare.facepp_utils import FacePPAPI
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("crawler.log"),
-        logging.StreamHandler()
-    ]
+from celebrity_compare.logging_utils import NonBlockingHandler
+from celebrity_compare.photo_mirror import PhotoMirror
+from celebrity_compare.catalogue import (
+    bulk_upsert_celebrities, CelebrityJsonlWriter
 )
+from crawler_engine import FetchEngine, Pipeline
+from crawl_state import CrawlStateStore
+from crawler_parsers import ParserPool
+
+# 配置日志：经队列由后台线程写入文件和终端，抓取线程不等待日志I/O
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.FileHandler("crawler.log"), logging.StreamHandler()]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+logging.basicConfig(level=logging.INFO, handlers=[NonBlockingHandler(_log_handlers)])
 logger = logging.getLogger(__name__)
 
 # 爬虫配置
@@ -41,6 +47,9 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:89.0) Gecko/20100101 Firefox/89.0',
 ]
 
+# 新浪娱乐明星库列表页
+SINA_BASE_URL = "https://ent.sina.com.cn/ku/star_search_index.d.html"
+
 def get_headers():
     """获取随机UA头"""
     return {
@@ -50,23 +59,27 @@ def get_headers():
         'Referer': 'https://ent.sina.com.cn/ku/star_search_index.d.html',
     }
 
-def generate_face_token(photo_url):
+def generate_face_token(photo_url, image_data=None):
     """为明星照片生成Face++ token
     
-    使用统一的FacePPAPI工具类来处理Face++ API的调用
+    使用统一的FacePPAPI工具类来处理Face++ API的调用，
+    已下载的图片数据可以通过image_data传入，避免重复获取
+    
+    返回:
+        tuple: (face_token, 生成token的密钥标识)，失败时为 (None, None)
     """
     try:
         # 检查URL是否有效
         if not photo_url or not isinstance(photo_url, str):
             logger.error(f"无效的照片URL: {photo_url}")
-            return None
+            return None, None
             
         # 确保URL格式正确
         if photo_url.startswith('//'):
             photo_url = 'https:' + photo_url
         elif not (photo_url.startswith('http://') or photo_url.startswith('https://')):
             logger.error(f"非标准URL格式: {photo_url}")
-            return None
+            return None, None
         
         # 使用FacePPAPI工具类获取face_token
         logger.info(f"正在调用Face++ API检测照片: {photo_url[:50]}...")
@@ -75,194 +88,66 @@ def generate_face_token(photo_url):
         api_config = FacePPAPI.get_api_config()
         return_landmark = api_config.get('return_landmark')
         
-        # 尝试下载图片内容以防止INVALID_IMAGE_URL错误
-        try:
-            img_response = requests.get(photo_url, timeout=10)
-            if img_response.status_code == 200:
-                image_data = img_response.content
-                # 使用本地图片数据而不是URL
-                face_token = FacePPAPI.get_face_token(
-                    image_data=image_data,
-                    file_name='celebrity.jpg',
-                    return_landmark=return_landmark
-                )
-            else:
-                logger.error(f"下载图片失败，状态码: {img_response.status_code}")
-                return None
-        except Exception as e:
-            logger.error(f"下载图片时出错: {str(e)}")
-            return None
+        # 通过本地镜像获取图片内容以防止INVALID_IMAGE_URL错误，已镜像的照片不再回源下载
+        if image_data is None:
+            image_data = PhotoMirror.fetch(photo_url, headers=get_headers())
+        if not image_data:
+            return None, None
+        
+        # 使用本地图片数据而不是URL
+        face_token, key_id = FacePPAPI.get_face_token_with_key(
+            image_data=image_data,
+            file_name='celebrity.jpg',
+            return_landmark=return_landmark
+        )
         
         if face_token:
             logger.info(f"成功生成Face++ token: {face_token[:10]}...")
-            return face_token
+            return face_token, key_id
         else:
             logger.warning(f"未在照片中检测到人脸: {photo_url}")
-            return None
+            return None, None
             
     except Exception as e:
         logger.error(f"生成Face++ token时出错: {str(e)}")
-        return None
+        return None, None
 
-def save_celebrity_to_db(celebrity_data, source_name):
-    """保存明星信息到数据库和JSON文件"""
-    try:
-        # 检查是否已存在同名明星
-        existing = Celebrity.objects.filter(name=celebrity_data['name']).first()
-        if not existing:
-            # 提取国籍、出生日期等信息
-            nationality = None
-            birth_date = None
-            occupation = None
-            
-            if 'raw_data' in celebrity_data:
-                nationality = celebrity_data['raw_data'].get('国籍')
-                
-                # 处理日期格式
-                birth_date_raw = celebrity_data['raw_data'].get('出生日期')
-                if birth_date_raw:
-                    birth_date = validate_date_format(birth_date_raw)
-                
-                occupation = celebrity_data['raw_data'].get('职业')
+_json_writers = {}
 
-            # 为照片生成Face++ token
-            face_token = generate_face_token(celebrity_data['photo_url'])
-            
-            # 创建新的明星记录，只使用模型中存在的字段
-            Celebrity.objects.create(
-                name=celebrity_data['name'],
-                photo=celebrity_data['photo_url'],
-                face_token=face_token,
-                description=celebrity_data.get('description', ''),
-                nationality=nationality,
-                occupation=occupation,
-                birth_date=birth_date,
-                detail_url=celebrity_data.get('detail_url'),
-                source=source_name  # 添加数据源信息
-            )
-            logger.info(f"成功保存明星到数据库: {celebrity_data['name']}")
-            
-            # 同时保存到JSON文件
-            save_celebrity_to_json(celebrity_data, source_name)
-            return True
-        else:
-            # 如果已存在且没有Face++ token，尝试生成并更新
-            if not existing.face_token:
-                face_token = generate_face_token(celebrity_data['photo_url'])
-                if face_token:
-                    existing.face_token = face_token
-                    # 同时更新其他可能缺失的字段
-                    if not existing.nationality and 'raw_data' in celebrity_data:
-                        existing.nationality = celebrity_data['raw_data'].get('国籍')
-                    
-                    if not existing.occupation and 'raw_data' in celebrity_data:
-                        existing.occupation = celebrity_data['raw_data'].get('职业')
-                            
-                    if not existing.birth_date and 'raw_data' in celebrity_data:
-                        birth_date_raw = celebrity_data['raw_data'].get('出生日期')
-                        if birth_date_raw:
-                            existing.birth_date = validate_date_format(birth_date_raw)
-                    
-                    if not existing.detail_url and 'detail_url' in celebrity_data:
-                        existing.detail_url = celebrity_data['detail_url']
-                    
-                    if not existing.source:
-                        existing.source = source_name  # 更新数据源信息
-                        
-                    existing.save()
-                    logger.info(f"已为已存在的明星 {celebrity_data['name']} 生成Face++ token")
-            else:
-                logger.info(f"明星已存在: {celebrity_data['name']}")
-            return False
-    except Exception as e:
-        logger.error(f"保存明星异常: {celebrity_data['name']}, 错误: {str(e)}")
-        # 记录详细错误信息
-        import traceback
-        logger.error(traceback.format_exc())
-        return False
+def get_json_writer(source_name):
+    """获取数据源对应的JSONL输出（进程内复用，姓名索引只建立一次）"""
+    if source_name not in _json_writers:
+        data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+        _json_writers[source_name] = CelebrityJsonlWriter(
+            os.path.join(data_dir, f"{source_name}_celebrities.jsonl"),
+            legacy_json_path=os.path.join(data_dir, f"{source_name}_celebrities.json")
+        )
+    return _json_writers[source_name]
 
-def validate_date_format(date_str):
-    """验证日期格式是否符合YYYY-MM-DD，不符合则返回None"""
-    if not date_str:
-        return None
-        
-    # 检查特殊值
-    if date_str in ['未知', '保密']:
-        return None
-    
-    # 检查只有年份的情况
-    import re
-    if re.match(r'^\d{4}$', date_str):
-        return f"{date_str}-01-01"  # 如果只有年份，添加月和日
-        
-    # 检查常见日期格式
-    date_formats = [
-        r'^\d{4}-\d{1,2}-\d{1,2}$',  # YYYY-MM-DD
-        r'^\d{4}/\d{1,2}/\d{1,2}$',  # YYYY/MM/DD
-        r'^\d{4}年\d{1,2}月\d{1,2}日$',  # YYYY年MM月DD日
-    ]
+def get_crawl_state(source_name):
+    """获取指定数据源的爬取状态存储"""
+    state_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'crawl_state')
+    os.makedirs(state_dir, exist_ok=True)
+    return CrawlStateStore(os.path.join(state_dir, f"{source_name}.sqlite3"))
+
+def crawl_sina_stars(page_count=5, max_count=50, concurrency=8, max_per_host=4, min_interval=0.3, restart=False,
+                     image_workers=4, token_workers=2, queue_size=32, batch_size=50, parser_workers=2,
+                     parser_backend=None):
+    """
+    爬取新浪娱乐的明星数据
     
-    for date_format in date_formats:
-        if re.match(date_format, date_str):
-            # 转换为标准格式
-            parts = re.findall(r'\d+', date_str)
-            if len(parts) >= 3:
-                year, month, day = parts[0], parts[1], parts[2]
-                # 确保月和日是两位数
-                month = month.zfill(2)
-                day = day.zfill(2)
-                return f"{year}-{month}-{day}"
+    爬虫拆分为相互独立的流水线阶段，阶段之间通过有界队列连接，各自有独立的并发数：
+    抓取列表页 -> 解析列表页 -> 抓取详情页 -> 解析详情页 -> 入库 -> 下载照片 -> 生成Face++ token
+    抓取由并发抓取引擎完成（共享长连接会话，按主机限制并发数和请求间隔），
+    Face++调用变慢时只会让token阶段积压，不会阻塞页面抓取；结束时打印各阶段吞吐统计。
+    HTML解析在 parser_workers 个独立进程中执行（为0时在线程中解析），优先使用 lxml 解析后端。
+    入库阶段按 batch_size 分批批量写入数据库，并追加到 data/sina_celebrities.jsonl。
     
-    # 如果都不符合，返回None
-    logger.warning(f"日期格式不正确: {date_str}")
-    return None
-
-def save_celebrity_to_json(celebrity_data, source_name):
-    """保存明星信息到JSON文件，按数据源分类"""
-    try:
-        # 确保data目录存在
-        data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
-        if not os.path.exists(data_dir):
-            os.makedirs(data_dir)
-        
-        # 根据数据源选择文件名
-        file_name = f"{source_name}_celebrities.json"
-        file_path = os.path.join(data_dir, file_name)
-        
-        # 读取现有数据，处理文件不存在或格式错误的情况
-        existing_data = []
-        if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            except json.JSONDecodeError:
-                logger.error(f"JSON文件 {file_path} 格式错误，将重新创建")
-                # 如果JSON格式错误，备份旧文件
-                if os.path.exists(file_path):
-                    backup_path = file_path + ".bak"
-                    os.rename(file_path, backup_path)
-                    logger.info(f"已将错误的JSON文件备份为 {backup_path}")
-        
-        # 检查是否已存在相同名字的明星
-        exists = any(item.get('name') == celebrity_data['name'] for item in existing_data)
-        if not exists:
-            # 添加新数据
-            existing_data.append(celebrity_data)
-            # 保存更新后的数据，确保使用正确的编码
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, ensure_ascii=False, indent=2)
-            logger.info(f"成功保存明星数据到 {file_name}")
-        return True
-    except Exception as e:
-        logger.error(f"保存明星JSON数据异常: {celebrity_data['name']}, 错误: {str(e)}")
-        # 记录更详细的错误信息以便调试
-        import traceback
-        logger.error(traceback.format_exc())
-        return False
-
-def crawl_sina_stars(page_count=5, max_count=50):
-    """爬取新浪娱乐的明星数据"""
-    base_url = "https://ent.sina.com.cn/ku/star_search_index.d.html"
+    爬取进度保存在 data/crawl_state/sina.sqlite3 中：列表页使用条件请求（ETag/Last-Modified）
+    并比较内容哈希，未变化的页面不再解析；已入库且有token的明星不再抓取详情页；
+    中断（或达到数量上限）后再次运行会从断点继续，restart=True 时重新开始。
+    """
+    base_url = SINA_BASE_URL
     
     headers = get_headers()
     headers['Referer'] = base_url
@@ -270,142 +155,249 @@ def crawl_sina_stars(page_count=5, max_count=50):
     count = 0
     current_count = Celebrity.objects.filter(source="sina").count()
     remaining_count = max(0, max_count - current_count)
+    if remaining_count <= 0:
+        logger.info(f"已达到目标抓取数量，停止抓取")
+        return count
     
-    for page in range(1, page_count + 1):
-        if count >= remaining_count:
-            logger.info(f"已达到目标抓取数量，停止抓取")
-            break
-            
-        logger.info(f"正在抓取新浪娱乐第 {page} 页")
-        try:
-            # 构建带页码的URL
-            page_url = f"{base_url}?page={page}"
-            
-            response = requests.get(page_url, headers=headers, timeout=15)
-            response.encoding = 'utf-8'
-            
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # 查找明星列表
-                star_list = soup.select('div#dataList ul.tv-list.star_list.clearfix li')
-                
-                if not star_list:
-                    logger.error(f"在第 {page} 页未找到明星列表")
-                    continue
-                
-                for star_item in star_list:
-                    try:
-                        # 获取明星姓名
-                        name_tag = star_item.select_one('h4.left a')
-                        if not name_tag:
-                            continue
-                        name = name_tag.get_text().strip()
-                        
-                        # 获取明星详情页链接
-                        detail_url = name_tag.get('href')
-                        
-                        # 获取明星照片
-                        img_tag = star_item.select_one('a.item-img.left img')
-                        photo_url = img_tag.get('src') if img_tag else ''
-                        if photo_url and photo_url.startswith('//'):
-                            photo_url = 'https:' + photo_url
-                        
-                        # 提取基本信息
-                        intro_div = star_item.select_one('div.item-intro')
-                        if not intro_div:
-                            continue
-                            
-                        info = {}
-                        intro_paragraphs = intro_div.select('p')
-                        for p in intro_paragraphs:
-                            label = p.select_one('span.txt')
-                            if label:
-                                key = label.get_text().strip().rstrip(':')
-                                # 获取标签后面的文本
-                                value = p.get_text().replace(label.get_text(), '').strip()
-                                info[key] = value
-                        
-                        # 构建描述
-                        description_parts = []
-                        if '性别' in info:
-                            description_parts.append(f"性别: {info['性别']}")
-                        if '职业' in info:
-                            description_parts.append(f"职业: {info['职业']}")
-                        if '国籍' in info:
-                            description_parts.append(f"国籍: {info['国籍']}")
-                        if '出生日期' in info:
-                            description_parts.append(f"出生日期: {info['出生日期']}")
-                        if '星座' in info:
-                            description_parts.append(f"星座: {info['星座']}")
-                        if '身高' in info:
-                            description_parts.append(f"身高: {info['身高']}")
-                            
-                        description = "\n".join(description_parts)
-                        
-                        # 获取更多详细信息（可选）
-                        if detail_url:
-                            try:
-                                detail_resp = requests.get(detail_url, headers=headers, timeout=10)
-                                detail_resp.encoding = 'utf-8'
-                                
-                                if detail_resp.status_code == 200:
-                                    detail_soup = BeautifulSoup(detail_resp.text, 'html.parser')
-                                    # 寻找详细简介
-                                    intro_text = detail_soup.select_one('div.star-info-txt')
-                                    if intro_text:
-                                        more_info = intro_text.get_text().strip()
-                                        if more_info:
-                                            description += "\n\n" + more_info
-                            except Exception as e:
-                                logger.error(f"获取明星详情页出错: {detail_url}, 错误: {str(e)}")
-                        
-                        if name and photo_url:
-                            celebrity_data = {
-                                "name": name,
-                                "photo_url": photo_url,
-                                "description": description,
-                                "source": "sina",
-                                "raw_data": info,
-                                "detail_url": detail_url
-                            }
-                            
-                            if save_celebrity_to_db(celebrity_data, "sina"):
-                                count += 1
-                                print(f"新浪娱乐: 已保存 {name} (总数: {count})")
-                                
-                                if count >= remaining_count:
-                                    logger.info(f"已达到最大抓取数量，停止抓取")
-                                    return count
-                        
-                        # 随机延迟，避免被封
-                        time.sleep(random.uniform(0.5, 1.5))
-                        
-                    except Exception as e:
-                        logger.error(f"处理明星数据时出错: {str(e)}")
-                
-                # 如果本页没有找到明星数据，可能已到末页
-                if len(star_list) == 0:
-                    logger.info("没有找到更多明星数据，停止爬取")
-                    break
-                    
-            else:
-                logger.error(f"请求新浪娱乐页面失败，状态码: {response.status_code}")
+    state = get_crawl_state("sina")
+    resumed = state.begin_run(restart=restart)
+    if resumed:
+        logger.info("检测到未完成的爬取，从断点继续")
+    else:
+        # 新的一轮：所有列表页加入队列
+        state.enqueue([
+            (f"{base_url}?page={page}", 'list', f"{base_url}?page={page}", {'page': page})
+            for page in range(1, page_count + 1)
+        ])
+    
+    engine = FetchEngine(
+        concurrency=concurrency,
+        max_per_host=max_per_host,
+        min_interval=min_interval,
+    )
+    parsers = ParserPool(workers=parser_workers, backend=parser_backend)
+    logger.info(f"HTML解析后端: {parsers.backend}，解析进程数: {parser_workers}")
+    stats = {'not_modified': 0, 'unchanged': 0, 'skipped_existing': 0, 'tokens': 0}
+    stats_lock = threading.Lock()
+    
+    def count_stat(name):
+        """统计计数（解析和token生成阶段有多个线程）"""
+        with stats_lock:
+            stats[name] += 1
+    pipeline = Pipeline()
+    
+    def source_items():
+        """先恢复断点中未完成的明星，再产出待抓取的列表页"""
+        for key, url, star in state.pending('detail'):
+            yield {'kind': 'detail', 'key': key, 'star': star}
+        for key, url, payload in state.pending('list'):
+            yield {'kind': 'list', 'key': key, 'url': url, 'page': payload['page']}
+    
+    def to_detail_request(key, star):
+        """构建详情页抓取任务，已有token的明星不再处理"""
+        existing = Celebrity.objects.filter(name=star['name']).values('face_token').first()
+        if existing and existing['face_token']:
+            count_stat('skipped_existing')
+            state.mark_done(key)
+            return []
+        # 已存在（仅需补充token）或没有详情页的明星不抓取详情页
+        url = None if existing else star['detail_url']
+        return [{'key': key, 'star': star, 'url': url}]
+    
+    def fetch_list(item):
+        """阶段：抓取列表页（条件请求）"""
+        if item['kind'] == 'detail':
+            return [item]
+        result = engine.fetch(
+            item['url'], headers=headers, extra_headers=state.conditional_headers(item['url'])
+        )
+        return [dict(item, result=result)]
+    
+    def parse_list(item):
+        """阶段：解析列表页，明星加入队列作为断点"""
+        if item['kind'] == 'detail':
+            return to_detail_request(item['key'], item['star'])
+        
+        page = item['page']
+        result = item['result']
+        if result.error:
+            logger.error(f"抓取新浪娱乐第 {page} 页时出错: {str(result.error)}")
+            return []
+        if result.status_code == 304:
+            # 服务端确认页面未变化
+            count_stat('not_modified')
+            state.mark_done(item['key'])
+            return []
+        if result.status_code != 200:
+            logger.error(f"请求新浪娱乐页面失败，状态码: {result.status_code}")
+            return []
+        
+        content_hash = state.content_hash(result.text)
+        if state.is_unchanged(result.url, content_hash):
+            # 内容与上次一致，跳过解析
+            count_stat('unchanged')
+            state.mark_done(item['key'])
+            return []
         
-        except Exception as e:
-            logger.error(f"抓取新浪娱乐第 {page} 页时出错: {str(e)}")
+        logger.info(f"正在解析新浪娱乐第 {page} 页")
+        stars = parsers.parse_list(result.text)
+        if not stars:
+            logger.error(f"在第 {page} 页未找到明星列表")
+            return []
         
-        # 页面间延迟
-        time.sleep(random.uniform(2, 4))
+        # 明星加入队列与列表页完成在同一事务中保存，作为断点
+        detail_items = [
+            (star['detail_url'] or f"name:{star['name']}", 'detail', star['detail_url'], star)
+            for star in stars
+        ]
+        state.enqueue(detail_items, done_key=item['key'])
+        state.record_page(result.url, result.headers, content_hash)
+        
+        requests_out = []
+        for key, _, _, star in detail_items:
+            requests_out.extend(to_detail_request(key, star))
+        return requests_out
+    
+    def fetch_detail(item):
+        """阶段：抓取详情页"""
+        if item['url']:
+            item['result'] = engine.fetch(item['url'], headers=headers)
+        return [item]
+    
+    def parse_detail(item):
+        """阶段：解析详情页，构建明星数据"""
+        star = item['star']
+        description = star['description']
+        
+        # 获取更多详细信息（可选）
+        result = item.get('result')
+        if result is not None:
+            if result.error:
+                logger.error(f"获取明星详情页出错: {result.url}, 错误: {str(result.error)}")
+            elif result.status_code == 200:
+                more_info = parsers.parse_detail(result.text)
+                if more_info:
+                    description += "\n\n" + more_info
+        
+        if not (star['name'] and star['photo_url']):
+            state.mark_done(item['key'])
+            return []
+        
+        return [{
+            'key': item['key'],
+            'celebrity_data': {
+                "name": star['name'],
+                "photo_url": star['photo_url'],
+                "description": description,
+                "source": "sina",
+                "raw_data": star['raw_data'],
+                "detail_url": star['detail_url']
+            }
+        }]
+    
+    persist_buffer = []
+    
+    def persist(item):
+        """阶段：批量保存明星信息（不生成token），攒够一批再写入"""
+        persist_buffer.append(item)
+        if len(persist_buffer) >= batch_size:
+            return flush_persist()
+        return []
+    
+    def flush_persist():
+        """批量写入数据库，需要token的明星交给下载阶段"""
+        nonlocal count
+        items = persist_buffer[:]
+        persist_buffer.clear()
+        if not items:
+            return []
+        
+        result = bulk_upsert_celebrities(
+            [item['celebrity_data'] for item in items], "sina",
+            max_create=remaining_count - count
+        )
+        # 因数量上限未写入的明星保留在断点中
+        skipped_names = {record['name'] for record in result['skipped']}
+        state.mark_done_many([
+            item['key'] for item in items if item['celebrity_data']['name'] not in skipped_names
+        ])
+        
+        writer = get_json_writer("sina")
+        for record in result['created']:
+            writer.append(record)
+            count += 1
+            logger.info(f"新浪娱乐: 已保存 {record['name']} (总数: {count})")
+        
+        if count >= remaining_count:
+            logger.info(f"已达到最大抓取数量，停止抓取")
+            # 停止抓取和入库，已入库的明星继续下载照片和生成token
+            pipeline.close_until('persist')
+        
+        return [
+            {'id': row['id'], 'name': row['name'], 'photo_url': row['photo']}
+            for row in result['rows'] if not row['face_token']
+        ]
+    
+    def download_image(item):
+        """阶段：下载照片到本地镜像"""
+        image_data = PhotoMirror.fetch(item['photo_url'], headers=get_headers())
+        if not image_data:
+            return []
+        return [dict(item, image_data=image_data)]
+    
+    def generate_token(item):
+        """阶段：调用Face++生成token并更新明星"""
+        face_token, key_id = generate_face_token(item['photo_url'], image_data=item['image_data'])
+        if face_token:
+            Celebrity.objects.filter(id=item['id']).update(
+                face_token=face_token,
+                face_token_key=key_id,
+                photo_hash=PhotoMirror.hash_for_url(item['photo_url'])
+            )
+            count_stat('tokens')
+            logger.info(f"已为明星 {item['name']} 生成Face++ token")
+        return []
+    
+    pipeline.add_stage('fetch_list', fetch_list, workers=concurrency, queue_size=queue_size)
+    # 解析阶段的线程只负责把页面交给解析进程，线程数与解析进程数一致
+    parse_workers = max(1, parser_workers)
+    pipeline.add_stage('parse_list', parse_list, workers=parse_workers, queue_size=queue_size)
+    pipeline.add_stage('fetch_detail', fetch_detail, workers=concurrency, queue_size=queue_size)
+    pipeline.add_stage('parse_detail', parse_detail, workers=parse_workers, queue_size=queue_size)
+    pipeline.add_stage('persist', persist, workers=1, queue_size=queue_size, on_finish=flush_persist)
+    pipeline.add_stage('download_image', download_image, workers=image_workers, queue_size=queue_size)
+    pipeline.add_stage('generate_token', generate_token, workers=token_workers, queue_size=queue_size)
+    
+    try:
+        pipeline.run(source_items())
+    finally:
+        engine.close()
+        parsers.close()
+        get_json_writer("sina").close()
+        _json_writers.pop("sina", None)
+        if state.finish_run():
+            logger.info("本轮爬取已全部完成")
+        else:
+            logger.info("本轮爬取未全部完成，下次运行将从断点继续")
+        state.close()
     
-    logger.info(f"新浪娱乐爬取完成，成功保存 {count} 个明星信息")
+    logger.info(f"各阶段吞吐统计:\n{pipeline.report()}")
+    logger.info(
+        f"新浪娱乐爬取完成，成功保存 {count} 个明星信息，生成 {stats['tokens']} 个Face++ token；"
+        f"未修改页面 {stats['not_modified']} 个，内容未变化页面 {stats['unchanged']} 个，"
+        f"跳过已有明星 {stats['skipped_existing']} 个"
+    )
     return count
 
-def crawl_celebrities(source='sina', page_count=5, limit=50):
+def crawl_celebrities(source='sina', page_count=5, limit=50, concurrency=8, max_per_host=4, min_interval=0.3,
+                      restart=False, image_workers=4, token_workers=2, batch_size=50, parser_workers=2,
+                      parser_backend=None):
     """统一的爬虫入口函数"""
     total_count = 0
     if source == 'sina':
-        total_count = crawl_sina_stars(page_count, limit)
+        total_count = crawl_sina_stars(page_count, limit, concurrency, max_per_host, min_interval, restart,
+                                       image_workers, token_workers, batch_size=batch_size,
+                                       parser_workers=parser_workers, parser_backend=parser_backend)
     
     return {
         "source": source,
@@ -420,8 +412,20 @@ if __name__ == "__main__":
                       help='数据源: sina-新浪娱乐')
     parser.add_argument('--page_count', type=int, default=5, help='爬取的页数')
     parser.add_argument('--max_count', type=int, default=50, help='最多爬取明星数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发抓取线程数')
+    parser.add_argument('--per_host', type=int, default=4, help='每个主机的最大并发请求数')
+    parser.add_argument('--interval', type=float, default=0.3, help='同一主机相邻请求的最小间隔（秒）')
+    parser.add_argument('--restart', action='store_true', help='放弃未完成的断点，从第1页重新开始')
+    parser.add_argument('--image_workers', type=int, default=4, help='照片下载阶段的并发数')
+    parser.add_argument('--token_workers', type=int, default=2, help='Face++ token生成阶段的并发数')
+    parser.add_argument('--batch_size', type=int, default=50, help='每批写入数据库的明星数')
+    parser.add_argument('--parser_workers', type=int, default=2, help='HTML解析进程数，0表示在线程中解析')
+    parser.add_argument('--parser', type=str, choices=['lxml', 'html.parser'], default=None,
+                      help='HTML解析后端，默认优先使用lxml')
     args = parser.parse_args()
     
-    total_count = crawl_sina_stars(args.page_count, args.max_count)
+    total_count = crawl_sina_stars(args.page_count, args.max_count, args.concurrency, args.per_host, args.interval,
+                                   args.restart, args.image_workers, args.token_workers, batch_size=args.batch_size,
+                                   parser_workers=args.parser_workers, parser_backend=args.parser)
     
-    print(f"爬取完成，共爬取了 {total_count} 个明星数据")
\ No newline at end of file
+    logger.info(f"爬取完成，共爬取了 {total_count} 个明星数据")
\ No newline at end of file
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+爬取状态存储（断点续爬与增量抓取）
+
+使用 SQLite 文件保存：
+- pages: 每个页面上次抓取时的 ETag / Last-Modified 和内容哈希，用于条件请求和跳过未变化的页面
+- frontier: 本轮待抓取的URL队列及其状态（pending/done），中断后从这里恢复
+- runs: 每一轮爬取的开始/结束时间，未结束的轮次在下次启动时自动续爬
+"""
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+class CrawlStateStore:
+    """爬取状态存储，可在多个线程中共享"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                fetched_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS frontier (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                url TEXT,
+                payload TEXT,
+                state TEXT NOT NULL DEFAULT 'pending',
+                seq INTEGER NOT NULL,
+                updated_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS frontier_state ON frontier (kind, state, seq);
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL,
+                finished_at REAL
+            );
+        """)
+        self.conn.commit()
+        self.run_id = None
+
+    @staticmethod
+    def content_hash(text):
+        """页面内容哈希"""
+        return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+    def begin_run(self, restart=False):
+        """
+        开始一轮爬取
+
+        参数:
+            restart (bool): 为True时放弃未完成的断点，重新开始
+
+        返回:
+            bool: 是否从断点恢复
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id FROM runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+            if row and not restart:
+                self.run_id = row[0]
+                return True
+
+            # 新的一轮：清空上一轮的队列
+            self.conn.execute("UPDATE runs SET finished_at = ? WHERE finished_at IS NULL", (time.time(),))
+            self.conn.execute("DELETE FROM frontier")
+            cursor = self.conn.execute("INSERT INTO runs (started_at) VALUES (?)", (time.time(),))
+            self.run_id = cursor.lastrowid
+            self.conn.commit()
+            return False
+
+    def finish_run(self):
+        """本轮队列全部完成时结束本轮，否则保留断点"""
+        with self._lock:
+            pending = self.conn.execute("SELECT COUNT(*) FROM frontier WHERE state = 'pending'").fetchone()[0]
+            if pending:
+                return False
+            self.conn.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), self.run_id))
+            self.conn.commit()
+            return True
+
+    def enqueue(self, items, done_key=None):
+        """
+        加入待抓取队列，已存在的条目保持原状态
+
+        参数:
+            items: (key, kind, url, payload) 的列表
+            done_key (str, 可选): 同一事务中标记为完成的条目（如产生这些条目的列表页）
+        """
+        with self._lock:
+            seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM frontier").fetchone()[0]
+            for key, kind, url, payload in items:
+                seq += 1
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO frontier (key, kind, url, payload, state, seq, updated_at) "
+                    "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+                    (key, kind, url, json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+                     seq, time.time())
+                )
+            if done_key:
+                self._mark_done(done_key)
+            self.conn.commit()
+
+    def _mark_done(self, key):
+        self.conn.execute(
+            "UPDATE frontier SET state = 'done', updated_at = ? WHERE key = ?", (time.time(), key)
+        )
+
+    def mark_done(self, key):
+        """标记条目已完成（断点）"""
+        with self._lock:
+            self._mark_done(key)
+            self.conn.commit()
+
+    def mark_done_many(self, keys):
+        """在同一事务中标记多个条目已完成"""
+        with self._lock:
+            for key in keys:
+                self._mark_done(key)
+            self.conn.commit()
+
+    def pending(self, kind):
+        """
+        获取指定类型的待抓取条目
+
+        返回:
+            list: (key, url, payload) 的列表，按加入顺序排列
+        """
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT key, url, payload FROM frontier WHERE kind = ? AND state = 'pending' ORDER BY seq",
+                (kind,)
+            ).fetchall()
+        return [(key, url, json.loads(payload) if payload else None) for key, url, payload in rows]
+
+    def conditional_headers(self, url):
+        """根据上次抓取记录构建条件请求头"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT etag, last_modified FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        headers = {}
+        if row:
+            etag, last_modified = row
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def is_unchanged(self, url, content_hash):
+        """页面内容哈希是否与上次一致"""
+        with self._lock:
+            row = self.conn.execute("SELECT content_hash FROM pages WHERE url = ?", (url,)).fetchone()
+        return bool(row and row[0] == content_hash)
+
+    def record_page(self, url, response_headers, content_hash):
+        """记录页面的缓存校验信息"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO pages (url, etag, last_modified, content_hash, fetched_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified, "
+                "content_hash = excluded.content_hash, fetched_at = excluded.fetched_at",
+                (url, response_headers.get('ETag'), response_headers.get('Last-Modified'), content_hash, time.time())
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+爬虫并发抓取引擎
+
+- 共享的 keep-alive 会话（连接池），避免每次请求重新建立连接
+- 按主机限制并发数和请求间隔（礼貌抓取）
+- 多阶段流水线：各阶段有独立的工作线程，通过有界队列相连，下游跟不上时上游自动阻塞（背压）
+"""
+
+import time
+import queue
+import random
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class FetchResult:
+    """单次抓取的结果"""
+
+    def __init__(self, url, status_code=None, text=None, headers=None, elapsed=0.0, error=None, context=None):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.elapsed = elapsed
+        self.error = error
+        self.context = context
+
+    @property
+    def ok(self):
+        return self.error is None and self.status_code == 200
+
+
+class HostLimiter:
+    """
+    按主机的并发与间隔控制
+
+    每个主机最多同时 max_per_host 个请求，且相邻两次请求的开始时间至少间隔 min_interval 秒。
+    """
+
+    def __init__(self, max_per_host=4, min_interval=0.2, jitter=0.1):
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_slot = {}
+
+    def _get_semaphore(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+    def _wait_for_slot(self, host):
+        """预约该主机的下一个请求时间点，并等待到该时间点"""
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_slot.get(host, now))
+            interval = self.min_interval + random.uniform(0, self.jitter) if self.min_interval else 0
+            self._next_slot[host] = start_at + interval
+        delay = start_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def acquire(self, url):
+        host = urlsplit(url).netloc
+        semaphore = self._get_semaphore(host)
+        semaphore.acquire()
+        self._wait_for_slot(host)
+        return semaphore
+
+    def release(self, semaphore):
+        semaphore.release()
+
+
+class FetchEngine:
+    """
+    并发抓取引擎
+
+    fetch 是线程安全的，由流水线抓取阶段的多个工作线程共享调用（并发数即工作线程数）。
+
+    使用示例:
+        engine = FetchEngine(concurrency=8, max_per_host=4)
+        pipeline.add_stage('fetch', lambda url: [engine.fetch(url)], workers=engine.concurrency)
+        ...
+        engine.close()
+    """
+
+    def __init__(self, concurrency=8, max_per_host=4, min_interval=0.2,
+                 timeout=15, headers_factory=None, encoding='utf-8'):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.headers_factory = headers_factory
+        self.encoding = encoding
+        self.limiter = HostLimiter(max_per_host=max_per_host, min_interval=min_interval)
+
+        # 共享会话，连接池大小与并发数一致，保持长连接
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, url, headers=None, timeout=None, context=None, extra_headers=None):
+        """抓取单个URL（阻塞），不抛出异常，错误记录在结果中"""
+        if headers is None and self.headers_factory:
+            headers = self.headers_factory()
+        if extra_headers:
+            # 条件请求头等按请求附加的头部
+            headers = {**(headers or {}), **extra_headers}
+        semaphore = self.limiter.acquire(url)
+        started = time.monotonic()
+        try:
+            response = self.session.get(url, headers=headers, timeout=timeout or self.timeout)
+            if self.encoding:
+                response.encoding = self.encoding
+            return FetchResult(
+                url,
+                status_code=response.status_code,
+                text=response.text,
+                headers=response.headers,
+                elapsed=time.monotonic() - started,
+                context=context,
+            )
+        except Exception as e:
+            return FetchResult(url, elapsed=time.monotonic() - started, error=e, context=context)
+        finally:
+            self.limiter.release(semaphore)
+
+    def close(self):
+        self.session.close()
+
+
+class Stage:
+    """流水线中的一个处理阶段，拥有独立的有界输入队列和工作线程"""
+
+    def __init__(self, name, handler, workers=1, queue_size=32, on_finish=None):
+        self.name = name
+        self.handler = handler
+        # 所有数据处理完后调用一次（如写出批量缓冲），返回值同handler
+        self.on_finish = on_finish
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        # 关闭后不再处理新数据，队列中的数据会被丢弃
+        self.closed = threading.Event()
+        self.processed = 0
+        self.emitted = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed, emitted, failed):
+        with self._lock:
+            self.processed += 1
+            self.emitted += emitted
+            self.failed += 1 if failed else 0
+            self.busy_seconds += elapsed
+
+    @property
+    def wall_seconds(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self):
+        wall = self.wall_seconds
+        return self.processed / wall if wall > 0 else 0.0
+
+
+class Pipeline:
+    """
+    多阶段流水线
+
+    各阶段通过有界队列相连，每个阶段有自己的并发数；下游处理不过来时上游在投递时阻塞（背压）。
+    阶段处理函数接收一个数据，返回要交给下一阶段的数据列表（或生成器、None）。
+
+    使用示例:
+        pipeline = Pipeline()
+        pipeline.add_stage('fetch', fetch_handler, workers=8)
+        pipeline.add_stage('parse', parse_handler, workers=2)
+        pipeline.run(source_items)
+        print(pipeline.report())
+    """
+
+    _END = object()
+
+    def __init__(self):
+        self.stages = []
+
+    def add_stage(self, name, handler, workers=1, queue_size=32, on_finish=None):
+        stage = Stage(name, handler, workers=workers, queue_size=queue_size, on_finish=on_finish)
+        self.stages.append(stage)
+        return stage
+
+    def get_stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def close_until(self, name):
+        """关闭指定阶段及其所有上游阶段（停止接收新数据），下游阶段继续处理已产出的数据"""
+        for stage in self.stages:
+            stage.closed.set()
+            if stage.name == name:
+                break
+
+    @staticmethod
+    def _put(stage, item):
+        """投递数据，队列满时阻塞；目标阶段已关闭时丢弃"""
+        while not stage.closed.is_set():
+            try:
+                stage.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+
+        while True:
+            item = stage.queue.get()
+            if item is self._END:
+                break
+            if stage.closed.is_set():
+                continue
+
+            started = time.monotonic()
+            failed = False
+            try:
+                outputs = stage.handler(item)
+                outputs = list(outputs) if outputs is not None else []
+            except Exception as e:
+                failed = True
+                outputs = []
+                logger.error(f"流水线阶段 {stage.name} 处理出错: {str(e)}")
+            stage.record(time.monotonic() - started, len(outputs), failed)
+
+            if next_stage:
+                for output in outputs:
+                    self._put(next_stage, output)
+
+        # 最后一个退出的工作线程通知下游阶段结束
+        with stage._lock:
+            stage._active -= 1
+            last_worker = stage._active == 0
+        if last_worker:
+            if stage.on_finish:
+                try:
+                    outputs = list(stage.on_finish() or [])
+                except Exception as e:
+                    outputs = []
+                    logger.error(f"流水线阶段 {stage.name} 结束处理出错: {str(e)}")
+                if next_stage:
+                    for output in outputs:
+                        self._put(next_stage, output)
+            stage.finished_at = time.monotonic()
+            if next_stage:
+                for _ in range(next_stage.workers):
+                    next_stage.queue.put(self._END)
+
+    def run(self, source):
+        """运行流水线直到所有数据处理完毕（在调用方线程中读取数据源）"""
+        threads = []
+        started = time.monotonic()
+        for index, stage in enumerate(self.stages):
+            stage.started_at = started
+            stage._active = stage.workers
+            for worker_index in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._worker, args=(index,),
+                    name=f"pipeline-{stage.name}-{worker_index}", daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        first_stage = self.stages[0]
+        try:
+            for item in source:
+                if first_stage.closed.is_set() or not self._put(first_stage, item):
+                    break
+        finally:
+            for _ in range(first_stage.workers):
+                first_stage.queue.put(self._END)
+            for thread in threads:
+                thread.join()
+
+    def report(self):
+        """各阶段吞吐统计"""
+        lines = [
+            f"{'阶段':<16}{'并发':>6}{'处理':>8}{'产出':>8}{'失败':>6}{'忙碌(秒)':>10}{'耗时(秒)':>10}{'吞吐(条/秒)':>12}"
+        ]
+        for stage in self.stages:
+            lines.append(
+                f"{stage.name:<16}{stage.workers:>6}{stage.processed:>8}{stage.emitted:>8}{stage.failed:>6}"
+                f"{stage.busy_seconds:>10.2f}{stage.wall_seconds:>10.2f}{stage.throughput:>12.2f}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+爬虫页面解析
+
+- 解析后端可插拔：优先使用C实现的 lxml，未安装时回退到纯Python的 html.parser
+- 解析函数只依赖 BeautifulSoup，不依赖Django，可以在进程池中并行执行
+"""
+
+import logging
+import multiprocessing
+import concurrent.futures
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+logger = logging.getLogger(__name__)
+
+# 按优先级排列的解析后端
+PARSER_BACKENDS = ['lxml', 'html.parser']
+
+# 只为需要的区域建立文档树，跳过导航、筛选和页脚等无关内容
+LIST_STRAINER = SoupStrainer('div', id='dataList')
+DETAIL_STRAINER = SoupStrainer('div', class_='star-info-txt')
+
+
+def available_backends():
+    """当前环境可用的解析后端"""
+    backends = []
+    for backend in PARSER_BACKENDS:
+        if backend == 'lxml':
+            try:
+                import lxml  # noqa: F401
+            except ImportError:
+                continue
+        backends.append(backend)
+    return backends
+
+
+def get_parser_backend(preferred=None):
+    """
+    选择解析后端
+
+    参数:
+        preferred (str, 可选): 指定的后端，不可用时回退到默认后端
+
+    返回:
+        str: BeautifulSoup 解析器名称
+    """
+    backends = available_backends()
+    if preferred and preferred in backends:
+        return preferred
+    if preferred:
+        logger.warning(f"解析后端 {preferred} 不可用，使用 {backends[0]}")
+    return backends[0]
+
+
+def parse_star_list(html, backend='html.parser'):
+    """解析新浪娱乐明星列表页，返回明星基本信息列表"""
+    soup = BeautifulSoup(html, backend, parse_only=LIST_STRAINER)
+
+    # 查找明星列表
+    star_list = soup.select('div#dataList ul.tv-list.star_list.clearfix li')
+
+    stars = []
+    for star_item in star_list:
+        try:
+            # 获取明星姓名
+            # 条目内的查找使用 find，比CSS选择器少一层匹配开销
+            heading = star_item.find('h4', class_='left')
+            name_tag = heading.find('a') if heading else None
+            if not name_tag:
+                continue
+            name = name_tag.get_text().strip()
+
+            # 获取明星详情页链接
+            detail_url = name_tag.get('href')
+
+            # 获取明星照片
+            img_link = star_item.find('a', class_='item-img')
+            img_tag = img_link.find('img') if img_link else None
+            photo_url = img_tag.get('src') if img_tag else ''
+            if photo_url and photo_url.startswith('//'):
+                photo_url = 'https:' + photo_url
+
+            # 提取基本信息
+            intro_div = star_item.find('div', class_='item-intro')
+            if not intro_div:
+                continue
+
+            info = {}
+            intro_paragraphs = intro_div.find_all('p')
+            for p in intro_paragraphs:
+                label = p.find('span', class_='txt')
+                if label:
+                    key = label.get_text().strip().rstrip(':')
+                    # 获取标签后面的文本
+                    value = p.get_text().replace(label.get_text(), '').strip()
+                    info[key] = value
+
+            # 构建描述
+            description_parts = []
+            if '性别' in info:
+                description_parts.append(f"性别: {info['性别']}")
+            if '职业' in info:
+                description_parts.append(f"职业: {info['职业']}")
+            if '国籍' in info:
+                description_parts.append(f"国籍: {info['国籍']}")
+            if '出生日期' in info:
+                description_parts.append(f"出生日期: {info['出生日期']}")
+            if '星座' in info:
+                description_parts.append(f"星座: {info['星座']}")
+            if '身高' in info:
+                description_parts.append(f"身高: {info['身高']}")
+
+            stars.append({
+                "name": name,
+                "photo_url": photo_url,
+                "description": "\n".join(description_parts),
+                "raw_data": info,
+                "detail_url": detail_url
+            })
+        except Exception as e:
+            logger.error(f"处理明星数据时出错: {str(e)}")
+
+    return stars
+
+
+def parse_star_detail(html, backend='html.parser'):
+    """解析新浪娱乐明星详情页，返回详细简介文本"""
+    detail_soup = BeautifulSoup(html, backend, parse_only=DETAIL_STRAINER)
+    # 寻找详细简介
+    intro_text = detail_soup.select_one('div.star-info-txt')
+    if intro_text:
+        return intro_text.get_text().strip()
+    return ''
+
+
+class ParserPool:
+    """
+    解析进程池
+
+    解析是CPU密集型操作，放在独立进程中执行可以绕开GIL，让抓取线程继续使用网络。
+    workers为0时在调用方线程中直接解析。
+    """
+
+    def __init__(self, workers=2, backend=None):
+        self.workers = workers
+        self.backend = get_parser_backend(backend)
+        self.executor = None
+        if workers > 0:
+            # spawn方式启动，避免在已有线程的进程中fork
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+
+    def _run(self, func, html):
+        if self.executor is None:
+            return func(html, self.backend)
+        return self.executor.submit(func, html, self.backend).result()
+
+    def parse_list(self, html):
+        return self._run(parse_star_list, html)
+
+    def parse_detail(self, html):
+        return self._run(parse_star_detail, html)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+比对链路端到端压测
+
+在本进程中启动Face++模拟服务，为每种明星库规模准备一个临时数据库（通过 import_celebrities 导入带token的明星），
+启动 runserver，然后按指定并发上传照片（POST /api/compare/）并轮询状态接口直到比对结束。
+
+按客户端观察到的进度划分阶段：
+- upload: 上传请求的往返时间
+- queue: 从上传返回到开始处理（不再有 queue_position）
+- detect: 从开始处理到人脸检测完成（进度达到50）
+- compare: 从检测完成到比对结束
+- total: 从发起上传到比对结束
+
+每种（明星库规模, 上传尺寸）组合输出吞吐和各阶段的 p50/p95/p99，结果保存为JSON，
+可以用 --baseline 与之前某次提交的结果比较。
+
+示例:
+    python loadtest.py --catalogue-sizes 100,1000,10000 --upload-sizes 640,1600 --requests 40 --concurrency 8
+    python loadtest.py --catalogue-sizes 100000 --requests 10 --baseline benchmarks/loadtest/上次的结果.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import concurrent.futures
+from datetime import datetime
+
+import requests
+from PIL import Image
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+sys.path.append(BACKEND_DIR)
+from celebrity_compare.facepp_emulator import EmulatorConfig, create_server  # noqa: E402
+from celebrity_compare.facepp_keys import make_key_id  # noqa: E402
+
+API_KEY = 'loadtest-key'
+API_SECRET = 'loadtest-secret'
+STAGES = ['upload', 'queue', 'detect', 'compare', 'total']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def summarize_samples(samples):
+    """耗时样本（秒）的统计，单位毫秒"""
+    if not samples:
+        return {'count': 0}
+    samples = sorted(samples)
+
+    def pick(percent):
+        return round(samples[min(int(len(samples) * percent / 100), len(samples) - 1)] * 1000, 1)
+
+    return {
+        'count': len(samples),
+        'mean': round(sum(samples) / len(samples) * 1000, 1),
+        'p50': pick(50),
+        'p95': pick(95),
+        'p99': pick(99),
+        'max': round(samples[-1] * 1000, 1),
+    }
+
+
+def make_uploads(width, count, seed):
+    """生成 count 张宽度为 width 的JPEG（3:4），内容各不相同，避免被合并为重复请求"""
+    rng = random.Random(seed)
+    uploads = []
+    for _ in range(count):
+        # 低分辨率噪声放大后再编码，体积与真实照片接近
+        noise = Image.frombytes('RGB', (24, 32), bytes(rng.getrandbits(8) for _ in range(24 * 32 * 3)))
+        image = noise.resize((width, width * 4 // 3), Image.BICUBIC)
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=90)
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+def write_catalogue(path, size, emulator, seed):
+    """生成 size 个明星的JSONL，face_token直接在模拟服务中登记"""
+    rng = random.Random(seed)
+    key_id = make_key_id(API_KEY)
+    with open(path, 'w', encoding='utf-8') as f:
+        for index in range(size):
+            face_token = emulator.register_face(API_KEY, rng.getrandbits(64))
+            f.write(json.dumps({
+                'name': f'压测明星{index:06d}',
+                'photo': f'https://example.invalid/loadtest/{index}.jpg',
+                'face_token': face_token,
+                'face_token_key': key_id,
+                'source': 'loadtest',
+            }, ensure_ascii=False) + '\n')
+
+
+class AppServer:
+    """使用临时数据库和媒体目录启动的 runserver 子进程"""
+
+    def __init__(self, workdir, emulator_url, extra_env=None):
+        self.workdir = workdir
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.env = dict(
+            os.environ,
+            DEBUG='False',
+            DB_NAME=os.path.join(workdir, 'db.sqlite3'),
+            MEDIA_ROOT=os.path.join(workdir, 'media'),
+            PHOTO_MIRROR_DIR=os.path.join(workdir, 'mirror'),
+            FACE_PLUS_PLUS_API_URL=emulator_url,
+            FACE_PLUS_PLUS_API_KEY=API_KEY,
+            FACE_PLUS_PLUS_API_SECRET=API_SECRET,
+            FACE_PLUS_PLUS_API_KEYS=f'{API_KEY}:{API_SECRET}',
+        )
+        self.env.update(extra_env or {})
+        self.process = None
+
+    def manage(self, *args):
+        subprocess.run(
+            [sys.executable, 'manage.py', *args], cwd=BACKEND_DIR, env=self.env, check=True,
+            stdout=subprocess.DEVNULL
+        )
+
+    def start(self, timeout=60):
+        self.process = subprocess.Popen(
+            [sys.executable, 'manage.py', 'runserver', f'127.0.0.1:{self.port}', '--noreload'],
+            cwd=BACKEND_DIR, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError('runserver 启动失败')
+            try:
+                requests.get(f'{self.base_url}/api/compare/admission/', timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError('等待 runserver 启动超时')
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def run_one(base_url, photo, poll_interval, timeout):
+    """上传一张照片并轮询到比对结束，返回各阶段耗时"""
+    session = requests.Session()
+    session_id = uuid.uuid4().hex
+    result = {'outcome': None, 'stages': {}}
+    started = time.perf_counter()
+    response = session.post(
+        f'{base_url}/api/compare/', data={'session_id': session_id},
+        files={'photo': ('upload.jpg', photo, 'image/jpeg')}, timeout=timeout
+    )
+    uploaded = time.perf_counter()
+    result['stages']['upload'] = uploaded - started
+    if response.status_code in (429, 503):
+        result['outcome'] = 'rejected'
+        return result
+    if response.status_code not in (200, 202):
+        result['outcome'] = f'http_{response.status_code}'
+        return result
+
+    comparison_id = response.json()['id']
+    admitted = detected = None
+    while time.perf_counter() - started < timeout:
+        data = session.get(
+            f'{base_url}/api/compare/status/{comparison_id}/', params={'session_id': session_id}, timeout=timeout
+        ).json()
+        now = time.perf_counter()
+        if admitted is None and not data.get('queue_position'):
+            admitted = now
+        if detected is None and data.get('progress', 0) >= 50:
+            detected = now
+        if data['status'] != 'processing':
+            admitted = admitted or now
+            detected = detected or now
+            result['outcome'] = data['status']
+            result['stages'].update({
+                'queue': admitted - uploaded,
+                'detect': detected - admitted,
+                'compare': now - detected,
+                'total': now - started,
+            })
+            return result
+        time.sleep(poll_interval)
+    result['outcome'] = 'timeout'
+    return result
+
+
+def run_round(base_url, uploads, requests_count, concurrency, poll_interval, timeout):
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda index: run_one(base_url, uploads[index % len(uploads)], poll_interval, timeout),
+            range(requests_count)
+        ))
+    wall = time.perf_counter() - started
+
+    outcomes = {}
+    for result in results:
+        outcomes[result['outcome']] = outcomes.get(result['outcome'], 0) + 1
+    completed = [result for result in results if result['outcome'] == 'completed']
+    return {
+        'requests': requests_count,
+        'wall_seconds': round(wall, 2),
+        'throughput_rps': round(len(completed) / wall, 3) if wall else 0.0,
+        'outcomes': outcomes,
+        # 阶段耗时只统计成功完成的比对
+        'stages': {stage: summarize_samples([r['stages'][stage] for r in completed]) for stage in STAGES},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def print_result(entry, baseline=None):
+    label = f"明星 {entry['catalogue_size']}，上传 {entry['upload_width']}px（{entry['upload_kb']}KB）"
+    print(f"\n{label}: 吞吐 {entry['throughput_rps']} 个/秒，结果 {entry['outcomes']}")
+    print(f"  {'阶段':<10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for stage in STAGES:
+        summary = entry['stages'][stage]
+        if not summary['count']:
+            continue
+        line = f"  {stage:<10}{summary['p50']:>10}{summary['p95']:>10}{summary['p99']:>10}{summary['max']:>10}"
+        previous = (baseline or {}).get('stages', {}).get(stage, {})
+        if previous.get('p95'):
+            change = (summary['p95'] - previous['p95']) / previous['p95']
+            line += f"   p95较基线 {change:+.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比对链路端到端压测")
+    parser.add_argument('--catalogue-sizes', type=str, default='100,1000,10000', help='明星库规模，逗号分隔')
+    parser.add_argument('--upload-sizes', type=str, default='640,1600', help='上传照片的宽度（像素），逗号分隔')
+    parser.add_argument('--requests', type=int, default=40, help='每种组合的上传次数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发上传数')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='状态轮询间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=120, help='单个比对的最长等待时间（秒）')
+    parser.add_argument('--latency-ms', type=float, default=20, help='模拟服务的典型延迟（毫秒）')
+    parser.add_argument('--latency-sigma', type=float, default=0.3, help='模拟服务延迟对数正态分布的sigma')
+    parser.add_argument('--tail-ratio', type=float, default=0.0, help='模拟服务落入长尾延迟的请求比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='模拟服务随机限流的比例')
+    parser.add_argument('--qps', type=float, default=0.0, help='模拟服务的QPS上限，0表示不限制')
+    parser.add_argument('--server-env', action='append', default=[], help='传给被测服务的环境变量，形如 KEY=VALUE，可重复')
+    parser.add_argument('--seed', type=int, default=42, help='随机数种子')
+    parser.add_argument('--output', type=str, default='', help='结果JSON路径，默认 benchmarks/loadtest/<时间>-<提交>.json')
+    parser.add_argument('--baseline', type=str, default='', help='用于比较的历史结果JSON')
+    parser.add_argument('--keep-workdir', action='store_true', help='保留临时数据库和媒体目录')
+    args = parser.parse_args()
+
+    catalogue_sizes = [int(size) for size in args.catalogue_sizes.split(',') if size.strip()]
+    upload_widths = [int(size) for size in args.upload_sizes.split(',') if size.strip()]
+    extra_env = dict(item.split('=', 1) for item in args.server_env)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            for entry in json.load(f)['results']:
+                baseline[(entry['catalogue_size'], entry['upload_width'])] = entry
+
+    config = EmulatorConfig(
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, tail_ratio=args.tail_ratio,
+        throttle_rate=args.throttle_rate, qps=args.qps, seed=args.seed
+    )
+    emulator_server, emulator = create_server('127.0.0.1', free_port(), config)
+    threading.Thread(target=emulator_server.serve_forever, daemon=True).start()
+    emulator_url = f'http://127.0.0.1:{emulator_server.server_address[1]}/facepp/v3'
+
+    uploads = {width: make_uploads(width, 8, args.seed + width) for width in upload_widths}
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'results': [],
+    }
+
+    for catalogue_size in catalogue_sizes:
+        workdir = tempfile.mkdtemp(prefix=f'loadtest-{catalogue_size}-')
+        server = AppServer(workdir, emulator_url, extra_env)
+        try:
+            print(f"准备 {catalogue_size} 个明星的数据库: {workdir}")
+            server.manage('migrate', '--noinput')
+            catalogue_path = os.path.join(workdir, 'celebrities.jsonl')
+            write_catalogue(catalogue_path, catalogue_size, emulator, args.seed)
+            server.manage('import_celebrities', catalogue_path, '--batch-size', '5000')
+            server.start()
+
+            for width in upload_widths:
+                result = run_round(
+                    server.base_url, uploads[width], args.requests, args.concurrency,
+                    args.poll_interval, args.timeout
+                )
+                entry = {
+                    'catalogue_size': catalogue_size,
+                    'upload_width': width,
+                    'upload_kb': round(sum(len(u) for u in uploads[width]) / len(uploads[width]) / 1024, 1),
+                    **result,
+                }
+                report['results'].append(entry)
+                print_result(entry, baseline.get((catalogue_size, width)))
+        finally:
+            server.stop()
+            if not args.keep_workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    emulator_server.shutdown()
+    report['emulator'] = emulator.stats()
+
+    output = args.output or os.path.join(
+        ROOT_DIR, 'benchmarks', 'loadtest', f"{datetime.now():%Y%m%d-%H%M%S}-{report['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {output}")
+
+
+if __name__ == '__main__':
+    main()